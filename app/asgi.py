@@ -12,6 +12,7 @@ from loguru import logger
 from app.config import config
 from app.models.exception import HttpException
 from app.router import root_api_router
+from app.services import bgm_library, events, transcriber
 from app.utils import utils
 
 
@@ -80,3 +81,9 @@ def shutdown_event():
 @app.on_event("startup")
 def startup_event():
     logger.info("startup event")
+    events.install_log_sink()
+    if config.whisper.get("preload", False):
+        logger.info("preloading whisper model")
+        transcriber.get_service().warm_up()
+    logger.info("indexing bgm library")
+    bgm_library.get_library().warm_up()
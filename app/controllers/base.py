@@ -1,3 +1,4 @@
+import hashlib
 from uuid import uuid4
 
 from fastapi import Request
@@ -18,6 +19,25 @@ def get_api_key(request: Request):
     return api_key
 
 
+def get_task_priority(request: Request):
+    # high, normal (default) or low
+    return request.headers.get("x-task-priority", "")
+
+
+def get_client_id(request: Request):
+    """
+    The client the tasks of the request are accounted to, for the fair share. The id
+    is stored with the queued tasks and the batches, an API key is only kept as a
+    short hash.
+    """
+    api_key = get_api_key(request)
+    if api_key:
+        return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    if request.client:
+        return request.client.host
+    return ""
+
+
 def verify_token(request: Request):
     token = get_api_key(request)
     if token != config.app.get("api_key", ""):
@@ -1,64 +1,124 @@
 import threading
 from typing import Any, Callable, Dict
 
+from app.controllers.manager import scheduler
+from app.controllers.manager.executor import create_executor
+
 
 class TaskManager:
-    def __init__(self, max_concurrent_tasks: int):
+    def __init__(
+        self, max_concurrent_tasks: int, executor=None, max_light_tasks: int = 0
+    ):
         self.max_concurrent_tasks = max_concurrent_tasks
+        # concurrent tasks of each pool, the light tasks (script, audio, subtitle)
+        # have their own slots and do not wait for the renders
+        self.pool_sizes = {
+            scheduler.POOL_HEAVY: max_concurrent_tasks,
+            scheduler.POOL_LIGHT: max_light_tasks or max_concurrent_tasks,
+        }
+        self.running = {pool: 0 for pool in self.pool_sizes}
         self.current_tasks = 0
         self.lock = threading.Lock()
         self.queue = self.create_queue()
+        # runs the tasks on threads or in worker processes, see app.task_executor
+        self.executor = executor or self.new_executor()
+
+    def new_executor(self):
+        """The executor of the tasks of this process, None if they run elsewhere."""
+        return create_executor(sum(self.pool_sizes.values()))
 
     def create_queue(self):
         raise NotImplementedError()
 
-    def add_task(self, func: Callable, *args: Any, **kwargs: Any):
+    def add_task(self, func: Callable, *args: Any, schedule: Dict = None, **kwargs: Any):
+        """
+        Runs the task if its pool has a free slot, otherwise queues it.
+        `schedule` is the priority, client, cost and pool of the task, see
+        scheduler.new_schedule().
+        """
+        task = {
+            "func": func,
+            "args": args,
+            "kwargs": kwargs,
+            "schedule": schedule or scheduler.new_schedule(),
+        }
+        pool = task["schedule"]["pool"]
         with self.lock:
-            if self.current_tasks < self.max_concurrent_tasks:
-                print(f"add task: {func.__name__}, current_tasks: {self.current_tasks}")
-                self.execute_task(func, *args, **kwargs)
+            if self.running[pool] < self.pool_sizes[pool]:
+                print(f"add task: {func.__name__}, {pool} tasks: {self.running[pool]}")
+                self.execute_task(task)
             else:
-                print(
-                    f"enqueue task: {func.__name__}, current_tasks: {self.current_tasks}"
-                )
-                self.enqueue({"func": func, "args": args, "kwargs": kwargs})
-
-    def execute_task(self, func: Callable, *args: Any, **kwargs: Any):
-        thread = threading.Thread(
-            target=self.run_task, args=(func, *args), kwargs=kwargs
-        )
-        thread.start()
-
-    def run_task(self, func: Callable, *args: Any, **kwargs: Any):
+                print(f"enqueue task: {func.__name__}, {pool} tasks: {self.running[pool]}")
+                self.enqueue(task)
+
+    def execute_task(self, task_info: Dict, from_queue: bool = False):
+        # called with self.lock held, the slot is taken before the task starts so
+        # tasks added meanwhile cannot exceed the size of the pool
+        pool = scheduler.schedule_of(task_info)["pool"]
+        self.running[pool] += 1
+        self.current_tasks += 1
+
+        def callback():
+            try:
+                if from_queue:
+                    self.acknowledge(task_info)
+            finally:
+                self.task_done(pool)
+
         try:
-            with self.lock:
-                self.current_tasks += 1
-            func(*args, **kwargs)  # call the function here, passing *args and **kwargs.
-        finally:
-            self.task_done()
+            self.executor.submit(
+                task_info["func"],
+                task_info.get("args", ()),
+                task_info.get("kwargs", {}),
+                callback=callback,
+            )
+        except Exception:
+            self.running[pool] -= 1
+            self.current_tasks -= 1
+            raise
 
     def check_queue(self):
         with self.lock:
-            if (
-                self.current_tasks < self.max_concurrent_tasks
-                and not self.is_queue_empty()
-            ):
-                task_info = self.dequeue()
-                func = task_info["func"]
-                args = task_info.get("args", ())
-                kwargs = task_info.get("kwargs", {})
-                self.execute_task(func, *args, **kwargs)
-
-    def task_done(self):
+            for pool, size in self.pool_sizes.items():
+                while self.running[pool] < size and not self.is_queue_empty(pool):
+                    task_info = self.dequeue(pool)
+                    if task_info is None:
+                        # taken by another consumer meanwhile
+                        break
+                    self.execute_task(task_info, from_queue=True)
+
+    def task_done(self, pool: str = scheduler.POOL_HEAVY):
         with self.lock:
+            self.running[pool] -= 1
             self.current_tasks -= 1
         self.check_queue()
 
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancels a queued or running task of this process, the slot of a running task
+        is released right away so the next queued task starts. Returns False if the
+        task is neither queued nor running here.
+        """
+        with self.lock:
+            if self.remove(task_id):
+                return True
+        if self.executor is None:
+            return False
+        return self.executor.cancel(task_id)
+
+    def acknowledge(self, task_info: Dict):
+        """Called when a task taken from the queue is done, for queues that track them."""
+        pass
+
     def enqueue(self, task: Dict):
         raise NotImplementedError()
 
-    def dequeue(self):
+    def dequeue(self, pool: str):
+        raise NotImplementedError()
+
+    def remove(self, task_id: str) -> bool:
+        """Removes a queued task, returns False if it is not queued."""
         raise NotImplementedError()
 
-    def is_queue_empty(self):
+    def is_queue_empty(self, pool: str):
         raise NotImplementedError()
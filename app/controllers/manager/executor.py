@@ -0,0 +1,420 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from app.config import config
+from app.models import const
+from app.services import cancellation
+from app.services import events as task_events
+
+# seconds a cancelled task has to stop before its worker process is killed
+_CANCEL_GRACE_PERIOD = 30
+
+
+def _once(callback: Callable) -> Callable:
+    lock = threading.Lock()
+    called = []
+
+    def call():
+        with lock:
+            if called:
+                return
+            called.append(True)
+        callback()
+
+    return call
+
+
+class ThreadExecutor:
+    """Runs every task on its own thread of the API process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # task id => completion callback of the running tasks
+        self._running: Dict[str, Callable] = {}
+
+    def submit(self, func: Callable, args: Tuple, kwargs: Dict, callback: Callable):
+        task_id = kwargs.get("task_id", "")
+        done = _once(callback)
+        if task_id:
+            # created here, so the task can be cancelled before it starts; the task
+            # takes this token
+            cancellation.token(task_id)
+            with self._lock:
+                self._running[task_id] = done
+
+        def run():
+            try:
+                func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    if self._running.get(task_id) is done:
+                        del self._running[task_id]
+                if task_id:
+                    cancellation.release(task_id)
+                done()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancels a running task: its token is cancelled, which kills its processes,
+        and its slot is released at once while the thread winds down.
+        """
+        with self._lock:
+            done = self._running.pop(task_id, None)
+        if done is None:
+            return False
+        # a task that finished meanwhile has released its token, none is left behind
+        cancellation.cancel(task_id)
+        done()
+        return True
+
+    def shutdown(self):
+        pass
+
+
+class _ForwardingState:
+    """
+    Stands in for sm.state inside a worker process: the task updates are sent to the
+    API process, which applies them to its own state (the in-memory state of a
+    worker process would not be visible to the API).
+    """
+
+    def __init__(self, events):
+        self._events = events
+        # key of the task running in the worker, the API drops the updates of a
+        # task it has finished (cancelled)
+        self.key = None
+
+    def update_task(self, task_id: str, *args, **kwargs):
+        self._events.put(("state", self.key, "update_task", task_id, args, kwargs))
+
+    def update_running_task(self, task_id: str, *args, **kwargs):
+        self._events.put(
+            ("state", self.key, "update_running_task", task_id, args, kwargs)
+        )
+
+    def get_task(self, task_id: str):
+        # the state is kept by the API process
+        return None
+
+
+class _ForwardingEventBus:
+    """Stands in for the event bus inside a worker process, like _ForwardingState."""
+
+    def __init__(self, events):
+        self._events = events
+
+    def watched(self, task_id: str) -> bool:
+        # decided by the API process, see ProcessExecutor._handle_event
+        return True
+
+    def publish(self, event: Dict):
+        self._events.put(("event", event))
+
+
+def _listen_cancellations(cancels, running: list, lock: threading.Lock):
+    # cancels the task of the worker through its token, so it stops at its next
+    # check() and the worker is not killed in the middle of a write to the queues
+    while True:
+        key = cancels.get()
+        if key is None:
+            break
+        with lock:
+            if running[0] == key and running[1]:
+                cancellation.cancel(running[1])
+
+
+def _worker_main(tasks, events, cancels, max_tasks: int, max_memory_mb: int):
+    from app.services import state as sm
+
+    state = _ForwardingState(events)
+    sm.state = state
+    task_events.set_bus(_ForwardingEventBus(events))
+    task_events.install_log_sink()
+    # key and task id of the running task
+    running = [None, ""]
+    lock = threading.Lock()
+    threading.Thread(
+        target=_listen_cancellations, args=(cancels, running, lock), daemon=True
+    ).start()
+    pid = os.getpid()
+    completed = 0
+    while True:
+        item = tasks.get()
+        if item is None:
+            break
+
+        key, func, args, kwargs = item
+        task_id = kwargs.get("task_id", "")
+        with lock:
+            if task_id:
+                # the task takes this token, it can be cancelled before it starts
+                cancellation.token(task_id)
+            running[:] = [key, task_id]
+        state.key = key
+        events.put(("start", key, pid))
+        error = ""
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            error = traceback.format_exc()
+        with lock:
+            running[:] = [None, ""]
+            if task_id:
+                cancellation.release(task_id)
+        events.put(("done", key, error))
+        completed += 1
+
+        if max_tasks and completed >= max_tasks:
+            events.put(("exit", pid, f"completed {completed} tasks"))
+            break
+        if max_memory_mb:
+            import psutil
+
+            rss_mb = psutil.Process(pid).memory_info().rss / 1024 / 1024
+            if rss_mb > max_memory_mb:
+                events.put(("exit", pid, f"memory usage {rss_mb:.0f} MB"))
+                break
+
+
+class ProcessExecutor:
+    """
+    Runs the tasks in a pool of worker processes, so concurrent renders do not share
+    one interpreter (and its GIL), and a crashing render cannot take the API down.
+
+    A worker is replaced after `max_tasks_per_child` tasks, or once its memory usage
+    is above `max_memory_mb` after a task. A worker that dies while running a task
+    fails that task and is replaced as well. The task state updates of the workers
+    are applied to the state of the API process by the supervisor thread.
+
+    A cancelled task is cancelled through its token in the worker, the worker is
+    killed only if the task is still running after `_CANCEL_GRACE_PERIOD` seconds.
+    """
+
+    def __init__(self, max_workers: int, max_tasks_per_child: int = 0, max_memory_mb: int = 0):
+        self.max_workers = max(1, int(max_workers))
+        self.max_tasks_per_child = max(0, int(max_tasks_per_child))
+        self.max_memory_mb = max(0, int(max_memory_mb))
+
+        # spawn: the workers must not inherit the threads and sockets of the API process
+        self._ctx = multiprocessing.get_context("spawn")
+        self._tasks = self._ctx.Queue()
+        self._events = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._workers: Dict[int, Any] = {}
+        # pid => queue of the keys of the tasks to cancel in that worker
+        self._cancels: Dict[int, Any] = {}
+        # task key => (task_id, callback, pid of the worker running it)
+        self._running: Dict[int, list] = {}
+        self._next_key = 0
+        # keys of the tasks cancelled before a worker took them
+        self._cancelled = set()
+        # key of a cancelled task still running => (pid of its worker, kill deadline)
+        self._cancelling: Dict[int, Tuple[int, float]] = {}
+        self._stopped = False
+
+        for _ in range(self.max_workers):
+            self._start_worker()
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+
+    def _start_worker(self):
+        cancels = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                self._tasks,
+                self._events,
+                cancels,
+                self.max_tasks_per_child,
+                self.max_memory_mb,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self._workers[process.pid] = process
+        self._cancels[process.pid] = cancels
+        logger.info(f"task worker started, pid: {process.pid}")
+
+    def submit(self, func: Callable, args: Tuple, kwargs: Dict, callback: Callable):
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._running[key] = [kwargs.get("task_id", ""), callback, None]
+        self._tasks.put((key, func, args, kwargs))
+
+    def _finish(self, key: int, error: str = "", failed: bool = False):
+        with self._lock:
+            entry = self._running.pop(key, None)
+        if entry is None:
+            return
+        task_id, callback, _ = entry
+        if error:
+            logger.error(f"task {task_id} failed in worker process: {error}")
+        if failed and task_id:
+            from app.services import state as sm
+
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"task callback error: {e}")
+
+    def _handle_event(self, event):
+        kind = event[0]
+        if kind == "state":
+            from app.services import state as sm
+
+            _, key, method, task_id, args, kwargs = event
+            with self._lock:
+                finished = key not in self._running
+            if finished:
+                # sent by a task that was cancelled meanwhile
+                return
+            if method == "update_running_task":
+                sm.state.update_running_task(task_id, *args, **kwargs)
+            else:
+                sm.state.update_task(task_id, *args, **kwargs)
+        elif kind == "event":
+            bus = task_events.get_bus()
+            if event[1].get("type") != task_events.EVENT_LOG or bus.watched(
+                event[1].get("task_id", "")
+            ):
+                bus.publish(event[1])
+        elif kind == "start":
+            _, key, pid = event
+            with self._lock:
+                if key in self._running:
+                    self._running[key][2] = pid
+                cancelled = key in self._cancelled
+                self._cancelled.discard(key)
+                if cancelled:
+                    self._cancelling[key] = self._kill_deadline(pid)
+            if cancelled:
+                # the worker took a task that was cancelled while queued
+                self._send_cancel(key, pid)
+        elif kind == "done":
+            _, key, error = event
+            self._finish(key, error)
+            with self._lock:
+                self._cancelling.pop(key, None)
+        elif kind == "exit":
+            _, pid, reason = event
+            logger.info(f"task worker {pid} recycled: {reason}")
+            process = self._workers.pop(pid, None)
+            self._cancels.pop(pid, None)
+            if process is not None:
+                process.join(timeout=10)
+                if not self._stopped:
+                    self._start_worker()
+
+    def _reap_dead_workers(self):
+        for pid, process in list(self._workers.items()):
+            # a recycled worker exits with 0, it is replaced by its "exit" event
+            if process.is_alive() or process.exitcode == 0:
+                continue
+            self._workers.pop(pid, None)
+            self._cancels.pop(pid, None)
+            logger.error(f"task worker {pid} died, exit code: {process.exitcode}")
+            with self._lock:
+                keys = [k for k, v in self._running.items() if v[2] == pid]
+                for key in [k for k, v in self._cancelling.items() if v[0] == pid]:
+                    del self._cancelling[key]
+            for key in keys:
+                # a task finished (or cancelled) meanwhile is left alone
+                self._finish(key, f"worker process {pid} died", failed=True)
+            if not self._stopped:
+                self._start_worker()
+
+    @staticmethod
+    def _kill_deadline(pid: int) -> Tuple[int, float]:
+        return pid, time.monotonic() + _CANCEL_GRACE_PERIOD
+
+    def _send_cancel(self, key: int, pid: int):
+        cancels = self._cancels.get(pid)
+        if cancels is not None:
+            cancels.put(key)
+
+    def _kill_stuck_workers(self):
+        now = time.monotonic()
+        with self._lock:
+            stuck = [(k, v[0]) for k, v in self._cancelling.items() if v[1] <= now]
+            for key, _ in stuck:
+                del self._cancelling[key]
+        for key, pid in stuck:
+            # the worker is replaced once it is reaped
+            logger.warning(f"stopping worker {pid}, its cancelled task did not stop")
+            cancellation.kill_process_tree(pid)
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancels a task through its token in the worker process that runs it, and
+        releases the slot of the task at once; the updates the task sends afterwards
+        are dropped. A task that does not stop in time is killed with its worker.
+        """
+        with self._lock:
+            keys = [k for k, v in self._running.items() if v[0] == task_id]
+            if not keys:
+                return False
+            key = keys[0]
+            pid = self._running[key][2]
+            if pid is None:
+                self._cancelled.add(key)
+            else:
+                self._cancelling[key] = self._kill_deadline(pid)
+        if pid is not None:
+            logger.info(f"cancelling task {task_id} in worker {pid}")
+            self._send_cancel(key, pid)
+        self._finish(key)
+        return True
+
+    def _supervise(self):
+        last_check = time.monotonic()
+        while not self._stopped:
+            try:
+                if time.monotonic() - last_check >= 1:
+                    self._kill_stuck_workers()
+                    self._reap_dead_workers()
+                    last_check = time.monotonic()
+            except Exception as e:
+                logger.error(f"task supervisor error: {e}")
+            try:
+                event = self._events.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            try:
+                self._handle_event(event)
+            except Exception as e:
+                logger.error(f"task supervisor error: {e}")
+
+    def shutdown(self):
+        self._stopped = True
+        for _ in self._workers:
+            self._tasks.put(None)
+        for cancels in list(self._cancels.values()):
+            cancels.put(None)
+        for process in list(self._workers.values()):
+            process.join(timeout=10)
+
+
+def create_executor(max_workers: int, kind: Optional[str] = None):
+    """Creates the executor selected by app.task_executor: "thread" (default) or "process"."""
+    kind = kind or config.app.get("task_executor", "thread")
+    if kind == "process":
+        return ProcessExecutor(
+            max_workers=max_workers,
+            max_tasks_per_child=config.app.get("task_worker_max_tasks", 10),
+            max_memory_mb=config.app.get("task_worker_max_memory_mb", 0),
+        )
+    return ThreadExecutor()
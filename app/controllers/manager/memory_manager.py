@@ -1,18 +1,21 @@
-from queue import Queue
 from typing import Dict
 
 from app.controllers.manager.base_manager import TaskManager
+from app.controllers.manager.scheduler import FairQueue
 
 
 class InMemoryTaskManager(TaskManager):
     def create_queue(self):
-        return Queue()
+        return FairQueue()
 
     def enqueue(self, task: Dict):
         self.queue.put(task)
 
-    def dequeue(self):
-        return self.queue.get()
+    def dequeue(self, pool: str):
+        return self.queue.get(pool)
 
-    def is_queue_empty(self):
-        return self.queue.empty()
+    def remove(self, task_id: str) -> bool:
+        return self.queue.remove(lambda task: task["kwargs"].get("task_id") == task_id)
+
+    def is_queue_empty(self, pool: str):
+        return self.queue.empty(pool)
@@ -1,11 +1,18 @@
 import json
-from typing import Dict
+import threading
+import time
+from typing import Dict, Optional, Tuple
 
 import redis
+from loguru import logger
+from pydantic import BaseModel
 
+from app.config import config
+from app.controllers.manager import scheduler
 from app.controllers.manager.base_manager import TaskManager
-from app.models.schema import VideoParams
+from app.models import schema
 from app.services import task as tm
+from app.utils import utils
 
 FUNC_MAP = {
     "start": tm.start,
@@ -13,44 +20,258 @@ FUNC_MAP = {
 }
 
 
+def get_redis_url():
+    host = config.app.get("redis_host", "localhost")
+    port = config.app.get("redis_port", 6379)
+    db = config.app.get("redis_db", 0)
+    password = config.app.get("redis_password", None)
+    return f"redis://:{password}@{host}:{port}/{db}"
+
+
+def serialize_task(task: Dict) -> Dict:
+    task_with_serializable_params = task.copy()
+    task_with_serializable_params["kwargs"] = dict(task.get("kwargs", {}))
+
+    # the params (VideoParams, AudioRequest, SubtitleRequest...) are stored as a dict
+    # and the name of their model, which rebuilds them on the worker
+    params = task["kwargs"].get("params")
+    if isinstance(params, BaseModel):
+        task_with_serializable_params["kwargs"]["params"] = params.model_dump(mode="json")
+        task_with_serializable_params["params_model"] = type(params).__name__
+
+    # 将函数对象转换为其名称
+    task_with_serializable_params["func"] = task["func"].__name__
+    return task_with_serializable_params
+
+
+def deserialize_task(task_info: Dict) -> Dict:
+    # 将函数名称转换回函数对象
+    task_info["func"] = FUNC_MAP[task_info["func"]]
+
+    if "params" in task_info["kwargs"] and isinstance(task_info["kwargs"]["params"], dict):
+        # the tasks queued by a previous version are video tasks
+        model_name = task_info.pop("params_model", "VideoParams")
+        model = getattr(schema, model_name, None)
+        if not (isinstance(model, type) and issubclass(model, BaseModel)):
+            raise ValueError(f"unknown task params model: {model_name}")
+        task_info["kwargs"]["params"] = model(**task_info["kwargs"]["params"])
+    return task_info
+
+
+# Moves an expired item from the processing list back to the queue, only if it is
+# still in the processing list (another process may have acknowledged or requeued it)
+_REQUEUE_SCRIPT = """
+local removed = redis.call('LREM', KEYS[2], 1, ARGV[1])
+if removed > 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+    redis.call('HINCRBY', KEYS[4], ARGV[2], 1)
+end
+redis.call('ZREM', KEYS[3], ARGV[1])
+return removed
+"""
+
+
+class ReliableQueue:
+    """
+    A Redis list with acknowledgments.
+
+    An item is atomically moved from the queue to a processing list when it is taken
+    (LMOVE/BLMOVE) and gets a lease (a sorted set scored by its deadline). The owner
+    extends the lease while the task runs and removes the item when the task is done.
+    The item of a process that died stops being extended; once its lease expires,
+    requeue_expired() puts it back in the queue for another consumer. The requeues
+    of every item are counted, see attempts().
+    """
+
+    def __init__(self, client: redis.Redis, name: str, visibility_timeout: int = 300):
+        self.client = client
+        self.name = name
+        self.processing = f"{name}:processing"
+        self.leases = f"{name}:leases"
+        self.attempts_key = f"{name}:attempts"
+        self.visibility_timeout = max(10, int(visibility_timeout))
+
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._heartbeat = None
+        self._requeue = self.client.register_script(_REQUEUE_SCRIPT)
+
+    def push(self, data: Dict):
+        data = dict(data)
+        data.setdefault("queue_id", utils.get_uuid(True))
+        self.client.rpush(self.name, json.dumps(data))
+
+    def pop(self, timeout: int = 0) -> Optional[Tuple[str, Dict]]:
+        """Takes the next item, waiting up to `timeout` seconds when timeout > 0."""
+        if timeout > 0:
+            payload = self.client.blmove(self.name, self.processing, timeout, "LEFT", "RIGHT")
+        else:
+            payload = self.client.lmove(self.name, self.processing, "LEFT", "RIGHT")
+        if payload is None:
+            return None
+
+        self.client.zadd(self.leases, {payload: time.time() + self.visibility_timeout})
+        with self._held_lock:
+            self._held.add(payload)
+        self._start_heartbeat()
+        return payload, json.loads(payload)
+
+    def ack(self, payload):
+        with self._held_lock:
+            self._held.discard(payload)
+        data = json.loads(payload)
+        pipe = self.client.pipeline()
+        pipe.lrem(self.processing, 1, payload)
+        pipe.zrem(self.leases, payload)
+        pipe.hdel(self.attempts_key, data.get("queue_id", ""))
+        pipe.execute()
+
+    def attempts(self, data: Dict) -> int:
+        """How many times the item was requeued after its consumer died."""
+        value = self.client.hget(self.attempts_key, data.get("queue_id", ""))
+        return int(value) if value else 0
+
+    def _start_heartbeat(self):
+        if self._heartbeat is not None and self._heartbeat.is_alive():
+            return
+        self._heartbeat = threading.Thread(target=self._extend_leases, daemon=True)
+        self._heartbeat.start()
+
+    def _extend_leases(self):
+        while True:
+            time.sleep(self.visibility_timeout / 3)
+            with self._held_lock:
+                held = list(self._held)
+            if not held:
+                continue
+            deadline = time.time() + self.visibility_timeout
+            try:
+                # XX: only extend the leases that were not requeued meanwhile
+                self.client.zadd(self.leases, {p: deadline for p in held}, xx=True)
+            except Exception as e:
+                logger.error(f"failed to extend task leases: {e}")
+
+    def requeue_expired(self) -> int:
+        now = time.time()
+        # an item taken by a process that died before it could write the lease
+        for payload in self.client.lrange(self.processing, 0, -1):
+            self.client.zadd(self.leases, {payload: now + self.visibility_timeout}, nx=True)
+
+        requeued = 0
+        for payload in self.client.zrangebyscore(self.leases, "-inf", now):
+            queue_id = json.loads(payload).get("queue_id", "")
+            keys = [self.name, self.processing, self.leases, self.attempts_key]
+            if self._requeue(keys=keys, args=[payload, queue_id]):
+                requeued += 1
+                logger.warning(f"task lease expired, requeued: {queue_id}")
+        return requeued
+
+    def remove(self, predicate) -> int:
+        """Removes the queued items matching the predicate, returns how many were removed."""
+        removed = 0
+        for payload in self.client.lrange(self.name, 0, -1):
+            if predicate(json.loads(payload)):
+                removed += self.client.lrem(self.name, 1, payload)
+        return removed
+
+    def __len__(self):
+        return self.client.llen(self.name)
+
+
+def queue_name(pool: str, priority: str) -> str:
+    # the normal renders keep the name of the former single queue
+    if (pool, priority) == (scheduler.POOL_HEAVY, scheduler.PRIORITY_NORMAL):
+        return "task_queue"
+    return f"task_queue:{pool}:{priority}"
+
+
+def task_queues(client: redis.Redis, visibility_timeout: int) -> Dict[tuple, ReliableQueue]:
+    """The queue of every (pool, priority) class, in the order they are served."""
+    return {
+        (pool, priority): ReliableQueue(
+            client, queue_name(pool, priority), visibility_timeout=visibility_timeout
+        )
+        for priority in scheduler.PRIORITIES
+        for pool in scheduler.POOLS
+    }
+
+
 class RedisTaskManager(TaskManager):
-    def __init__(self, max_concurrent_tasks: int, redis_url: str):
+    """
+    Queues the tasks in Redis, in one reliable queue per pool and priority class.
+    The classes are served by priority; unlike the in-memory queue there is no
+    fair share between the clients within a class.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_tasks: int,
+        redis_url: str,
+        executor=None,
+        max_light_tasks: int = 0,
+    ):
         self.redis_client = redis.Redis.from_url(redis_url)
-        super().__init__(max_concurrent_tasks)
+        self.reliable_queues = task_queues(
+            self.redis_client, config.app.get("redis_task_visibility_timeout", 300)
+        )
+        # the tasks are only queued here and run by standalone workers (worker.py)
+        self.queue_only = config.app.get("enable_redis_workers", False)
+        super().__init__(
+            max_concurrent_tasks, executor=executor, max_light_tasks=max_light_tasks
+        )
 
     def create_queue(self):
         return "task_queue"
 
+    def new_executor(self):
+        # the standalone workers run the tasks, there is nothing to run here
+        if self.queue_only:
+            return None
+        return super().new_executor()
+
+    def add_task(self, func, *args, schedule: Dict = None, **kwargs):
+        if self.queue_only:
+            logger.info(f"enqueue task for the workers: {func.__name__}")
+            self.enqueue(
+                {
+                    "func": func,
+                    "args": args,
+                    "kwargs": kwargs,
+                    "schedule": schedule or scheduler.new_schedule(),
+                }
+            )
+            return
+        super().add_task(func, *args, schedule=schedule, **kwargs)
+
     def enqueue(self, task: Dict):
-        task_with_serializable_params = task.copy()
-
-        if "params" in task["kwargs"] and isinstance(
-            task["kwargs"]["params"], VideoParams
-        ):
-            task_with_serializable_params["kwargs"]["params"] = task["kwargs"][
-                "params"
-            ].dict()
-
-        # 将函数对象转换为其名称
-        task_with_serializable_params["func"] = task["func"].__name__
-        self.redis_client.rpush(self.queue, json.dumps(task_with_serializable_params))
-
-    def dequeue(self):
-        task_json = self.redis_client.lpop(self.queue)
-        if task_json:
-            task_info = json.loads(task_json)
-            # 将函数名称转换回函数对象
-            task_info["func"] = FUNC_MAP[task_info["func"]]
-
-            if "params" in task_info["kwargs"] and isinstance(
-                task_info["kwargs"]["params"], dict
-            ):
-                task_info["kwargs"]["params"] = VideoParams(
-                    **task_info["kwargs"]["params"]
-                )
+        schedule = scheduler.schedule_of(task)
+        queue = self.reliable_queues[(schedule["pool"], schedule["priority"])]
+        queue.push(serialize_task(task))
 
+    def dequeue(self, pool: str):
+        for priority in scheduler.PRIORITIES:
+            queue = self.reliable_queues[(pool, priority)]
+            item = queue.pop()
+            if item is None:
+                continue
+            payload, task_info = item
+            task_info = deserialize_task(task_info)
+            task_info["payload"] = payload
+            task_info["queue"] = queue
             return task_info
         return None
 
-    def is_queue_empty(self):
-        return self.redis_client.llen(self.queue) == 0
+    def acknowledge(self, task_info: Dict):
+        task_info["queue"].ack(task_info["payload"])
+
+    def remove(self, task_id: str) -> bool:
+        def matches(data):
+            return data.get("kwargs", {}).get("task_id") == task_id
+
+        return any(queue.remove(matches) for queue in self.reliable_queues.values())
+
+    def is_queue_empty(self, pool: str):
+        return all(
+            len(self.reliable_queues[(pool, priority)]) == 0
+            for priority in scheduler.PRIORITIES
+        )
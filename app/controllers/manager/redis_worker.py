@@ -0,0 +1,145 @@
+import signal
+import threading
+import time
+
+import redis
+from loguru import logger
+
+from app.config import config
+from app.controllers.manager.redis_manager import (
+    deserialize_task,
+    get_redis_url,
+    task_queues,
+)
+from app.models import const
+from app.services import cancellation, events
+from app.services import state as sm
+
+# seconds between the checks of the running tasks for a cancellation
+_CANCEL_POLL_INTERVAL = 2
+
+
+class RedisWorker:
+    """
+    Standalone consumer of the Redis task queue (see worker.py).
+
+    Every consumer thread takes the next task of the queues by priority (light tasks
+    first within a priority), runs one task at a time and acknowledges it when it
+    is done. The worker also requeues the tasks whose lease
+    expired, i.e. the tasks of workers that died; a task requeued more than
+    `max_attempts` times is marked as failed instead of being run again.
+    """
+
+    def __init__(self, redis_url: str = "", concurrency: int = 1, max_attempts: int = 3):
+        self.client = redis.Redis.from_url(redis_url or get_redis_url())
+        self.visibility_timeout = config.app.get("redis_task_visibility_timeout", 300)
+        self.queues = list(task_queues(self.client, self.visibility_timeout).values())
+        self.concurrency = max(1, int(concurrency))
+        self.max_attempts = max(1, int(max_attempts))
+        self._stopped = threading.Event()
+        # ids of the tasks running on this worker
+        self._running = set()
+        self._running_lock = threading.Lock()
+
+    def stop(self, *args):
+        if not self._stopped.is_set():
+            logger.info("stopping worker, waiting for the running tasks to finish")
+            self._stopped.set()
+
+    def _run_task(self, queue, data):
+        task_id = data.get("kwargs", {}).get("task_id", "")
+        try:
+            task_info = deserialize_task(data)
+        except Exception as e:
+            # e.g. queued by another version, it is acknowledged and not retried
+            logger.error(f"invalid task {task_id}: {e}")
+            if task_id:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
+        kwargs = task_info.get("kwargs", {})
+        attempts = queue.attempts(data)
+        if attempts >= self.max_attempts:
+            logger.error(f"task {task_id} was interrupted {attempts} times, giving up")
+            if task_id:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
+
+        logger.info(f"running task {task_id}, attempt {attempts + 1}")
+        with self._running_lock:
+            self._running.add(task_id)
+        try:
+            task_info["func"](*task_info.get("args", ()), **kwargs)
+        except Exception as e:
+            logger.error(f"task {task_id} failed: {e}")
+        finally:
+            with self._running_lock:
+                self._running.discard(task_id)
+
+    def _watch_cancellations(self):
+        # the API marks a cancelled task in the state (or deletes it), the task is
+        # cancelled here through its token
+        while not self._stopped.wait(_CANCEL_POLL_INTERVAL):
+            with self._running_lock:
+                task_ids = list(self._running)
+            for task_id in task_ids:
+                try:
+                    task = sm.state.get_task(task_id)
+                except Exception as e:
+                    logger.error(f"failed to check task {task_id}: {e}")
+                    continue
+                if task is None or task.get("state") == const.TASK_STATE_CANCELLED:
+                    # only a token of a running task, a finished one has released it
+                    cancellation.cancel(task_id)
+
+    def _pop(self):
+        for queue in self.queues:
+            item = queue.pop()
+            if item is not None:
+                return queue, item
+        return None, None
+
+    def _consume(self):
+        while not self._stopped.is_set():
+            try:
+                queue, item = self._pop()
+            except redis.RedisError as e:
+                logger.error(f"failed to take a task: {e}")
+                time.sleep(5)
+                continue
+            if item is None:
+                self._stopped.wait(1)
+                continue
+
+            payload, data = item
+            try:
+                self._run_task(queue, data)
+            finally:
+                queue.ack(payload)
+
+    def run(self):
+        if not config.app.get("enable_redis", False):
+            raise ValueError("the worker needs the redis state, set app.enable_redis = true")
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        logger.info(f"worker started, concurrency: {self.concurrency}")
+        events.install_log_sink()
+        threads = [
+            threading.Thread(target=self._consume, daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        threads.append(threading.Thread(target=self._watch_cancellations, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        while not self._stopped.wait(self.visibility_timeout / 3):
+            try:
+                for queue in self.queues:
+                    queue.requeue_expired()
+            except redis.RedisError as e:
+                logger.error(f"failed to requeue expired tasks: {e}")
+
+        for thread in threads:
+            thread.join()
+        logger.info("worker stopped")
@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import threading
+from typing import Callable, Dict, Optional
+
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+# in the order they are served, a class is only served when the classes before it are empty
+PRIORITIES = [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW]
+
+# Tasks that stop before the materials (script, terms, audio, subtitle) run in their own
+# pool, so they do not wait for the renders
+POOL_LIGHT = "light"
+POOL_HEAVY = "heavy"
+POOLS = [POOL_LIGHT, POOL_HEAVY]
+LIGHT_STAGES = ["script", "terms", "audio", "subtitle"]
+
+# rough seconds of work of each stage, only their ratios matter
+_STAGE_COSTS = {"script": 5, "terms": 5, "audio": 10, "subtitle": 20, "materials": 30}
+_RENDER_COST = 90
+
+
+def estimate_cost(stop_at: str, params=None) -> float:
+    """Estimates the work of a task from the stage it stops at and its params."""
+    video_count = max(1, getattr(params, "video_count", 1) or 1)
+    clip_duration = max(1, getattr(params, "video_clip_duration", 5) or 5)
+
+    cost = 0.0
+    for stage, stage_cost in _STAGE_COSTS.items():
+        # the materials are downloaded for every video
+        cost += stage_cost * video_count if stage == "materials" else stage_cost
+        if stage == stop_at:
+            return cost
+
+    # shorter clips mean more cuts and transitions per second of video
+    return cost + video_count * _RENDER_COST * (0.5 + 2.5 / clip_duration)
+
+
+def new_schedule(
+    stop_at: str = "video", params=None, priority: str = "", client: str = ""
+) -> Dict:
+    """
+    The scheduling info of a task: its priority class, the client it is accounted to,
+    its estimated cost and its pool. Raises ValueError for an unknown priority.
+    """
+    priority = (priority or PRIORITY_NORMAL).strip().lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"invalid priority: {priority}, expected one of {PRIORITIES}")
+    return {
+        "priority": priority,
+        "client": client or "",
+        "cost": estimate_cost(stop_at, params),
+        "pool": POOL_LIGHT if stop_at in LIGHT_STAGES else POOL_HEAVY,
+    }
+
+
+def schedule_of(task: Dict) -> Dict:
+    return task.get("schedule") or new_schedule()
+
+
+class FairQueue:
+    """
+    Queue of the tasks of every pool, served by priority class and, within a class,
+    by start-time fair queuing between the clients.
+
+    Every task gets a start tag: the virtual time of its pool, or the finish tag of
+    the previous task of the same client if that is later, and the finish tag of the
+    client moves on by the estimated cost of the task. The task with the smallest
+    start tag is served first, so a client that queued many expensive tasks does not
+    delay the tasks of the other clients by more than one of its own tasks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heaps = {(pool, p): [] for pool in POOLS for p in PRIORITIES}
+        self._virtual_time = {pool: 0.0 for pool in POOLS}
+        self._finish_tags: Dict[tuple, float] = {}
+        self._counter = itertools.count()
+
+    def put(self, task: Dict):
+        schedule = schedule_of(task)
+        pool = schedule["pool"]
+        client_key = (pool, schedule["priority"], schedule["client"])
+        with self._lock:
+            start = max(self._virtual_time[pool], self._finish_tags.get(client_key, 0.0))
+            self._finish_tags[client_key] = start + schedule["cost"]
+            heap = self._heaps[(pool, schedule["priority"])]
+            heapq.heappush(heap, (start, next(self._counter), task))
+
+    def get(self, pool: str) -> Optional[Dict]:
+        with self._lock:
+            for priority in PRIORITIES:
+                heap = self._heaps[(pool, priority)]
+                if heap:
+                    start, _, task = heapq.heappop(heap)
+                    self._virtual_time[pool] = max(self._virtual_time[pool], start)
+                    self._forget_idle_clients(pool)
+                    return task
+        return None
+
+    def _forget_idle_clients(self, pool: str):
+        # a tag behind the virtual time has no effect on the next start tags
+        virtual_time = self._virtual_time[pool]
+        for key in [
+            k for k, v in self._finish_tags.items() if k[0] == pool and v <= virtual_time
+        ]:
+            del self._finish_tags[key]
+
+    def remove(self, predicate: Callable[[Dict], bool]) -> bool:
+        """Removes the queued tasks matching the predicate, returns True if there was one."""
+        removed = False
+        with self._lock:
+            for key, heap in self._heaps.items():
+                kept = [entry for entry in heap if not predicate(entry[2])]
+                if len(kept) != len(heap):
+                    heapq.heapify(kept)
+                    self._heaps[key] = kept
+                    removed = True
+        return removed
+
+    def empty(self, pool: str) -> bool:
+        with self._lock:
+            return not any(self._heaps[(pool, p)] for p in PRIORITIES)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(heap) for heap in self._heaps.values())
@@ -1,8 +1,8 @@
-import glob
+import json
 import os
 import pathlib
 import shutil
-from typing import Union
+from typing import Optional, Union
 
 from fastapi import BackgroundTasks, Depends, Path, Request, UploadFile
 from fastapi.params import File
@@ -11,12 +11,16 @@ from loguru import logger
 
 from app.config import config
 from app.controllers import base
+from app.controllers.manager import scheduler
 from app.controllers.manager.memory_manager import InMemoryTaskManager
-from app.controllers.manager.redis_manager import RedisTaskManager
+from app.controllers.manager.redis_manager import RedisTaskManager, get_redis_url
 from app.controllers.v1.base import new_router
+from app.models import const
 from app.models.exception import HttpException
 from app.models.schema import (
     AudioRequest,
+    BatchQueryResponse,
+    BatchResponse,
     BgmRetrieveResponse,
     BgmUploadResponse,
     SubtitleRequest,
@@ -24,8 +28,11 @@ from app.models.schema import (
     TaskQueryRequest,
     TaskQueryResponse,
     TaskResponse,
+    TaskVideoBatchRequest,
     TaskVideoRequest,
+    VideoParams,
 )
+from app.services import batch, bgm_library, checkpoint, encoding, events, transcriber
 from app.services import state as sm
 from app.services import task as tm
 from app.utils import utils
@@ -35,20 +42,33 @@ from app.utils import utils
 router = new_router()
 
 _enable_redis = config.app.get("enable_redis", False)
-_redis_host = config.app.get("redis_host", "localhost")
-_redis_port = config.app.get("redis_port", 6379)
-_redis_db = config.app.get("redis_db", 0)
-_redis_password = config.app.get("redis_password", None)
 _max_concurrent_tasks = config.app.get("max_concurrent_tasks", 5)
+_max_light_tasks = config.app.get("max_concurrent_light_tasks", 0)
 
-redis_url = f"redis://:{_redis_password}@{_redis_host}:{_redis_port}/{_redis_db}"
+redis_url = get_redis_url()
 # 根据配置选择合适的任务管理器
 if _enable_redis:
     task_manager = RedisTaskManager(
-        max_concurrent_tasks=_max_concurrent_tasks, redis_url=redis_url
+        max_concurrent_tasks=_max_concurrent_tasks,
+        redis_url=redis_url,
+        max_light_tasks=_max_light_tasks,
     )
 else:
-    task_manager = InMemoryTaskManager(max_concurrent_tasks=_max_concurrent_tasks)
+    task_manager = InMemoryTaskManager(
+        max_concurrent_tasks=_max_concurrent_tasks, max_light_tasks=_max_light_tasks
+    )
+
+
+def task_schedule(request: Request, params, stop_at: str):
+    # raises ValueError (a 400) for a model or a profile the server does not offer
+    transcriber.check_model_size(getattr(params, "whisper_model_size", ""))
+    encoding.check_profile(getattr(params, "encoding_profile", ""))
+    return scheduler.new_schedule(
+        stop_at,
+        params,
+        priority=base.get_task_priority(request),
+        client=base.get_client_id(request),
+    )
 
 
 @router.post("/videos", response_model=TaskResponse, summary="Generate a short video")
@@ -58,6 +78,67 @@ def create_video(
     return create_task(request, body, stop_at="video")
 
 
+@router.post(
+    "/videos/batch",
+    response_model=BatchResponse,
+    summary="Generate a short video for each subject of the batch",
+)
+def create_video_batch(request: Request, body: TaskVideoBatchRequest):
+    request_id = base.get_task_id(request)
+    max_batch_size = config.app.get("max_batch_size", 500)
+    if not body.items or len(body.items) > max_batch_size:
+        raise HttpException(
+            task_id="",
+            status_code=400,
+            message=f"{request_id}: a batch has 1 to {max_batch_size} items",
+        )
+
+    client = base.get_client_id(request)
+    try:
+        # the params set in an item take precedence over the defaults
+        items = [
+            TaskVideoRequest(
+                **{**(body.defaults or {}), **item.model_dump(exclude_unset=True)}
+            )
+            for item in body.items
+        ]
+        # the tasks of the batch share the fair share of the client
+        schedules = [task_schedule(request, item, "video") for item in items]
+    except ValueError as e:
+        raise HttpException(
+            task_id="", status_code=400, message=f"{request_id}: {str(e)}"
+        )
+
+    utils.run_in_background(batch.warm_up, items)
+    task_ids = [utils.get_uuid() for _ in items]
+    for task_id, item, schedule in zip(task_ids, items, schedules):
+        sm.state.update_task(task_id)
+        task_manager.add_task(
+            tm.start, task_id=task_id, params=item, stop_at="video", schedule=schedule
+        )
+    record = batch.create(task_ids, client=client)
+    logger.success(f"Batch created: {record['batch_id']}, tasks: {len(task_ids)}")
+    return utils.get_response(
+        200, {"batch_id": record["batch_id"], "task_ids": task_ids}
+    )
+
+
+@router.get(
+    "/videos/batch/{batch_id}",
+    response_model=BatchQueryResponse,
+    summary="Query the aggregate progress of a batch",
+)
+def get_video_batch(request: Request, batch_id: str = Path(..., description="Batch ID")):
+    request_id = base.get_task_id(request)
+    record = batch.load(batch_id)
+    if not record:
+        raise HttpException(
+            task_id=batch_id, status_code=404, message=f"{request_id}: batch not found"
+        )
+    tasks = [sm.state.get_task(task_id) for task_id in record["task_ids"]]
+    return utils.get_response(200, batch.progress(record, tasks))
+
+
 @router.post("/subtitle", response_model=TaskResponse, summary="Generate subtitle only")
 def create_subtitle(
     background_tasks: BackgroundTasks, request: Request, body: SubtitleRequest
@@ -85,8 +166,11 @@ def create_task(
             "request_id": request_id,
             "params": body.model_dump(),
         }
+        schedule = task_schedule(request, body, stop_at)
         sm.state.update_task(task_id)
-        task_manager.add_task(tm.start, task_id=task_id, params=body, stop_at=stop_at)
+        task_manager.add_task(
+            tm.start, task_id=task_id, params=body, stop_at=stop_at, schedule=schedule
+        )
         logger.success(f"Task created: {utils.to_json(task)}")
         return utils.get_response(200, task)
     except ValueError as e:
@@ -97,9 +181,16 @@ def create_task(
 from fastapi import Query
 
 @router.get("/tasks", response_model=TaskQueryResponse, summary="Get all tasks")
-def get_all_tasks(request: Request, page: int = Query(1, ge=1), page_size: int = Query(10, ge=1)):
+def get_all_tasks(
+    request: Request,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=1000),
+    state: Optional[int] = Query(
+        None, description="Only the tasks in this state, e.g. 4 (processing), 1 (complete)"
+    ),
+):
     request_id = base.get_task_id(request)
-    tasks, total = sm.state.get_all_tasks(page, page_size)
+    tasks, total = sm.state.get_all_tasks(page, page_size, state=state)
 
     response = {
         "tasks": tasks,
@@ -110,6 +201,77 @@ def get_all_tasks(request: Request, page: int = Query(1, ge=1), page_size: int =
     return utils.get_response(200, response)
 
 
+_TERMINAL_STATES = (
+    const.TASK_STATE_COMPLETE,
+    const.TASK_STATE_FAILED,
+    const.TASK_STATE_CANCELLED,
+)
+# seconds between the keep-alive comments of an idle event stream
+_EVENTS_KEEPALIVE = 15
+
+
+def _sse(event: dict) -> str:
+    # one line of data per event, utils.to_json() indents
+    data = json.dumps(event, ensure_ascii=False, default=str)
+    return f"event: {event.get('type', 'message')}\ndata: {data}\n\n"
+
+
+async def task_event_stream(request: Request, task_id: str = ""):
+    """
+    Server-sent events of one task, or of all tasks if task_id is empty: a "progress"
+    event for every state update, the "log" lines of the task and "deleted". The
+    stream of one task starts with its current state and ends once the task is
+    complete, failed, cancelled or deleted.
+    """
+    subscription = events.get_bus().subscribe(task_id)
+    try:
+        if task_id:
+            task = sm.state.get_task(task_id)
+            if task:
+                yield _sse({"type": events.EVENT_PROGRESS, **task})
+                if task.get("state") in _TERMINAL_STATES:
+                    return
+
+        while not await request.is_disconnected():
+            event = await subscription.get(timeout=_EVENTS_KEEPALIVE)
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield _sse(event)
+            if task_id and (
+                event["type"] == events.EVENT_DELETED
+                or event.get("state") in _TERMINAL_STATES
+            ):
+                return
+    finally:
+        subscription.close()
+
+
+def _event_stream_response(request: Request, task_id: str = "") -> StreamingResponse:
+    return StreamingResponse(
+        task_event_stream(request, task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/tasks/events", summary="Stream the events of all tasks (server-sent events)")
+async def stream_all_task_events(request: Request):
+    return _event_stream_response(request)
+
+
+@router.get(
+    "/tasks/{task_id}/events",
+    summary="Stream the progress and log events of a task (server-sent events)",
+)
+async def stream_task_events(request: Request, task_id: str = Path(..., description="Task ID")):
+    if not sm.state.get_task(task_id):
+        request_id = base.get_task_id(request)
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+    return _event_stream_response(request, task_id)
+
 
 @router.get(
     "/tasks/{task_id}", response_model=TaskQueryResponse, summary="Query task status"
@@ -165,10 +327,14 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
     request_id = base.get_task_id(request)
     task = sm.state.get_task(task_id)
     if task:
+        # stop the task first, it would keep rendering into the removed folder
+        if task.get("state") == const.TASK_STATE_PROCESSING:
+            task_manager.cancel(task_id)
+
         tasks_dir = utils.task_dir()
         current_task_dir = os.path.join(tasks_dir, task_id)
         if os.path.exists(current_task_dir):
-            shutil.rmtree(current_task_dir)
+            shutil.rmtree(current_task_dir, ignore_errors=True)
 
         sm.state.delete_task(task_id)
         logger.success(f"video deleted: {utils.to_json(task)}")
@@ -179,20 +345,90 @@ def delete_video(request: Request, task_id: str = Path(..., description="Task ID
     )
 
 
+@router.post(
+    "/tasks/{task_id}/cancel",
+    response_model=TaskResponse,
+    summary="Cancel a queued or running task",
+)
+def cancel_task(request: Request, task_id: str = Path(..., description="Task ID")):
+    request_id = base.get_task_id(request)
+    task = sm.state.get_task(task_id)
+    if not task:
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+    if task.get("state") != const.TASK_STATE_PROCESSING:
+        raise HttpException(
+            task_id=task_id,
+            status_code=400,
+            message=f"{request_id}: task is not running",
+        )
+
+    # marked first: the standalone workers cancel their tasks marked as cancelled
+    sm.state.update_task(
+        task_id, state=const.TASK_STATE_CANCELLED, progress=task.get("progress", 0)
+    )
+    task_manager.cancel(task_id)
+    logger.success(f"Task cancelled: {task_id}")
+    return utils.get_response(200, {"task_id": task_id})
+
+
+@router.post(
+    "/tasks/{task_id}/retry",
+    response_model=TaskResponse,
+    summary="Run a task again, skipping the stages that completed with unchanged inputs",
+)
+def retry_task(request: Request, task_id: str = Path(..., description="Task ID")):
+    request_id = base.get_task_id(request)
+    manifest = checkpoint.TaskManifest.load(task_id)
+    if not manifest or not manifest.params:
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+
+    task = sm.state.get_task(task_id)
+    if task and task.get("state") == const.TASK_STATE_PROCESSING:
+        raise HttpException(
+            task_id=task_id,
+            status_code=400,
+            message=f"{request_id}: task is still running",
+        )
+
+    stop_at = manifest.stop_at
+    params_class = {"audio": AudioRequest, "subtitle": SubtitleRequest}.get(
+        stop_at, VideoParams
+    )
+    try:
+        params = params_class(**manifest.params)
+        schedule = task_schedule(request, params, stop_at)
+        sm.state.update_task(task_id)
+        task_manager.add_task(
+            tm.start, task_id=task_id, params=params, stop_at=stop_at, schedule=schedule
+        )
+    except ValueError as e:
+        raise HttpException(
+            task_id=task_id, status_code=400, message=f"{request_id}: {str(e)}"
+        )
+
+    logger.success(f"Task retried: {task_id}, stop_at: {stop_at}")
+    return utils.get_response(200, {"task_id": task_id})
+
+
 @router.get(
     "/musics", response_model=BgmRetrieveResponse, summary="Retrieve local BGM files"
 )
 def get_bgm_list(request: Request):
-    suffix = "*.mp3"
-    song_dir = utils.song_dir()
-    files = glob.glob(os.path.join(song_dir, suffix))
     bgm_list = []
-    for file in files:
+    for song in bgm_library.get_library().songs():
+        if not os.path.isfile(song["source"]):
+            continue
         bgm_list.append(
             {
-                "name": os.path.basename(file),
-                "size": os.path.getsize(file),
-                "file": file,
+                "name": song["name"],
+                "size": song["size"],
+                "file": song["source"],
+                "duration": song["duration"],
+                "loudness": song["loudness"],
             }
         )
     response = {"files": bgm_list}
@@ -215,6 +451,8 @@ def upload_bgm_file(request: Request, file: UploadFile = File(...)):
             # If the file already exists, it will be overwritten
             file.file.seek(0)
             buffer.write(file.file.read())
+        # normalize and index the new song in the background
+        utils.run_in_background(bgm_library.get_library().add, save_path)
         response = {"file": save_path}
         return utils.get_response(200, response)
 
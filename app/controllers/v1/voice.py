@@ -0,0 +1,44 @@
+from typing import Optional
+
+from fastapi import Query, Request, Response
+
+from app.controllers.v1.base import new_router
+from app.models.schema import VoiceListResponse
+from app.services import voice_catalog
+from app.utils import utils
+
+# authentication dependency
+# router = new_router(dependencies=[Depends(base.verify_token)])
+router = new_router()
+
+
+@router.get(
+    "/voices",
+    response_model=VoiceListResponse,
+    summary="Retrieve the voice catalog",
+)
+def get_voice_list(
+    request: Request,
+    response: Response,
+    locale: Optional[str] = Query(
+        None, description="Comma separated locales or languages, eg: zh-CN,en"
+    ),
+    gender: Optional[str] = Query(None, description="Female, Male or Unisex"),
+    provider: Optional[str] = Query(
+        None, description="azure_v1, azure_v2, openai or openai_fm"
+    ),
+):
+    catalog = voice_catalog.get_catalog()
+    # the catalog is immutable for the lifetime of the process, so the ETag only
+    # depends on the catalog file and the filter
+    etag = '"%s"' % utils.md5(f"{catalog.etag}:{locale}:{gender}:{provider}")
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=3600"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    locales = [fl.strip() for fl in locale.split(",") if fl.strip()] if locale else None
+    voices = catalog.filter(
+        locales=locales, gender=gender or "", provider=provider or ""
+    )
+    response.headers.update(headers)
+    return utils.get_response(200, {"voices": voices, "total": len(voices)})
@@ -93,6 +93,10 @@ class VideoParams(BaseModel):
 
     subtitle_enabled: Optional[bool] = True
     subtitle_position: Optional[str] = "bottom"  # top, bottom, center
+    # whisper settings, only used when the subtitle is generated by whisper
+    whisper_model_size: Optional[str] = ""  # default: whisper.model_size, see whisper.allowed_model_sizes
+    whisper_beam_size: Optional[int] = 0  # default: whisper.beam_size
+    whisper_batch_size: Optional[int] = -1  # default: whisper.batch_size, 0: sequential
     custom_position: float = 70.0
     font_name: Optional[str] = "STHeitiMedium.ttc"
     text_fore_color: Optional[str] = "#FFFFFF"
@@ -102,6 +106,9 @@ class VideoParams(BaseModel):
     stroke_color: Optional[str] = "#000000"
     stroke_width: float = 1.5
     n_threads: Optional[int] = 2
+    # draft, balanced, archive, youtube, tiktok, instagram or a profile of config.toml,
+    # default: encoding.profile
+    encoding_profile: Optional[str] = ""
     paragraph_number: Optional[int] = 1
 
 
@@ -123,6 +130,9 @@ class SubtitleRequest(BaseModel):
     stroke_width: float = 1.5
     video_source: Optional[str] = "local"
     subtitle_enabled: Optional[str] = "true"
+    whisper_model_size: Optional[str] = ""
+    whisper_beam_size: Optional[int] = 0
+    whisper_batch_size: Optional[int] = -1
 
 
 class AudioRequest(BaseModel):
@@ -177,6 +187,19 @@ class TaskVideoRequest(VideoParams, BaseModel):
     pass
 
 
+class TaskVideoBatchRequest(BaseModel):
+    """
+    {
+      "defaults": {"video_aspect": "9:16", "voice_name": "en-US-JennyNeural-Female"},
+      "items": [{"video_subject": "spring"}, {"video_subject": "summer", "video_count": 2}]
+    }
+    """
+
+    # params applied to every item, the params set in an item take precedence
+    defaults: Optional[dict] = None
+    items: List[TaskVideoRequest]
+
+
 class TaskQueryRequest(BaseModel):
     pass
 
@@ -229,6 +252,50 @@ class TaskQueryResponse(BaseResponse):
         }
 
 
+class BatchResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "batch_id": "1f0e8a5c-52b5-4c1f-9d5e-0c44b06a4e52",
+                    "task_ids": ["6c85c8cc-a77a-42b9-bc30-947815aa0558"],
+                },
+            },
+        }
+
+
+class BatchQueryResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "batch_id": "1f0e8a5c-52b5-4c1f-9d5e-0c44b06a4e52",
+                    "total": 20,
+                    "processing": 3,
+                    "complete": 15,
+                    "failed": 1,
+                    "cancelled": 1,
+                    "progress": 81.5,
+                    "videos": 15,
+                    "elapsed": 1260.5,
+                    "throughput": 42.8,
+                    "eta": 336.1,
+                    "tasks": [
+                        {
+                            "task_id": "6c85c8cc-a77a-42b9-bc30-947815aa0558",
+                            "state": 1,
+                            "progress": 100,
+                        }
+                    ],
+                },
+            },
+        }
+
+
 class TaskDeletionResponse(BaseResponse):
     class Config:
         json_schema_extra = {
@@ -285,6 +352,8 @@ class BgmRetrieveResponse(BaseResponse):
                             "name": "output013.mp3",
                             "size": 1891269,
                             "file": "/MoneyPrinterTurbo/resource/songs/output013.mp3",
+                            "duration": 118.32,
+                            "loudness": -15.8,
                         }
                     ]
                 },
@@ -301,3 +370,25 @@ class BgmUploadResponse(BaseResponse):
                 "data": {"file": "/MoneyPrinterTurbo/resource/songs/example.mp3"},
             },
         }
+
+
+class VoiceListResponse(BaseResponse):
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": 200,
+                "message": "success",
+                "data": {
+                    "voices": [
+                        {
+                            "name": "zh-CN-XiaoxiaoNeural-Female",
+                            "short_name": "zh-CN-XiaoxiaoNeural",
+                            "locale": "zh-CN",
+                            "gender": "Female",
+                            "provider": "azure_v1",
+                        }
+                    ],
+                    "total": 1,
+                },
+            },
+        }
@@ -0,0 +1,88 @@
+"""
+SRT subtitles as in-memory items with numeric timestamps.
+
+Every stage works on the list of SubtitleItem returned by the stage before it, the
+file is only parsed when a stage starts from an existing subtitle file.
+"""
+
+import re
+from collections import namedtuple
+from typing import Iterable, List
+
+# start and end are in seconds
+SubtitleItem = namedtuple("SubtitleItem", ["start", "end", "text"])
+
+_TIME_RANGE_PATTERN = re.compile(
+    r"(\d+):(\d+):(\d+)(?:[,.](\d+))?\s*-->\s*(\d+):(\d+):(\d+)(?:[,.](\d+))?"
+)
+
+
+def _to_seconds(h, m, s, ms) -> float:
+    seconds = int(h) * 3600 + int(m) * 60 + int(s)
+    if ms:
+        seconds += int(ms) / (10 ** len(ms))
+    return seconds
+
+
+def format_time(seconds: float) -> str:
+    total_ms = int(round(max(0.0, seconds) * 1000))
+    hours, total_ms = divmod(total_ms, 3600000)
+    minutes, total_ms = divmod(total_ms, 60000)
+    secs, ms = divmod(total_ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{ms:03d}"
+
+
+def parse(lines: Iterable[str]) -> List[SubtitleItem]:
+    """Single pass over the lines of an SRT document, the index lines are ignored."""
+    items = []
+    start = end = None
+    text_lines = []
+    for line in lines:
+        line = line.strip()
+        if "-->" in line:
+            match = _TIME_RANGE_PATTERN.search(line)
+            if match:
+                if start is not None and text_lines:
+                    items.append(SubtitleItem(start, end, "\n".join(text_lines)))
+                g = match.groups()
+                start, end = _to_seconds(*g[:4]), _to_seconds(*g[4:])
+                text_lines = []
+                continue
+        if not line:
+            if start is not None:
+                if text_lines:
+                    items.append(SubtitleItem(start, end, "\n".join(text_lines)))
+                start = end = None
+                text_lines = []
+        elif start is not None:
+            text_lines.append(line)
+    if start is not None and text_lines:
+        items.append(SubtitleItem(start, end, "\n".join(text_lines)))
+    return items
+
+
+def loads(content: str) -> List[SubtitleItem]:
+    return parse(content.splitlines())
+
+
+def load(filename: str) -> List[SubtitleItem]:
+    with open(filename, "r", encoding="utf-8-sig") as f:
+        return parse(f)
+
+
+def dumps(items: Iterable[SubtitleItem]) -> str:
+    blocks = []
+    for idx, item in enumerate(items, start=1):
+        blocks.append(
+            f"{idx}\n{format_time(item.start)} --> {format_time(item.end)}\n{item.text}\n"
+        )
+    return "\n".join(blocks) + "\n" if blocks else ""
+
+
+def save(items: Iterable[SubtitleItem], filename: str):
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(dumps(items))
+
+
+def duration(items: List[SubtitleItem]) -> float:
+    return max((item.end for item in items), default=0.0)
@@ -0,0 +1,107 @@
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import config
+from app.models import const
+from app.services import bgm_library, transcriber, voice_catalog
+from app.utils import utils
+
+_BATCH_ID_PATTERN = re.compile(r"^[0-9a-f-]{32,36}$")
+
+
+def batch_dir():
+    return utils.storage_dir("batches", create=True)
+
+
+def create(task_ids: List[str], client: str = "") -> Dict:
+    """Records a batch of tasks, their progress is aggregated by progress()."""
+    batch = {
+        "batch_id": utils.get_uuid(),
+        "client": client,
+        "task_ids": task_ids,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(batch_dir(), f"{batch['batch_id']}.json"), "w") as f:
+        json.dump(batch, f)
+    return batch
+
+
+def load(batch_id: str) -> Optional[Dict]:
+    if not _BATCH_ID_PATTERN.match(batch_id or ""):
+        return None
+    file = os.path.join(batch_dir(), f"{batch_id}.json")
+    if not os.path.isfile(file):
+        return None
+    with open(file, "r") as f:
+        return json.load(f)
+
+
+def warm_up(params_list: List):
+    """
+    Loads the resources shared by the tasks of a batch once for the batch: the BGM
+    library, the voice catalog and the whisper models they use. The LLM, TTS and
+    HTTP clients and the material search results are shared once the first task
+    created them.
+    """
+    start = time.time()
+    bgm_library.get_library().refresh()
+    voice_catalog.get_catalog()
+
+    if config.app.get("subtitle_provider", "").strip().lower() == "whisper":
+        model_sizes = {p.whisper_model_size for p in params_list if p.subtitle_enabled}
+        for model_size in model_sizes:
+            transcriber.get_service(model_size).load()
+    logger.info(f"batch resources loaded, elapsed: {time.time() - start:.2f} s")
+
+
+def progress(batch: Dict, tasks: List[Optional[Dict]]) -> Dict:
+    """
+    Aggregates the states of the tasks of the batch (None for a deleted task):
+    the number of tasks in each state, the mean progress, the throughput in tasks
+    per hour and the estimated seconds until the batch is done.
+    """
+    counts = {"processing": 0, "complete": 0, "failed": 0, "cancelled": 0}
+    total_progress = 0
+    videos = 0
+    summaries = []
+    for task_id, task in zip(batch["task_ids"], tasks):
+        task = task or {"state": const.TASK_STATE_FAILED, "progress": 0}
+        state = task.get("state")
+        if state == const.TASK_STATE_COMPLETE:
+            counts["complete"] += 1
+            total_progress += 100
+            videos += len(task.get("videos", []))
+        elif state == const.TASK_STATE_FAILED:
+            counts["failed"] += 1
+            total_progress += 100
+        elif state == const.TASK_STATE_CANCELLED:
+            counts["cancelled"] += 1
+            total_progress += 100
+        else:
+            counts["processing"] += 1
+            total_progress += task.get("progress", 0)
+        summaries.append(
+            {"task_id": task_id, "state": state, "progress": task.get("progress", 0)}
+        )
+
+    total = len(batch["task_ids"])
+    finished = counts["complete"] + counts["failed"] + counts["cancelled"]
+    elapsed = time.time() - batch["created_at"]
+    throughput = finished / elapsed * 3600 if elapsed > 0 else 0
+    eta = (total - finished) * elapsed / finished if finished else None
+    return {
+        "batch_id": batch["batch_id"],
+        "total": total,
+        **counts,
+        "progress": round(total_progress / total, 1) if total else 100,
+        "videos": videos,
+        "elapsed": round(elapsed, 1),
+        "throughput": round(throughput, 1),
+        "eta": round(eta, 1) if eta is not None else None,
+        "tasks": summaries,
+    }
@@ -0,0 +1,232 @@
+import json
+import os
+import random
+import re
+import threading
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import config
+from app.services.utils import ffmpeg
+from app.utils import utils
+
+_DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_LOUDNORM_PATTERN = re.compile(r"\{[^{}]*\"input_i\"[^{}]*\}", re.S)
+
+
+def cache_dir():
+    return utils.storage_dir("cache_bgm", create=True)
+
+
+def manifest_file():
+    return os.path.join(cache_dir(), "manifest.json")
+
+
+def measure(source: str):
+    """First loudnorm pass, returns (duration, loudnorm stats) of the song."""
+    target = config.app.get("bgm_target_loudness", -14)
+    result = ffmpeg.run(
+        [
+            "-i",
+            source,
+            "-vn",
+            "-af",
+            f"loudnorm=I={target}:TP=-1.5:LRA=11:print_format=json",
+            "-f",
+            "null",
+            "-",
+        ]
+    )
+    stderr = result.stderr.decode("utf-8", errors="ignore")
+    duration = 0.0
+    match = _DURATION_PATTERN.search(stderr)
+    if match:
+        h, m, s = match.groups()
+        duration = int(h) * 3600 + int(m) * 60 + float(s)
+    stats = {}
+    match = _LOUDNORM_PATTERN.search(stderr)
+    if match:
+        stats = json.loads(match.group(0))
+    return duration, stats
+
+
+def normalize(source: str, output_file: str, stats: Dict):
+    """Second loudnorm pass, writes the song normalized to app.bgm_target_loudness."""
+    target = config.app.get("bgm_target_loudness", -14)
+    loudnorm = f"loudnorm=I={target}:TP=-1.5:LRA=11"
+    if stats:
+        loudnorm += (
+            f":measured_I={stats['input_i']}:measured_TP={stats['input_tp']}"
+            f":measured_LRA={stats['input_lra']}:measured_thresh={stats['input_thresh']}"
+            f":offset={stats['target_offset']}:linear=true"
+        )
+    tmp_file = f"{output_file}.{utils.get_uuid(True)}.tmp.m4a"
+    ffmpeg.run(
+        ["-i", source, "-vn", "-af", loudnorm, "-ar", "44100", "-c:a", "aac", "-b:a", "192k", tmp_file]
+    )
+    os.replace(tmp_file, output_file)
+
+
+class BgmLibrary:
+    """
+    Index of the background music in resource/songs.
+
+    Every song is measured and loudness-normalized once into storage/cache_bgm, and
+    its duration and loudness are kept in a manifest, so picking and mixing a song
+    needs neither a directory scan nor decoding per task. New songs (uploaded
+    through POST /musics, or copied into the folder) are indexed when they appear.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._dir_mtime = 0.0
+        self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.isfile(manifest_file()):
+            return
+        try:
+            with open(manifest_file(), "r", encoding="utf-8") as f:
+                self._entries = json.load(f).get("songs", {})
+        except Exception as e:
+            logger.warning(f"invalid bgm manifest: {manifest_file()} => {str(e)}")
+            self._entries = {}
+
+    def _save_manifest(self):
+        tmp_file = f"{manifest_file()}.{utils.get_uuid(True)}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"songs": self._entries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, manifest_file())
+
+    def _is_current(self, entry: Optional[Dict], source: str) -> bool:
+        if not entry:
+            return False
+        stat = os.stat(source)
+        return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+    @staticmethod
+    def _pending_entry(source: str) -> Dict:
+        # the original song, used until it is indexed; mtime 0 makes the next scan index it
+        return {
+            "name": os.path.basename(source),
+            "source": source,
+            "file": source,
+            "size": os.path.getsize(source),
+            "mtime": 0,
+            "duration": 0.0,
+            "loudness": None,
+            "normalized": False,
+        }
+
+    def add(self, source: str) -> Dict:
+        """Measures and normalizes one song, a song that did not change is skipped."""
+        name = os.path.basename(source)
+        with self._lock:
+            entry = self._entries.get(name)
+        if self._is_current(entry, source):
+            return entry
+
+        stat = os.stat(source)
+        entry = self._pending_entry(source)
+        entry.update(size=stat.st_size, mtime=stat.st_mtime)
+        try:
+            duration, stats = measure(source)
+            entry["duration"] = duration
+            if stats:
+                entry["loudness"] = float(stats["input_i"])
+            if config.app.get("bgm_normalize", True):
+                output_file = os.path.join(
+                    cache_dir(), f"{os.path.splitext(name)[0]}-{utils.md5(source)}.m4a"
+                )
+                normalize(source, output_file, stats)
+                entry["file"] = output_file
+                entry["normalized"] = True
+            logger.info(
+                f"bgm indexed: {name}, duration: {entry['duration']:.2f} s, loudness: {entry['loudness']} LUFS"
+            )
+        except Exception as e:
+            # the original song is still usable, it is just not normalized
+            logger.warning(f"failed to normalize bgm: {source} => {str(e)}")
+
+        with self._lock:
+            self._entries[name] = entry
+            self._save_manifest()
+        return entry
+
+    def scan(self):
+        """Indexes new or changed songs and drops the ones that were removed."""
+        with self._scan_lock:
+            song_dir = utils.song_dir()
+            self._dir_mtime = os.stat(song_dir).st_mtime
+            sources = {
+                f: os.path.join(song_dir, f)
+                for f in os.listdir(song_dir)
+                if f.lower().endswith(".mp3")
+            }
+            with self._lock:
+                removed = [name for name in self._entries if name not in sources]
+                for name in removed:
+                    entry = self._entries.pop(name)
+                    if entry.get("normalized") and os.path.isfile(entry["file"]):
+                        os.remove(entry["file"])
+                if removed:
+                    self._save_manifest()
+                for name, source in sources.items():
+                    if name not in self._entries:
+                        self._entries[name] = self._pending_entry(source)
+            for source in sorted(sources.values()):
+                self.add(source)
+            logger.info(f"bgm library ready, songs: {len(self._entries)}")
+
+    def refresh(self):
+        """Rescans in the background when the songs folder changed since the last scan."""
+        try:
+            changed = os.stat(utils.song_dir()).st_mtime != self._dir_mtime
+        except OSError:
+            changed = False
+        if changed and not self._scan_lock.locked():
+            utils.run_in_background(self.scan)
+
+    def warm_up(self):
+        return utils.run_in_background(self.scan)
+
+    def songs(self) -> List[Dict]:
+        self.refresh()
+        # a rescan may be adding songs meanwhile
+        with self._lock:
+            entries = list(self._entries.values())
+        return sorted(entries, key=lambda e: e["name"])
+
+    def resolve(self, bgm_file: str) -> str:
+        """Returns the normalized copy of a song of the library, or the file itself."""
+        with self._lock:
+            entry = self._entries.get(os.path.basename(bgm_file))
+        if (
+            entry
+            and os.path.abspath(entry["source"]) == os.path.abspath(bgm_file)
+            and os.path.isfile(entry["file"])
+        ):
+            return entry["file"]
+        return bgm_file
+
+    def random_file(self) -> str:
+        songs = [e for e in self.songs() if os.path.isfile(e["file"])]
+        if not songs:
+            return ""
+        return random.choice(songs)["file"]
+
+
+_library: Optional[BgmLibrary] = None
+_library_lock = threading.Lock()
+
+
+def get_library() -> BgmLibrary:
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                _library = BgmLibrary()
+    return _library
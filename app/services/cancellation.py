@@ -0,0 +1,157 @@
+import contextvars
+import os
+import threading
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+
+
+class TaskCancelled(Exception):
+    """Raised by CancellationToken.check() in a task that was cancelled."""
+
+    def __init__(self, task_id: str):
+        super().__init__(f"task {task_id} was cancelled")
+        self.task_id = task_id
+
+
+def kill_child_processes(paths: Iterable[str], name: str = "ffmpeg") -> int:
+    """
+    Kills the child processes of this process (e.g. the ffmpeg started by MoviePy)
+    whose command line refers to one of the paths, the processes of the other tasks
+    are left alone. Returns the number of processes killed.
+    """
+    import psutil
+
+    paths = [p for p in paths if p]
+    if not paths:
+        return 0
+    killed = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            if name not in child.name().lower():
+                continue
+            cmdline = child.cmdline()
+            if any(path in arg for arg in cmdline for path in paths):
+                child.kill()
+                killed += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return killed
+
+
+def kill_process_tree(pid: int):
+    """Kills a process and all of its children."""
+    import psutil
+
+    try:
+        process = psutil.Process(pid)
+        for child in process.children(recursive=True):
+            child.kill()
+        process.kill()
+    except psutil.NoSuchProcess:
+        pass
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation of a task: the task calls check() between its stages and
+    in its long loops, which raises TaskCancelled once the token is cancelled. The
+    processes registered with the token, and the ffmpeg processes writing into the
+    task dir, are killed when it is cancelled so a running render stops at once.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise TaskCancelled(self.task_id)
+
+    def register(self, process):
+        """Tracks a subprocess.Popen of the task, it is killed if the task is cancelled."""
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled:
+            process.kill()
+
+    def unregister(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def cancel(self):
+        if self._event.is_set():
+            return
+        self._event.set()
+        logger.info(f"cancelling task: {self.task_id}")
+
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+        from app.utils import utils
+
+        task_dir = os.path.join(utils.task_dir(), self.task_id, "")
+        try:
+            killed = kill_child_processes([task_dir])
+        except Exception as e:
+            logger.error(f"failed to kill the processes of task {self.task_id}: {e}")
+            killed = 0
+        logger.info(
+            f"task {self.task_id} cancelled, killed {len(processes) + killed} processes"
+        )
+
+
+_tokens: Dict[str, CancellationToken] = {}
+_tokens_lock = threading.Lock()
+_current = contextvars.ContextVar("cancellation_token", default=None)
+
+
+def token(task_id: str) -> CancellationToken:
+    """The token of the task, created on first use."""
+    with _tokens_lock:
+        t = _tokens.get(task_id)
+        if t is None:
+            t = _tokens[task_id] = CancellationToken(task_id)
+        return t
+
+
+def release(task_id: str):
+    with _tokens_lock:
+        _tokens.pop(task_id, None)
+
+
+def cancel(task_id: str) -> bool:
+    """Cancels the task if it runs in this process, returns False otherwise."""
+    with _tokens_lock:
+        t = _tokens.get(task_id)
+    if t is None:
+        return False
+    t.cancel()
+    return True
+
+
+def activate(t: Optional[CancellationToken]):
+    """Makes the token the current one of the calling thread (or context)."""
+    _current.set(t)
+
+
+def current() -> Optional[CancellationToken]:
+    return _current.get()
+
+
+def check():
+    """Raises TaskCancelled if the current task was cancelled, a no-op outside of a task."""
+    t = _current.get()
+    if t is not None:
+        t.check()
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+
+from app.utils import utils
+
+MANIFEST_FILE = "manifest.json"
+
+
+def input_hash(inputs) -> str:
+    data = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class TaskManifest:
+    """
+    Checkpoints of the stages of a task, kept in manifest.json of the task dir.
+
+    Every completed stage (script, terms, audio, subtitle, materials, combined-N,
+    final-N) is recorded with a hash of its inputs, its outputs and the files it
+    produced. A stage is restored instead of being run again when its inputs are
+    unchanged and its files still exist. The inputs of a stage include the key of
+    the stages it depends on, so a stage that ran again with different results
+    invalidates the stages after it.
+    """
+
+    def __init__(self, task_id: str, data: Dict = None):
+        self.task_id = task_id
+        self.file = os.path.join(utils.task_dir(task_id), MANIFEST_FILE)
+        self._data = data or {"task_id": task_id, "stages": {}}
+        self._data.setdefault("stages", {})
+
+    @classmethod
+    def load(cls, task_id: str) -> Optional["TaskManifest"]:
+        """The manifest of the task, None if the task has none (or it is invalid)."""
+        file = os.path.join(utils.task_dir(), task_id, MANIFEST_FILE)
+        if not os.path.isfile(file):
+            return None
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"invalid task manifest: {file}, {e}")
+            return None
+        if not isinstance(data, dict):
+            return None
+        return cls(task_id, data)
+
+    @classmethod
+    def open(cls, task_id: str) -> "TaskManifest":
+        return cls.load(task_id) or cls(task_id)
+
+    @property
+    def params(self) -> Optional[Dict]:
+        return self._data.get("params")
+
+    @property
+    def stop_at(self) -> str:
+        return self._data.get("stop_at", "video")
+
+    def set_params(self, params: Dict, stop_at: str):
+        self._data["params"] = params
+        self._data["stop_at"] = stop_at
+        self._save()
+
+    def key(self, stage: str) -> str:
+        """Identifies the inputs and the results of a completed stage, "" if it is not."""
+        entry = self._data["stages"].get(stage)
+        if not entry:
+            return ""
+        return input_hash([entry["hash"], entry.get("outputs")])
+
+    def restore(self, stage: str, inputs) -> Optional[Dict]:
+        """The outputs of the stage if it completed with the same inputs, otherwise None."""
+        entry = self._data["stages"].get(stage)
+        if not entry or entry.get("hash") != input_hash(inputs):
+            return None
+        missing = [f for f in entry.get("files", []) if not os.path.isfile(f)]
+        if missing:
+            logger.info(f"stage {stage} has to run again, missing files: {missing}")
+            return None
+
+        logger.info(f"\n\n## {stage}: unchanged, restored from the task manifest")
+        return entry.get("outputs", {})
+
+    def record(self, stage: str, inputs, outputs: Dict, files: Iterable[str] = ()):
+        self._data["stages"][stage] = {
+            "hash": input_hash(inputs),
+            "outputs": outputs,
+            "files": [f for f in files if f],
+            "completed_at": int(time.time()),
+        }
+        self._save()
+
+    def _save(self):
+        tmp_file = f"{self.file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(utils.to_json(self._data))
+        os.replace(tmp_file, self.file)
@@ -0,0 +1,158 @@
+from typing import Dict, List
+
+from loguru import logger
+
+from app.config import config
+
+# Built-in profiles, [encoding.profiles.<name>] in config.toml overrides or adds profiles.
+# crf is the quality target, maxrate/bufsize cap the bitrate of complex scenes (VBV),
+# gop is the keyframe interval in frames (30 fps).
+BUILTIN_PROFILES: Dict[str, Dict] = {
+    # fastest encode, small and rough, the previous hard-coded settings
+    "draft": {
+        "preset": "ultrafast",
+        "crf": 28,
+        "maxrate": "2000k",
+        "bufsize": "4000k",
+        "gop": 60,
+        "audio_bitrate": "128k",
+    },
+    "balanced": {
+        "preset": "veryfast",
+        "crf": 23,
+        "maxrate": "4500k",
+        "bufsize": "9000k",
+        "gop": 60,
+        "audio_bitrate": "160k",
+    },
+    # best quality per byte, slow
+    "archive": {
+        "preset": "slow",
+        "crf": 18,
+        "maxrate": "12000k",
+        "bufsize": "24000k",
+        "gop": 120,
+        "audio_bitrate": "256k",
+    },
+    "youtube": {
+        "preset": "medium",
+        "crf": 20,
+        "maxrate": "8000k",
+        "bufsize": "16000k",
+        "gop": 15,
+        "audio_bitrate": "192k",
+    },
+    "tiktok": {
+        "preset": "veryfast",
+        "crf": 23,
+        "maxrate": "5000k",
+        "bufsize": "10000k",
+        "gop": 60,
+        "audio_bitrate": "128k",
+    },
+    "instagram": {
+        "preset": "veryfast",
+        "crf": 23,
+        "maxrate": "3500k",
+        "bufsize": "7000k",
+        "gop": 60,
+        "audio_bitrate": "128k",
+    },
+}
+
+DEFAULT_PROFILE = "draft"
+
+
+class EncodingProfile:
+    def __init__(
+        self,
+        name: str,
+        codec: str = "libx264",
+        preset: str = "veryfast",
+        crf: int = 23,
+        maxrate: str = "",
+        bufsize: str = "",
+        gop: int = 60,
+        audio_bitrate: str = "128k",
+        faststart: bool = True,
+    ):
+        self.name = name
+        self.codec = codec
+        self.preset = preset
+        self.crf = int(crf)
+        self.maxrate = maxrate
+        self.bufsize = bufsize
+        self.gop = int(gop)
+        self.audio_bitrate = audio_bitrate
+        self.faststart = faststart
+
+    def __repr__(self):
+        return f"EncodingProfile({self.name}: {self.codec} {self.preset} crf {self.crf}, maxrate {self.maxrate or '-'})"
+
+    def rate_control_args(self) -> List[str]:
+        args = ["-crf", str(self.crf), "-g", str(self.gop)]
+        if self.maxrate:
+            args += ["-maxrate", self.maxrate, "-bufsize", self.bufsize or self.maxrate]
+        return args
+
+    def video_args(self, threads: int = 2) -> List[str]:
+        """Arguments of an ffmpeg command line that encodes the video stream."""
+        return [
+            "-c:v",
+            self.codec,
+            "-preset",
+            self.preset,
+            *self.rate_control_args(),
+            "-pix_fmt",
+            "yuv420p",
+            "-threads",
+            str(threads),
+        ]
+
+    def audio_args(self) -> List[str]:
+        """Arguments of the ffmpeg command line that writes the final file."""
+        args = ["-c:a", "aac", "-b:a", self.audio_bitrate]
+        if self.faststart:
+            args += ["-movflags", "+faststart"]
+        return args
+
+    def moviepy_kwargs(self, threads: int = 2) -> Dict:
+        """Keyword arguments of VideoClip.write_videofile for the video stream."""
+        return {
+            "codec": self.codec,
+            "preset": self.preset,
+            "threads": threads,
+            "ffmpeg_params": self.rate_control_args(),
+        }
+
+
+def profiles() -> Dict[str, Dict]:
+    result = {name: dict(p) for name, p in BUILTIN_PROFILES.items()}
+    for name, p in config.encoding.get("profiles", {}).items():
+        result.setdefault(name, {}).update(p)
+    return result
+
+
+def check_profile(name: str):
+    """Raises ValueError for a profile name that is neither built in nor configured."""
+    all_profiles = profiles()
+    if name and name not in all_profiles:
+        raise ValueError(
+            f"unknown encoding profile: {name}, "
+            f"available: {', '.join(sorted(all_profiles))}"
+        )
+
+
+def get_profile(name: str = "") -> EncodingProfile:
+    """
+    Returns the named profile, encoding.profile by default. An unknown name raises
+    ValueError, only an unknown encoding.profile falls back to the built-in default.
+    """
+    all_profiles = profiles()
+    if not name:
+        name = config.encoding.get("profile", DEFAULT_PROFILE)
+        if name not in all_profiles:
+            logger.warning(f"unknown encoding profile: {name}, using {DEFAULT_PROFILE}")
+            name = DEFAULT_PROFILE
+    check_profile(name)
+    return EncodingProfile(name=name, **all_profiles[name])
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from loguru import logger
+
+from app.config import config
+
+EVENT_PROGRESS = "progress"
+EVENT_LOG = "log"
+EVENT_DELETED = "deleted"
+
+_CHANNEL = "task_events"
+# sorted set of the tasks watched by the subscribers of any process ("*": all tasks),
+# scored by the time their watch expires
+_WATCHERS_KEY = "task_events:watchers"
+_WATCH_TTL = 60
+# seconds the subscribers refresh their watch, and a publisher reuses its answer
+_WATCH_REFRESH = 20
+_WATCH_CACHE = 2.0
+
+
+class Subscription:
+    """
+    The events of one task (or of all tasks if task_id is empty) for one client.
+    Created in the event loop of the client; the events are published from any thread
+    and handed over to the loop. A slow client loses its oldest events, not the
+    publishers' time.
+    """
+
+    def __init__(self, bus, task_id: str = "", max_events: int = 1000):
+        self.bus = bus
+        self.task_id = task_id
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=max_events)
+
+    def _put(self, event: Dict):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+
+    def deliver(self, event: Dict):
+        if self.task_id and event.get("task_id") != self.task_id:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # the loop of the client is closed
+            self.close()
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """Delivers the task events to the subscribers of this process."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, task_id: str = "") -> Subscription:
+        subscription = Subscription(self, task_id)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def watched(self, task_id: str) -> bool:
+        """Whether a subscriber receives the events of the task."""
+        with self._lock:
+            return any(
+                not s.task_id or s.task_id == task_id for s in self._subscribers
+            )
+
+    def publish(self, event: Dict):
+        self._dispatch(event)
+
+    def _dispatch(self, event: Dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+
+class RedisEventBus(EventBus):
+    """
+    Publishes the task events on a Redis channel, so the events of the tasks run by
+    other processes (standalone workers) reach the subscribers of the API. The
+    channel is listened to once the first client subscribes.
+
+    The subscribers keep the tasks they watch in a sorted set with an expiry, so the
+    processes running the tasks know whether anyone reads their log events (see
+    watched()) without a round trip per log line.
+    """
+
+    def __init__(self, client):
+        super().__init__()
+        self._client = client
+        self._listener = None
+        # task id => (time checked, watched)
+        self._watched: Dict[str, tuple] = {}
+
+    def subscribe(self, task_id: str = "") -> Subscription:
+        subscription = super().subscribe(task_id)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+        try:
+            self._watch([task_id or "*"])
+        except Exception as e:
+            logger.debug(f"failed to watch task events: {e}")
+        return subscription
+
+    def _watch(self, task_ids):
+        now = time.time()
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zadd(_WATCHERS_KEY, {task_id: now + _WATCH_TTL for task_id in task_ids})
+        pipe.zremrangebyscore(_WATCHERS_KEY, "-inf", now)
+        pipe.execute()
+
+    def _refresh_watches(self):
+        with self._lock:
+            task_ids = {s.task_id or "*" for s in self._subscribers}
+        if task_ids:
+            self._watch(task_ids)
+
+    def watched(self, task_id: str) -> bool:
+        now = time.monotonic()
+        cached = self._watched.get(task_id)
+        if cached and now - cached[0] < _WATCH_CACHE:
+            return cached[1]
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            pipe.zscore(_WATCHERS_KEY, task_id)
+            pipe.zscore(_WATCHERS_KEY, "*")
+            expiries = pipe.execute()
+        except Exception as e:
+            logger.debug(f"failed to check the task event watchers: {e}")
+            return False
+        watched = any(e is not None and e > time.time() for e in expiries)
+        if len(self._watched) > 1000:
+            self._watched.clear()
+        self._watched[task_id] = (now, watched)
+        return watched
+
+    def publish(self, event: Dict):
+        try:
+            self._client.publish(_CHANNEL, json.dumps(event, default=str))
+        except Exception as e:
+            logger.debug(f"failed to publish task event: {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(_CHANNEL)
+                refreshed = 0.0
+                while True:
+                    if time.monotonic() - refreshed >= _WATCH_REFRESH:
+                        self._refresh_watches()
+                        refreshed = time.monotonic()
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        self._dispatch(json.loads(message["data"]))
+            except Exception as e:
+                logger.error(f"task event listener error: {e}")
+                time.sleep(5)
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus() -> EventBus:
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                if config.app.get("enable_redis", False):
+                    import redis
+
+                    from app.controllers.manager.redis_manager import get_redis_url
+
+                    _bus = RedisEventBus(redis.Redis.from_url(get_redis_url()))
+                else:
+                    _bus = EventBus()
+    return _bus
+
+
+def set_bus(bus):
+    """Replaces the bus of this process, e.g. in a worker process that forwards its events."""
+    global _bus
+    _bus = bus
+
+
+def publish(event_type: str, task_id: str, **fields):
+    get_bus().publish(
+        {"type": event_type, "task_id": task_id, "time": time.time(), **fields}
+    )
+
+
+def _log_sink(message):
+    from app.services import cancellation
+
+    token = cancellation.current()
+    # the log lines of a task nobody is watching are not published
+    if token is None or not get_bus().watched(token.task_id):
+        return
+    record = message.record
+    publish(
+        EVENT_LOG,
+        token.task_id,
+        level=record["level"].name,
+        message=record["message"],
+    )
+
+
+_log_sink_id = None
+
+
+def install_log_sink():
+    """
+    Publishes the log lines of the running tasks (app.task_log_events) while they
+    are watched, a task is known from the cancellation token of the logging thread.
+    """
+    global _log_sink_id
+    if _log_sink_id is None and config.app.get("task_log_events", True):
+        _log_sink_id = logger.add(_log_sink, level="INFO", format="{message}")
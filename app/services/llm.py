@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import re
@@ -13,6 +14,21 @@ from app.config import config
 _max_retries = 5
 
 
+@functools.lru_cache(maxsize=8)
+def _get_client(llm_provider: str, api_key: str, base_url: str, api_version: str = ""):
+    """
+    The client of the provider settings, shared by the tasks so they reuse its
+    connection pool instead of opening new connections for every prompt.
+    """
+    if llm_provider == "azure":
+        return AzureOpenAI(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=base_url,
+        )
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+
 def _generate_response(prompt: str) -> str:
     try:
         content = ""
@@ -226,18 +242,7 @@ def _generate_response(prompt: str) -> str:
                 ).json()
                 return response.get("result")
 
-            if llm_provider == "azure":
-                client = AzureOpenAI(
-                    api_key=api_key,
-                    api_version=api_version,
-                    azure_endpoint=base_url,
-                )
-            else:
-                client = OpenAI(
-                    api_key=api_key,
-                    base_url=base_url,
-                )
-
+            client = _get_client(llm_provider, api_key, base_url, api_version)
             response = client.chat.completions.create(
                 model=model_name, messages=[{"role": "user", "content": prompt}]
             )
@@ -1,6 +1,8 @@
 import os
 import random
-from typing import List
+import threading
+import time
+from typing import Callable, List
 from urllib.parse import urlencode
 
 import requests
@@ -9,10 +11,20 @@ from moviepy.video.io.VideoFileClip import VideoFileClip
 
 from app.config import config
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import cancellation, progress
 from app.utils import utils
 
 requested_count = 0
 
+# shared by the tasks, so the searches and downloads reuse the connections to the hosts
+_session = requests.Session()
+
+_DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# search results by (source, term, minimum duration, aspect) => (time, items)
+_search_cache = {}
+_search_cache_lock = threading.Lock()
+
 
 def get_api_key(cfg_key: str):
     api_keys = config.app.get(cfg_key)
@@ -50,7 +62,7 @@ def search_videos_pexels(
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = _session.get(
             query_url,
             headers=headers,
             proxies=config.proxy,
@@ -109,7 +121,7 @@ def search_videos_pixabay(
     logger.info(f"searching videos: {query_url}, with proxies: {config.proxy}")
 
     try:
-        r = requests.get(
+        r = _session.get(
             query_url, proxies=config.proxy, verify=False, timeout=(30, 60)
         )
         response = r.json()
@@ -144,7 +156,14 @@ def search_videos_pixabay(
     return []
 
 
-def save_video(video_url: str, save_dir: str = "") -> str:
+def save_video(
+    video_url: str, save_dir: str = "", on_progress: Callable[[int, int], None] = None
+) -> str:
+    """
+    Downloads the video into the cache (or save_dir), streamed in chunks into a temp
+    file so an interrupted download is not taken for a cached video. on_progress is
+    called with the bytes downloaded and the size of the video (0 if unknown).
+    """
     if not save_dir:
         save_dir = utils.storage_dir("cache_videos")
 
@@ -166,16 +185,31 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     }
 
     # if video does not exist, download it
-    with open(video_path, "wb") as f:
-        f.write(
-            requests.get(
-                video_url,
-                headers=headers,
-                proxies=config.proxy,
-                verify=False,
-                timeout=(60, 240),
-            ).content
-        )
+    tmp_path = f"{video_path}.{threading.get_ident()}.part"
+    try:
+        with _session.get(
+            video_url,
+            headers=headers,
+            proxies=config.proxy,
+            verify=False,
+            timeout=(60, 240),
+            stream=True,
+        ) as r:
+            r.raise_for_status()
+            total = int(r.headers.get("Content-Length") or 0)
+            downloaded = 0
+            with open(tmp_path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+                    cancellation.check()
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    progress.count("bytes", len(chunk))
+                    if on_progress:
+                        on_progress(downloaded, total)
+        os.replace(tmp_path, video_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
@@ -194,6 +228,42 @@ def save_video(video_url: str, save_dir: str = "") -> str:
     return ""
 
 
+def search_videos(
+    source: str,
+    search_term: str,
+    minimum_duration: int,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+) -> List[MaterialInfo]:
+    """
+    Searches the videos of the source, the results are cached for
+    app.material_search_cache_ttl seconds so the tasks of a batch with common
+    terms do not search them again.
+    """
+    search = search_videos_pixabay if source == "pixabay" else search_videos_pexels
+    ttl = config.app.get("material_search_cache_ttl", 3600)
+    aspect = VideoAspect(video_aspect).value
+    key = (source, search_term.strip().lower(), minimum_duration, aspect)
+    if ttl > 0:
+        with _search_cache_lock:
+            cached = _search_cache.get(key)
+        if cached and time.time() - cached[0] < ttl:
+            logger.info(f"search results of '{search_term}' found in the cache")
+            return list(cached[1])
+
+    video_items = search(
+        search_term=search_term,
+        minimum_duration=minimum_duration,
+        video_aspect=video_aspect,
+    )
+    if ttl > 0 and video_items:
+        now = time.time()
+        with _search_cache_lock:
+            for k in [k for k, v in _search_cache.items() if now - v[0] >= ttl]:
+                del _search_cache[k]
+            _search_cache[key] = (now, video_items)
+    return list(video_items)
+
+
 def download_videos(
     task_id: str,
     search_terms: List[str],
@@ -206,12 +276,9 @@ def download_videos(
     valid_video_items = []
     valid_video_urls = []
     found_duration = 0.0
-    search_videos = search_videos_pexels
-    if source == "pixabay":
-        search_videos = search_videos_pixabay
-
     for search_term in search_terms:
         video_items = search_videos(
+            source=source,
             search_term=search_term,
             minimum_duration=max_clip_duration,
             video_aspect=video_aspect,
@@ -240,15 +307,23 @@ def download_videos(
 
     total_duration = 0.0
     for item in valid_video_items:
+        cancellation.check()
+        # the progress of the stage is the footage downloaded, in seconds
+        seconds = min(max_clip_duration, item.duration)
+        progress.report(total_duration)
+
+        def downloaded(size, total, base=total_duration, seconds=seconds):
+            if total:
+                progress.report(base + seconds * min(1.0, size / total))
+
         try:
             logger.info(f"downloading video: {item.url}")
             saved_video_path = save_video(
-                video_url=item.url, save_dir=material_directory
+                video_url=item.url, save_dir=material_directory, on_progress=downloaded
             )
             if saved_video_path:
                 logger.info(f"video saved: {saved_video_path}")
                 video_paths.append(saved_video_path)
-                seconds = min(max_clip_duration, item.duration)
                 total_duration += seconds
                 if total_duration > audio_duration:
                     logger.info(
@@ -0,0 +1,328 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from loguru import logger
+
+from app.models import const
+from app.services import cancellation
+from app.services import state as sm
+from app.utils import utils
+
+# unit of work of each stage, and its seconds per unit until the throughput of the
+# stage was measured on this machine
+STAGE_UNITS = {
+    "script": ("request", 5.0),
+    "terms": ("request", 5.0),
+    # characters synthesized
+    "audio": ("char", 0.01),
+    # seconds of audio transcribed
+    "subtitle": ("second", 0.3),
+    # seconds of footage downloaded (or preprocessed)
+    "materials": ("second", 0.5),
+    # frames encoded, every video is encoded twice (combined and final)
+    "render": ("frame", 0.01),
+}
+RENDER_FPS = 30
+
+# progress of a task that started, the rest is spread over its stages by their
+# expected duration
+_START_PROGRESS = 5
+# seconds between two progress updates of a stage, the updates are published
+_UPDATE_INTERVAL = 1.0
+# weight of the last run in the measured throughput of a stage
+_HISTORY_ALPHA = 0.3
+# lower bound of the measured seconds per unit of a stage, relative to its default
+_MIN_RATE_RATIO = 0.05
+
+
+class ThroughputHistory:
+    """
+    Seconds per unit of work of every stage, an exponential moving average over the
+    runs of the stage, kept in storage/stats/throughput.json. The processes running
+    tasks update the file in turn, an update racing with another one may be lost.
+    """
+
+    def __init__(self, file: str = ""):
+        self.file = file or os.path.join(
+            utils.storage_dir("stats", create=True), "throughput.json"
+        )
+        self._lock = threading.Lock()
+        self._rates = None
+
+    def _load(self) -> Dict[str, float]:
+        try:
+            with open(self.file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def rate(self, stage: str) -> float:
+        with self._lock:
+            if self._rates is None:
+                self._rates = self._load()
+            rate = self._rates.get(stage)
+        default = STAGE_UNITS[stage][1]
+        # a stage that happened to be instant (cached) keeps a weight
+        return max(rate, default * _MIN_RATE_RATIO) if rate else default
+
+    def record(self, stage: str, elapsed: float, units: float):
+        if elapsed <= 0 or units <= 0:
+            return
+        with self._lock:
+            rates = self._load()
+            measured = elapsed / units
+            previous = rates.get(stage)
+            rates[stage] = (
+                measured
+                if not previous
+                else _HISTORY_ALPHA * measured + (1 - _HISTORY_ALPHA) * previous
+            )
+            self._rates = rates
+            tmp_file = f"{self.file}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(rates, f)
+                os.replace(tmp_file, self.file)
+            except OSError as e:
+                logger.warning(f"failed to save the stage throughput: {e}")
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history() -> ThroughputHistory:
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = ThroughputHistory()
+    return _history
+
+
+class ProgressTracker:
+    """
+    Progress of a task measured in units of work: the characters synthesized, the
+    seconds of audio transcribed, the seconds of footage downloaded and the frames
+    encoded. Each stage weighs its expected duration (its units times the measured
+    seconds per unit), the remaining time is estimated the same way, with the
+    throughput of the current stage once it has run for a while.
+
+    The timings of the stages, the current stage and the estimate are published with
+    every progress update as "stage", "stages" and "eta" (seconds).
+    """
+
+    def __init__(self, task_id: str, stages: Dict[str, float], history=None):
+        self.task_id = task_id
+        self.history = history or get_history()
+        # stage => expected units, in the order they run
+        self._units = dict(stages)
+        self._timings: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._stage = None
+        self._started = 0.0
+        self._done = 0.0
+        # units of the stage restored from a checkpoint rather than worked on
+        self._skipped = 0.0
+        self._step = None
+        self._last_update = 0.0
+
+    def set_units(self, stage: str, units: float):
+        """Refines the expected units of a stage once they are known."""
+        with self._lock:
+            if stage in self._units:
+                self._units[stage] = max(0.0, float(units))
+
+    def begin(self, stage: str, units: float = None):
+        with self._lock:
+            if units is not None:
+                self._units[stage] = max(0.0, float(units))
+            self._units.setdefault(stage, 0.0)
+            self._stage = stage
+            self._started = time.monotonic()
+            self._done = 0.0
+            self._skipped = 0.0
+            self._step = None
+        self.update(force=True)
+
+    def end(self, restored: bool = False):
+        """Ends the current stage, its throughput is recorded unless it was restored."""
+        with self._lock:
+            stage = self._stage
+            if stage is None:
+                return
+            elapsed = time.monotonic() - self._started
+            worked = max(0.0, self._units[stage] - self._skipped)
+            self._timings[stage] = {
+                **self._timings.get(stage, {}),
+                "elapsed": round(elapsed, 2),
+                "units": round(self._units[stage], 2),
+                "unit": STAGE_UNITS.get(stage, ("", 0))[0],
+                "restored": restored,
+            }
+            self._stage = None
+        if not restored and stage in STAGE_UNITS:
+            self.history.record(stage, elapsed, worked)
+        self.update(force=True)
+
+    @contextlib.contextmanager
+    def step(self, units: float):
+        """A part of the current stage, report() counts from the start of the step."""
+        units = max(0.0, float(units))
+        with self._lock:
+            base = self._done
+            self._step = (base, units)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._done = base + units
+                self._step = None
+
+    def report(self, done: float):
+        """The units of work done in the current stage (or step)."""
+        with self._lock:
+            if self._step:
+                base, units = self._step
+                self._done = base + min(max(0.0, done), units)
+            else:
+                self._done = max(0.0, float(done))
+        self.update()
+
+    def skip(self, units: float):
+        """Units of the current stage restored from a checkpoint."""
+        with self._lock:
+            self._done += units
+            self._skipped += units
+        self.update()
+
+    def count(self, name: str, value: float):
+        """Adds to a counter of the current stage, e.g. the bytes downloaded."""
+        with self._lock:
+            if self._stage is None:
+                return
+            timing = self._timings.setdefault(self._stage, {})
+            timing[name] = timing.get(name, 0) + value
+
+    def _expected(self, stage: str) -> float:
+        if stage not in STAGE_UNITS:
+            return 0.0
+        return self._units.get(stage, 0.0) * self.history.rate(stage)
+
+    def estimate(self):
+        """(fraction of the expected work done, seconds remaining)"""
+        with self._lock:
+            total = done = remaining = 0.0
+            for stage in self._units:
+                expected = self._expected(stage)
+                total += expected
+                if stage in self._timings and stage != self._stage:
+                    done += expected
+                elif stage == self._stage:
+                    units = self._units[stage]
+                    fraction = min(1.0, self._done / units) if units else 0.0
+                    done += expected * fraction
+                    worked = self._done - self._skipped
+                    elapsed = time.monotonic() - self._started
+                    if worked > 0 and elapsed >= 5:
+                        # the throughput of this run, once it is meaningful
+                        remaining += max(0.0, units - self._done) * elapsed / worked
+                    else:
+                        remaining += expected * (1 - fraction)
+                else:
+                    remaining += expected
+        return (done / total if total else 0.0), max(0.0, remaining)
+
+    def fields(self) -> Dict:
+        _, eta = self.estimate()
+        with self._lock:
+            timings = {k: dict(v) for k, v in self._timings.items()}
+            if self._stage is not None:
+                timings[self._stage] = {
+                    **timings.get(self._stage, {}),
+                    "elapsed": round(time.monotonic() - self._started, 2),
+                    "units": round(self._units[self._stage], 2),
+                    "done": round(self._done, 2),
+                    "unit": STAGE_UNITS.get(self._stage, ("", 0))[0],
+                }
+            return {"stage": self._stage or "", "stages": timings, "eta": round(eta)}
+
+    def progress(self) -> int:
+        fraction, _ = self.estimate()
+        # 100 is set once the task is complete
+        return min(99, int(_START_PROGRESS + (100 - _START_PROGRESS) * fraction))
+
+    def update(self, force: bool = False):
+        token = cancellation.current()
+        if token is not None and token.cancelled:
+            # the task is cancelled (or deleted), its state is not ours anymore
+            return
+        now = time.monotonic()
+        if not force and now - self._last_update < _UPDATE_INTERVAL:
+            return
+        self._last_update = now
+        # a task cancelled, failed or deleted meanwhile is left as it is
+        sm.state.update_running_task(
+            self.task_id,
+            state=const.TASK_STATE_PROCESSING,
+            progress=self.progress(),
+            **self.fields(),
+        )
+
+    def complete(self, **kwargs):
+        """Marks the task as complete, with the timings of its stages."""
+        fields = self.fields()
+        sm.state.update_running_task(
+            self.task_id,
+            state=const.TASK_STATE_COMPLETE,
+            progress=100,
+            stages=fields["stages"],
+            eta=0,
+            **kwargs,
+        )
+
+
+_current = contextvars.ContextVar("progress_tracker", default=None)
+
+
+def activate(tracker: Optional[ProgressTracker]):
+    """Makes the tracker the current one of the calling thread (or context)."""
+    _current.set(tracker)
+
+
+def current() -> Optional[ProgressTracker]:
+    return _current.get()
+
+
+def report(done: float):
+    """Reports the work done in the current stage of the current task, a no-op outside of a task."""
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.report(done)
+
+
+def count(name: str, value: float):
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.count(name, value)
+
+
+def reporter() -> Optional[Callable[[float], None]]:
+    """report() of the current tracker, for the callbacks run on other threads."""
+    tracker = _current.get()
+    return tracker.report if tracker is not None else None
+
+
+@contextlib.contextmanager
+def step(units: float):
+    tracker = _current.get()
+    if tracker is None:
+        yield
+        return
+    with tracker.step(units):
+        yield
@@ -1,8 +1,12 @@
 import ast
+import json
+import os
+import time
 from abc import ABC, abstractmethod
 
 from app.config import config
 from app.models import const
+from app.services import events
 
 
 # Base class for state management
@@ -11,24 +15,51 @@ class BaseState(ABC):
     def update_task(self, task_id: str, state: int, progress: int = 0, **kwargs):
         pass
 
+    @abstractmethod
+    def update_running_task(
+        self, task_id: str, state: int, progress: int = 0, **kwargs
+    ) -> bool:
+        """
+        Updates a task that is still processing, for the progress reports of the task:
+        a task deleted or finished (complete, failed, cancelled) meanwhile is left
+        alone. Returns whether the task was updated.
+        """
+        pass
+
     @abstractmethod
     def get_task(self, task_id: str):
         pass
 
     @abstractmethod
-    def get_all_tasks(self, page: int, page_size: int):
+    def get_all_tasks(self, page: int, page_size: int, state: int = None):
+        """A page of the tasks in the order they were created, and their total count."""
         pass
 
+    @staticmethod
+    def _publish(fields: dict):
+        # every update is streamed to the subscribers of the task, see app.services.events
+        events.publish(events.EVENT_PROGRESS, **fields)
+
+
+_TASK_STATES = (
+    const.TASK_STATE_PROCESSING,
+    const.TASK_STATE_COMPLETE,
+    const.TASK_STATE_FAILED,
+    const.TASK_STATE_CANCELLED,
+)
+
 
 # Memory state management
 class MemoryState(BaseState):
     def __init__(self):
         self._tasks = {}
 
-    def get_all_tasks(self, page: int, page_size: int):
+    def get_all_tasks(self, page: int, page_size: int, state: int = None):
         start = (page - 1) * page_size
         end = start + page_size
         tasks = list(self._tasks.values())
+        if state is not None:
+            tasks = [task for task in tasks if task.get("state") == state]
         total = len(tasks)
         return tasks[start:end], total
 
@@ -49,6 +80,20 @@ class MemoryState(BaseState):
             "progress": progress,
             **kwargs,
         }
+        self._publish(self._tasks[task_id])
+
+    def update_running_task(
+        self,
+        task_id: str,
+        state: int = const.TASK_STATE_PROCESSING,
+        progress: int = 0,
+        **kwargs,
+    ) -> bool:
+        task = self._tasks.get(task_id)
+        if not task or task.get("state") != const.TASK_STATE_PROCESSING:
+            return False
+        self.update_task(task_id, state, progress, **kwargs)
+        return True
 
     def get_task(self, task_id: str):
         return self._tasks.get(task_id, None)
@@ -56,37 +101,118 @@ class MemoryState(BaseState):
     def delete_task(self, task_id: str):
         if task_id in self._tasks:
             del self._tasks[task_id]
+        events.publish(events.EVENT_DELETED, task_id)
+
+
+# Writes the fields of a task and keeps its index up to date: the task is added to
+# the index by its creation time on its first update, and moved to the set of its
+# new state when its state changes. With a required state, a task in another state
+# (or deleted) is left alone. Returns 1 if the task was written.
+# KEYS: the task hash, the index, the prefix of the state sets
+# ARGV: the task id, the time, the encoded state, the encoded required state (or an
+# empty string), then the fields and values
+_UPDATE_SCRIPT = """
+local previous = redis.call('HGET', KEYS[1], 'state')
+if ARGV[4] ~= '' and previous ~= ARGV[4] then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 5))
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[1])
+if previous ~= ARGV[3] then
+    local created = redis.call('ZSCORE', KEYS[2], ARGV[1])
+    if previous then
+        redis.call('ZREM', KEYS[3] .. previous, ARGV[1])
+    end
+    redis.call('ZADD', KEYS[3] .. ARGV[3], created, ARGV[1])
+end
+return 1
+"""
 
 
 # Redis state management
 class RedisState(BaseState):
-    def __init__(self, host="localhost", port=6379, db=0, password=None):
+    """
+    Tasks kept in Redis hashes, one field per key of the task. The values are JSON
+    encoded, an update is written in one round trip.
+
+    The tasks are indexed by a sorted set of their ids scored by creation time, and a
+    sorted set per state, so a page of the tasks (of a state) is read in
+    O(log(n) + page size) with a correct total, without scanning the keyspace.
+    """
+
+    INDEX_KEY = "tasks:index"
+    STATE_KEY_PREFIX = "tasks:state:"
+    # set once the tasks written before the index existed were indexed
+    INDEX_BUILT_KEY = "tasks:index:built"
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, client=None):
         import redis
 
-        self._redis = redis.StrictRedis(host=host, port=port, db=db, password=password)
+        # client: an existing connection, e.g. a fakeredis one in the benchmarks
+        self._redis = client or redis.StrictRedis(
+            host=host, port=port, db=db, password=password
+        )
+        self._update = self._redis.register_script(_UPDATE_SCRIPT)
+        self._index_checked = False
 
-    def get_all_tasks(self, page: int, page_size: int):
+    def get_all_tasks(self, page: int, page_size: int, state: int = None):
+        self._ensure_index()
+        key = self.INDEX_KEY if state is None else self._state_key(state)
         start = (page - 1) * page_size
-        end = start + page_size
-        tasks = []
-        cursor = 0
-        total = 0
-        while True:
-            cursor, keys = self._redis.scan(cursor, count=page_size)
-            total += len(keys)
-            if total > start:
-                for key in keys[max(0, start - total):end - total]:
-                    task_data = self._redis.hgetall(key)
-                    task = {
-                        k.decode("utf-8"): self._convert_to_original_type(v) for k, v in task_data.items()
-                    }
-                    tasks.append(task)
-                    if len(tasks) >= page_size:
-                        break
-            if cursor == 0 or len(tasks) >= page_size:
-                break
+
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zcard(key)
+        pipe.zrange(key, start, start + page_size - 1)
+        total, task_ids = pipe.execute()
+        if not task_ids:
+            return [], total
+
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(task_id)
+        # a task deleted meanwhile is left out
+        tasks = [self._decode_task(data) for data in pipe.execute() if data]
         return tasks, total
 
+    def _state_key(self, state) -> str:
+        return f"{self.STATE_KEY_PREFIX}{self._encode(state)}"
+
+    def _ensure_index(self):
+        """Indexes the tasks written before the index existed, once."""
+        if self._index_checked:
+            return
+        if not self._redis.exists(self.INDEX_BUILT_KEY):
+            self.rebuild_index()
+        self._index_checked = True
+
+    def rebuild_index(self) -> int:
+        """
+        Indexes every task hash of the database (scanning the whole keyspace), the
+        tasks without an index entry are dated by their task dir, if any. Returns the
+        number of tasks indexed.
+        """
+        from app.utils import utils
+
+        count = 0
+        for key in self._redis.scan_iter(count=1000, _type="HASH"):
+            task_id, state = self._redis.hmget(key, "task_id", "state")
+            if task_id is None or state is None or self._decode(task_id) != key.decode("utf-8"):
+                continue
+            task_id = key.decode("utf-8")
+            created = self._redis.zscore(self.INDEX_KEY, task_id)
+            if created is None:
+                task_dir = os.path.join(utils.task_dir(), task_id)
+                created = os.path.getctime(task_dir) if os.path.isdir(task_dir) else 0
+            pipe = self._redis.pipeline()
+            pipe.zadd(self.INDEX_KEY, {task_id: created})
+            for known_state in _TASK_STATES:
+                pipe.zrem(self._state_key(known_state), task_id)
+            pipe.zadd(self._state_key(self._decode(state)), {task_id: created})
+            pipe.execute()
+            count += 1
+        self._redis.set(self.INDEX_BUILT_KEY, int(time.time()))
+        return count
+
     def update_task(
         self,
         task_id: str,
@@ -94,6 +220,22 @@ class RedisState(BaseState):
         progress: int = 0,
         **kwargs,
     ):
+        self._write(task_id, state, progress, kwargs)
+
+    def update_running_task(
+        self,
+        task_id: str,
+        state: int = const.TASK_STATE_PROCESSING,
+        progress: int = 0,
+        **kwargs,
+    ) -> bool:
+        return self._write(
+            task_id, state, progress, kwargs, required_state=const.TASK_STATE_PROCESSING
+        )
+
+    def _write(
+        self, task_id: str, state: int, progress: int, kwargs: dict, required_state=None
+    ) -> bool:
         progress = int(progress)
         if progress > 100:
             progress = 100
@@ -105,31 +247,58 @@ class RedisState(BaseState):
             **kwargs,
         }
 
+        required = "" if required_state is None else self._encode(required_state)
+        args = [task_id, time.time(), self._encode(state), required]
         for field, value in fields.items():
-            self._redis.hset(task_id, field, str(value))
+            args += [field, self._encode(value)]
+        written = self._update(
+            keys=[task_id, self.INDEX_KEY, self.STATE_KEY_PREFIX], args=args
+        )
+        if not written:
+            return False
+        self._publish(fields)
+        return True
 
     def get_task(self, task_id: str):
         task_data = self._redis.hgetall(task_id)
         if not task_data:
             return None
 
-        task = {
-            key.decode("utf-8"): self._convert_to_original_type(value)
-            for key, value in task_data.items()
-        }
-        return task
+        return self._decode_task(task_data)
 
     def delete_task(self, task_id: str):
-        self._redis.delete(task_id)
+        pipe = self._redis.pipeline()
+        pipe.delete(task_id)
+        pipe.zrem(self.INDEX_KEY, task_id)
+        for state in _TASK_STATES:
+            pipe.zrem(self._state_key(state), task_id)
+        pipe.execute()
+        events.publish(events.EVENT_DELETED, task_id)
 
     @staticmethod
-    def _convert_to_original_type(value):
-        """
-        Convert the value from byte string to its original data type.
-        You can extend this method to handle other data types as needed.
-        """
+    def _encode(value) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    @classmethod
+    def _decode_task(cls, task_data) -> dict:
+        return {
+            key.decode("utf-8"): cls._decode(value) for key, value in task_data.items()
+        }
+
+    @classmethod
+    def _decode(cls, value):
         value_str = value.decode("utf-8")
+        try:
+            return json.loads(value_str)
+        except ValueError:
+            # written with str() by a previous version
+            return cls._convert_to_original_type(value_str)
 
+    @staticmethod
+    def _convert_to_original_type(value_str: str):
+        """
+        Convert a value written with str() back to its original data type.
+        """
         try:
             # try to convert byte string array to list
             return ast.literal_eval(value_str)
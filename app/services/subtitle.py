@@ -1,63 +1,60 @@
+import functools
 import json
 import os.path
 import re
 from timeit import default_timer as timer
 
-from faster_whisper import WhisperModel
 from loguru import logger
 
 from app.config import config
+from app.models import srt
+from app.services import progress, transcriber
 from app.utils import utils
 
-model_size = config.whisper.get("model_size", "large-v3")
-device = config.whisper.get("device", "cpu")
-compute_type = config.whisper.get("compute_type", "int8")
-model = None
 
-
-def create(audio_file, subtitle_file: str = ""):
-    global model
-    if not model:
-        model_path = f"{utils.root_dir()}/models/whisper-{model_size}"
-        model_bin_file = f"{model_path}/model.bin"
-        if not os.path.isdir(model_path) or not os.path.isfile(model_bin_file):
-            model_path = model_size
-
-        logger.info(
-            f"loading model: {model_path}, device: {device}, compute_type: {compute_type}"
-        )
-        try:
-            model = WhisperModel(
-                model_size_or_path=model_path, device=device, compute_type=compute_type
-            )
-        except Exception as e:
-            logger.error(
-                f"failed to load model: {e} \n\n"
-                f"********************************************\n"
-                f"this may be caused by network issue. \n"
-                f"please download the model manually and put it in the 'models' folder. \n"
-                f"see [README.md FAQ](https://github.com/harry0703/MoneyPrinterTurbo) for more details.\n"
-                f"********************************************\n\n"
-            )
-            return None
-
-    logger.info(f"start, output file: {subtitle_file}")
+def create(
+    audio_file,
+    subtitle_file: str = "",
+    model_size: str = "",
+    beam_size: int = 0,
+    batch_size: int = -1,
+):
+    """
+    Transcribes the audio file into the subtitle file.
+
+    :param model_size: whisper model, defaults to whisper.model_size
+    :param beam_size: beam size of the decoder, defaults to whisper.beam_size (5)
+    :param batch_size: > 0 splits the audio at the VAD silences and decodes the chunks
+        in parallel batches, 0 decodes the audio sequentially, defaults to whisper.batch_size
+    """
     if not subtitle_file:
         subtitle_file = f"{audio_file}.srt"
+    if not beam_size or beam_size < 1:
+        beam_size = config.whisper.get("beam_size", 5)
+    if batch_size is None or batch_size < 0:
+        batch_size = config.whisper.get("batch_size", 0)
+
+    logger.info(
+        f"start, output file: {subtitle_file}, model: {model_size or 'default'}, "
+        f"beam_size: {beam_size}, batch_size: {batch_size}"
+    )
 
-    segments, info = model.transcribe(
+    start = timer()
+    segments, info = transcriber.get_service(model_size).transcribe(
         audio_file,
-        beam_size=5,
+        batch_size=batch_size,
+        beam_size=beam_size,
         word_timestamps=True,
         vad_filter=True,
         vad_parameters=dict(min_silence_duration_ms=500),
     )
+    if segments is None:
+        return None
 
     logger.info(
         f"detected language: '{info.language}', probability: {info.language_probability:.2f}"
     )
 
-    start = timer()
     subtitles = []
 
     def recognized(seg_text, seg_start, seg_end):
@@ -73,6 +70,8 @@ def create(audio_file, subtitle_file: str = ""):
         )
 
     for segment in segments:
+        # the progress of the stage is the audio transcribed, in seconds
+        progress.report(segment.end)
         words_idx = 0
         words_len = len(segment.words)
 
@@ -118,47 +117,41 @@ def create(audio_file, subtitle_file: str = ""):
     diff = end - start
     logger.info(f"complete, elapsed: {diff:.2f} s")
 
-    idx = 1
-    lines = []
-    for subtitle in subtitles:
-        text = subtitle.get("msg")
-        if text:
-            lines.append(
-                utils.text_to_srt(
-                    idx, text, subtitle.get("start_time"), subtitle.get("end_time")
-                )
-            )
-            idx += 1
-
-    sub = "\n".join(lines) + "\n"
-    with open(subtitle_file, "w", encoding="utf-8") as f:
-        f.write(sub)
+    items = [
+        srt.SubtitleItem(sub["start_time"], sub["end_time"], sub["msg"])
+        for sub in subtitles
+        if sub.get("msg")
+    ]
+    srt.save(items, subtitle_file)
     logger.info(f"subtitle file created: {subtitle_file}")
+    return items
 
 
-def file_to_subtitles(filename):
+def file_to_subtitles(filename) -> list[srt.SubtitleItem]:
     if not filename or not os.path.isfile(filename):
         return []
+    return srt.load(filename)
+
+
+try:
+    # C implementation, an order of magnitude faster than the pure Python fallback
+    from rapidfuzz.distance import Levenshtein as _rf_levenshtein
+except ImportError:
+    _rf_levenshtein = None
+
+# one token per CJK/kana/hangul character, one token per word for the other scripts
+_TOKEN_PATTERN = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|[^\W\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+"
+)
 
-    times_texts = []
-    current_times = None
-    current_text = ""
-    index = 0
-    with open(filename, "r", encoding="utf-8") as f:
-        for line in f:
-            times = re.findall("([0-9]*:[0-9]*:[0-9]*,[0-9]*)", line)
-            if times:
-                current_times = line
-            elif line.strip() == "" and current_times:
-                index += 1
-                times_texts.append((index, current_times.strip(), current_text.strip()))
-                current_times, current_text = None, ""
-            elif current_times:
-                current_text += line
-    return times_texts
+# Minimum half width of the alignment band, in tokens, around the diagonal.
+_ALIGN_BAND = 32
 
 
 def levenshtein_distance(s1, s2):
+    if _rf_levenshtein is not None:
+        return _rf_levenshtein.distance(s1, s2)
+
     if len(s1) < len(s2):
         return levenshtein_distance(s2, s1)
 
@@ -179,103 +172,178 @@ def levenshtein_distance(s1, s2):
 
 
 def similarity(a, b):
-    distance = levenshtein_distance(a.lower(), b.lower())
     max_length = max(len(a), len(b))
+    if max_length == 0:
+        return 1.0
+    distance = levenshtein_distance(a.lower(), b.lower())
     return 1 - (distance / max_length)
 
 
-def correct(subtitle_file, video_script):
-    subtitle_items = file_to_subtitles(subtitle_file)
-    script_lines = utils.split_string_by_punctuations(video_script)
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
 
-    corrected = False
-    new_subtitle_items = []
-    script_index = 0
-    subtitle_index = 0
 
-    while script_index < len(script_lines) and subtitle_index < len(subtitle_items):
-        script_line = script_lines[script_index].strip()
-        subtitle_line = subtitle_items[subtitle_index][2].strip()
+@functools.lru_cache(maxsize=65536)
+def _token_cost(a: str, b: str) -> float:
+    if a == b:
+        return 0.0
+    if len(a) == 1 and len(b) == 1:
+        return 1.0
+    return 1.0 - similarity(a, b)
 
-        if script_line == subtitle_line:
-            new_subtitle_items.append(subtitle_items[subtitle_index])
-            script_index += 1
-            subtitle_index += 1
+
+def align_tokens(source: list[str], target: list[str], band: int = _ALIGN_BAND):
+    """
+    Global alignment (edit distance) of two token sequences, restricted to a band
+    around the diagonal, so the cost is O(len(source) * band) instead of O(n * m).
+
+    :return: for each source token, the index of the aligned target token, or -1 if
+        the source token was deleted
+    """
+    n, m = len(source), len(target)
+    if n == 0:
+        return []
+    if m == 0:
+        return [-1] * n
+
+    width = band + abs(n - m)
+    inf = float("inf")
+    # back pointers: 0 = diagonal (match/substitution), 1 = up (delete), 2 = left (insert)
+    lows, backs = [], []
+
+    prev_lo, prev_hi = 0, min(m, width)
+    prev = [float(j) for j in range(prev_lo, prev_hi + 1)]
+    lows.append(prev_lo)
+    backs.append([2] * len(prev))
+
+    for i in range(1, n + 1):
+        center = i * m // n
+        lo, hi = max(0, center - width), min(m, center + width)
+        cur = [inf] * (hi - lo + 1)
+        back = [1] * (hi - lo + 1)
+        token = source[i - 1]
+        for j in range(lo, hi + 1):
+            best, move = inf, 1
+            if prev_lo <= j <= prev_hi:
+                best = prev[j - prev_lo] + 1
+            if j > 0:
+                if prev_lo <= j - 1 <= prev_hi:
+                    cost = prev[j - 1 - prev_lo] + _token_cost(token, target[j - 1])
+                    if cost <= best:
+                        best, move = cost, 0
+                if j - 1 >= lo:
+                    cost = cur[j - 1 - lo] + 1
+                    if cost < best:
+                        best, move = cost, 2
+            cur[j - lo] = best
+            back[j - lo] = move
+        lows.append(lo)
+        backs.append(back)
+        prev, prev_lo, prev_hi = cur, lo, hi
+
+    mapping = [-1] * n
+    i, j = n, m
+    while i > 0:
+        move = backs[i][j - lows[i]]
+        if move == 0:
+            mapping[i - 1] = j - 1
+            i, j = i - 1, j - 1
+        elif move == 1:
+            i -= 1
         else:
-            combined_subtitle = subtitle_line
-            start_time = subtitle_items[subtitle_index][1].split(" --> ")[0]
-            end_time = subtitle_items[subtitle_index][1].split(" --> ")[1]
-            next_subtitle_index = subtitle_index + 1
-
-            while next_subtitle_index < len(subtitle_items):
-                next_subtitle = subtitle_items[next_subtitle_index][2].strip()
-                if similarity(
-                    script_line, combined_subtitle + " " + next_subtitle
-                ) > similarity(script_line, combined_subtitle):
-                    combined_subtitle += " " + next_subtitle
-                    end_time = subtitle_items[next_subtitle_index][1].split(" --> ")[1]
-                    next_subtitle_index += 1
-                else:
-                    break
-
-            if similarity(script_line, combined_subtitle) > 0.8:
-                logger.warning(
-                    f"Merged/Corrected - Script: {script_line}, Subtitle: {combined_subtitle}"
-                )
-                new_subtitle_items.append(
-                    (
-                        len(new_subtitle_items) + 1,
-                        f"{start_time} --> {end_time}",
-                        script_line,
-                    )
-                )
-                corrected = True
-            else:
-                logger.warning(
-                    f"Mismatch - Script: {script_line}, Subtitle: {combined_subtitle}"
-                )
-                new_subtitle_items.append(
-                    (
-                        len(new_subtitle_items) + 1,
-                        f"{start_time} --> {end_time}",
-                        script_line,
-                    )
-                )
-                corrected = True
-
-            script_index += 1
-            subtitle_index = next_subtitle_index
-
-    # Process the remaining lines of the script.
-    while script_index < len(script_lines):
-        logger.warning(f"Extra script line: {script_lines[script_index]}")
-        if subtitle_index < len(subtitle_items):
-            new_subtitle_items.append(
-                (
-                    len(new_subtitle_items) + 1,
-                    subtitle_items[subtitle_index][1],
-                    script_lines[script_index],
-                )
-            )
-            subtitle_index += 1
+            j -= 1
+    return mapping
+
+
+def align_subtitles(
+    script_lines: list[str], subtitle_items: list[srt.SubtitleItem]
+) -> list[srt.SubtitleItem]:
+    """
+    Aligns the script lines with the recognized subtitle items.
+
+    Both sides are tokenized, the tokens are aligned globally, and each script line
+    takes the time span of the subtitle tokens aligned to it. The time of a token is
+    interpolated by its position inside its subtitle item. Lines without any aligned
+    token are placed between their neighbours.
+
+    :return: one item per script line
+    """
+    target_tokens, target_times = [], []
+    for start, end, text in subtitle_items:
+        tokens = tokenize(text)
+        step = (end - start) / len(tokens) if tokens else 0
+        for k, token in enumerate(tokens):
+            target_tokens.append(token)
+            target_times.append((start + k * step, start + (k + 1) * step))
+
+    source_tokens, source_lines = [], []
+    for line_index, line in enumerate(script_lines):
+        for token in tokenize(line):
+            source_tokens.append(token)
+            source_lines.append(line_index)
+
+    mapping = align_tokens(source_tokens, target_tokens)
+
+    spans = [None] * len(script_lines)
+    for source_index, target_index in enumerate(mapping):
+        if target_index < 0:
+            continue
+        line_index = source_lines[source_index]
+        t_start, t_end = target_times[target_index]
+        span = spans[line_index]
+        if span is None:
+            spans[line_index] = [t_start, t_end]
         else:
-            new_subtitle_items.append(
-                (
-                    len(new_subtitle_items) + 1,
-                    "00:00:00,000 --> 00:00:00,000",
-                    script_lines[script_index],
-                )
+            span[0] = min(span[0], t_start)
+            span[1] = max(span[1], t_end)
+
+    results = []
+    previous_end = 0.0
+    for line_index, line in enumerate(script_lines):
+        span = spans[line_index]
+        if span is None:
+            next_start = next(
+                (s[0] for s in spans[line_index + 1 :] if s is not None), previous_end
             )
-        script_index += 1
-        corrected = True
-
-    if corrected:
-        with open(subtitle_file, "w", encoding="utf-8") as fd:
-            for i, item in enumerate(new_subtitle_items):
-                fd.write(f"{i + 1}\n{item[1]}\n{item[2]}\n\n")
-        logger.info("Subtitle corrected")
-    else:
+            span = [previous_end, max(previous_end, next_start)]
+        start = max(span[0], previous_end)
+        end = max(span[1], start)
+        results.append(srt.SubtitleItem(start, end, line.strip()))
+        previous_end = end
+    return results
+
+
+def correct(subtitle_file, video_script, subtitle_items=None) -> list[srt.SubtitleItem]:
+    """
+    Replaces the recognized text with the script lines, realigned to the recognized
+    timings. Returns the corrected items, the subtitle file is only parsed when the
+    items are not passed in.
+    """
+    if subtitle_items is None:
+        subtitle_items = file_to_subtitles(subtitle_file)
+    script_lines = utils.split_string_by_punctuations(video_script)
+
+    if len(script_lines) == len(subtitle_items) and all(
+        line.strip() == item.text.strip()
+        for line, item in zip(script_lines, subtitle_items)
+    ):
         logger.success("Subtitle is correct")
+        return subtitle_items
+
+    start = timer()
+    aligned = align_subtitles(script_lines, subtitle_items)
+    mismatched = 0
+    for item in aligned:
+        if item.end <= item.start:
+            mismatched += 1
+            logger.warning(f"Mismatch - Script: {item.text}")
+
+    srt.save(aligned, subtitle_file)
+    logger.info(
+        f"Subtitle corrected, lines: {len(aligned)}, subtitle items: {len(subtitle_items)}, "
+        f"unmatched lines: {mismatched}, elapsed: {timer() - start:.2f} s"
+    )
+    return aligned
 
 
 if __name__ == "__main__":
@@ -1,5 +1,4 @@
 import math
-import os.path
 import re
 import traceback
 from os import path
@@ -9,7 +8,16 @@ from loguru import logger
 from app.config import config
 from app.models import const
 from app.models.schema import VideoConcatMode, VideoParams
-from app.services import llm, material, subtitle, video, voice
+from app.services import (
+    cancellation,
+    checkpoint,
+    llm,
+    material,
+    progress,
+    subtitle,
+    video,
+    voice,
+)
 from app.services import state as sm
 from app.utils import utils
 
@@ -95,40 +103,57 @@ def generate_audio(task_id, params, video_script):
 
 
 def generate_subtitle(task_id, params, video_script, sub_maker, audio_file):
+    """
+    Returns the subtitle file and its items, ("", None) if the subtitle is disabled
+    or could not be generated.
+    """
     if not params.subtitle_enabled:
-        return ""
+        return "", None
 
     subtitle_path = path.join(utils.task_dir(task_id), "subtitle.srt")
     subtitle_provider = config.app.get("subtitle_provider", "").strip().lower()
     logger.info(f"\n\n## generating subtitle, provider: {subtitle_provider}")
 
+    subtitle_items = None
     subtitle_fallback = False
     if subtitle_provider == "edge":
-        voice.create_subtitle(
+        subtitle_items = voice.create_subtitle(
             text=video_script, sub_maker=sub_maker, subtitle_file=subtitle_path
         )
-        if not os.path.exists(subtitle_path):
+        if not subtitle_items:
             subtitle_fallback = True
             logger.warning("subtitle file not found, fallback to whisper")
 
     if subtitle_provider == "whisper" or subtitle_fallback:
-        subtitle.create(audio_file=audio_file, subtitle_file=subtitle_path)
-        logger.info("\n\n## correcting subtitle")
-        subtitle.correct(subtitle_file=subtitle_path, video_script=video_script)
+        subtitle_items = subtitle.create(
+            audio_file=audio_file,
+            subtitle_file=subtitle_path,
+            model_size=params.whisper_model_size,
+            beam_size=params.whisper_beam_size,
+            batch_size=params.whisper_batch_size,
+        )
+        if subtitle_items:
+            logger.info("\n\n## correcting subtitle")
+            subtitle_items = subtitle.correct(
+                subtitle_file=subtitle_path,
+                video_script=video_script,
+                subtitle_items=subtitle_items,
+            )
 
-    subtitle_lines = subtitle.file_to_subtitles(subtitle_path)
-    if not subtitle_lines:
+    if not subtitle_items:
         logger.warning(f"subtitle file is invalid: {subtitle_path}")
-        return ""
+        return "", None
 
-    return subtitle_path
+    return subtitle_path, subtitle_items
 
 
 def get_video_materials(task_id, params, video_terms, audio_duration):
     if params.video_source == "local":
         logger.info("\n\n## preprocess local materials")
         materials = video.preprocess_video(
-            materials=params.video_materials, clip_duration=params.video_clip_duration
+            materials=params.video_materials,
+            clip_duration=params.video_clip_duration,
+            encoding_profile=params.encoding_profile,
         )
         if not materials:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -157,8 +182,64 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
         return downloaded_videos
 
 
+# rough characters of a paragraph of a generated script, and characters spoken per
+# second, to plan the work of a task before its script is known
+_PARAGRAPH_CHARS = 300
+_CHARS_PER_SECOND = 12
+
+
+def _planned_stages(params, stop_at: str):
+    """
+    The stages the task runs with their expected units of work (see progress.py), the
+    units are refined once the script and the audio are known.
+    """
+    chars = len((params.video_script or "").strip()) or _PARAGRAPH_CHARS * max(
+        1, params.paragraph_number or 1
+    )
+    audio_seconds = chars / _CHARS_PER_SECOND
+    stages = {"script": 1}
+    if params.video_source != "local":
+        stages["terms"] = 1
+    stages["audio"] = chars
+    stages["subtitle"] = audio_seconds if _transcribes(params) else 0
+    stages["materials"] = audio_seconds * getattr(params, "video_count", 1)
+    stages["render"] = _render_frames(params, audio_seconds)
+
+    planned = {}
+    for stage, units in stages.items():
+        planned[stage] = units
+        if stage == stop_at:
+            break
+    return planned
+
+
+def _transcribes(params) -> bool:
+    # the edge subtitles come with the audio, only whisper has work to report
+    provider = config.app.get("subtitle_provider", "").strip().lower()
+    return bool(getattr(params, "subtitle_enabled", True)) and provider == "whisper"
+
+
+def _render_frames(params, audio_duration: float) -> float:
+    # every video is encoded twice, combined and final
+    return 2 * getattr(params, "video_count", 1) * audio_duration * progress.RENDER_FPS
+
+
+def _inputs(params, *names, **extra):
+    """The values of the params a stage depends on, for its checkpoint."""
+    inputs = {name: getattr(params, name, None) for name in names}
+    inputs.update(extra)
+    return inputs
+
+
 def generate_final_videos(
-    task_id, params, downloaded_videos, audio_file, subtitle_path
+    task_id,
+    params,
+    downloaded_videos,
+    audio_file,
+    subtitle_path,
+    subtitle_items=None,
+    manifest: checkpoint.TaskManifest = None,
+    audio_duration: float = 0,
 ):
     final_video_paths = []
     combined_video_paths = []
@@ -167,61 +248,80 @@ def generate_final_videos(
     )
     video_transition_mode = params.video_transition_mode
 
-    _progress = 50
+    # the frames encoded by each render, for the task progress
+    frames = audio_duration * progress.RENDER_FPS
+    tracker = progress.current()
     for i in range(params.video_count):
+        cancellation.check()
         index = i + 1
         combined_video_path = path.join(
             utils.task_dir(task_id), f"combined-{index}.mp4"
         )
-        logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
-        try:
-            video.combine_videos(
-                combined_video_path=combined_video_path,
-                video_paths=downloaded_videos,
-                audio_file=audio_file,
-                video_aspect=params.video_aspect,
-                video_concat_mode=video_concat_mode,
-                video_transition_mode=video_transition_mode,
-                max_clip_duration=params.video_clip_duration,
-                min_clip_duration=1.5,  # Thêm tham số thời lượng tối thiểu 1.5 giây
-                threads=params.n_threads,
-            )
-        except Exception as e:
-            logger.error(f"Error combining videos: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            # Create an error file to indicate the error
-            with open(f"{combined_video_path}.error.txt", "w") as f:
-                f.write(f"Error: {str(e)}\n{traceback.format_exc()}")
-            # Update task state to failed
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-            return None, None
-
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+        combined_inputs = _inputs(
+            params,
+            "video_aspect",
+            "video_concat_mode",
+            "video_transition_mode",
+            "video_clip_duration",
+            "encoding_profile",
+            index=index,
+            materials=manifest.key("materials") if manifest else "",
+            audio=manifest.key("audio") if manifest else "",
+        )
+        if manifest and manifest.restore(f"combined-{index}", combined_inputs):
+            if tracker:
+                tracker.skip(frames)
+        else:
+            logger.info(f"\n\n## combining video: {index} => {combined_video_path}")
+            with progress.step(frames):
+                if not _combine_video(
+                    task_id,
+                    params,
+                    downloaded_videos,
+                    audio_file,
+                    combined_video_path,
+                    video_concat_mode,
+                    video_transition_mode,
+                ):
+                    return None, None
+            if manifest:
+                manifest.record(
+                    f"combined-{index}",
+                    combined_inputs,
+                    {"file": combined_video_path},
+                    files=[combined_video_path],
+                )
 
         final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
-
-        logger.info(f"\n\n## generating video: {index} => {final_video_path}")
-        try:
-            video.generate_video(
-                video_path=combined_video_path,
-                audio_path=audio_file,
-                subtitle_path=subtitle_path,
-                output_file=final_video_path,
-                params=params,
-            )
-        except Exception as e:
-            logger.error(f"Error generating final video: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            # Create an error file to indicate the error
-            with open(f"{final_video_path}.error.txt", "w") as f:
-                f.write(f"Error: {str(e)}\n{traceback.format_exc()}")
-            # Update task state to failed
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-            return None, None
-
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+        final_inputs = {
+            "params": params.model_dump(mode="json"),
+            "combined": manifest.key(f"combined-{index}") if manifest else "",
+            "audio": manifest.key("audio") if manifest else "",
+            "subtitle": manifest.key("subtitle") if manifest else "",
+        }
+        if manifest and manifest.restore(f"final-{index}", final_inputs):
+            if tracker:
+                tracker.skip(frames)
+        else:
+            logger.info(f"\n\n## generating video: {index} => {final_video_path}")
+            with progress.step(frames):
+                if not _generate_video(
+                    task_id,
+                    params,
+                    combined_video_path,
+                    audio_file,
+                    subtitle_path,
+                    subtitle_items,
+                    final_video_path,
+                ):
+                    return None, None
+            if manifest:
+                manifest.record(
+                    f"final-{index}",
+                    final_inputs,
+                    {"file": final_video_path},
+                    files=[final_video_path],
+                )
 
         final_video_paths.append(final_video_path)
         combined_video_paths.append(combined_video_path)
@@ -229,107 +329,306 @@ def generate_final_videos(
     return final_video_paths, combined_video_paths
 
 
+def _combine_video(
+    task_id,
+    params,
+    downloaded_videos,
+    audio_file,
+    combined_video_path,
+    video_concat_mode,
+    video_transition_mode,
+):
+    try:
+        video.combine_videos(
+            combined_video_path=combined_video_path,
+            video_paths=downloaded_videos,
+            audio_file=audio_file,
+            video_aspect=params.video_aspect,
+            video_concat_mode=video_concat_mode,
+            video_transition_mode=video_transition_mode,
+            max_clip_duration=params.video_clip_duration,
+            min_clip_duration=1.5,  # Thêm tham số thời lượng tối thiểu 1.5 giây
+            threads=params.n_threads,
+            encoding_profile=params.encoding_profile,
+        )
+    except Exception as e:
+        # a render interrupted by the cancellation is not an error
+        cancellation.check()
+        logger.error(f"Error combining videos: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        # Create an error file to indicate the error
+        with open(f"{combined_video_path}.error.txt", "w") as f:
+            f.write(f"Error: {str(e)}\n{traceback.format_exc()}")
+        # Update task state to failed
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        return False
+    return True
+
+
+def _generate_video(
+    task_id,
+    params,
+    combined_video_path,
+    audio_file,
+    subtitle_path,
+    subtitle_items,
+    final_video_path,
+):
+    try:
+        video.generate_video(
+            video_path=combined_video_path,
+            audio_path=audio_file,
+            subtitle_path=subtitle_path,
+            output_file=final_video_path,
+            params=params,
+            subtitle_items=subtitle_items,
+        )
+    except Exception as e:
+        # a render interrupted by the cancellation is not an error
+        cancellation.check()
+        logger.error(f"Error generating final video: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        # Create an error file to indicate the error
+        with open(f"{final_video_path}.error.txt", "w") as f:
+            f.write(f"Error: {str(e)}\n{traceback.format_exc()}")
+        # Update task state to failed
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        return False
+    return True
+
+
 def start(task_id, params: VideoParams, stop_at: str = "video"):
+    # the token is cancelled by the task manager, see cancellation.py
+    cancellation.activate(cancellation.token(task_id))
+    # the stages report their work to the tracker, see progress.py
+    progress.activate(
+        progress.ProgressTracker(task_id, _planned_stages(params, stop_at))
+    )
+    try:
+        return _run(task_id, params, stop_at)
+    except cancellation.TaskCancelled:
+        logger.warning(f"task {task_id} cancelled")
+        # a progress update may have raced with the cancellation, unless it was deleted
+        task = sm.state.get_task(task_id)
+        if task and task.get("state") != const.TASK_STATE_CANCELLED:
+            sm.state.update_task(
+                task_id,
+                state=const.TASK_STATE_CANCELLED,
+                progress=task.get("progress", 0),
+            )
+    finally:
+        progress.activate(None)
+        cancellation.activate(None)
+        cancellation.release(task_id)
+
+
+def _run(task_id, params: VideoParams, stop_at: str = "video"):
     logger.info(f"start task: {task_id}, stop_at: {stop_at}")
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=5)
+    tracker = progress.current()
 
     if type(params.video_concat_mode) is str:
         params.video_concat_mode = VideoConcatMode(params.video_concat_mode)
 
-    # 1. Generate script
-    video_script = generate_script(task_id, params)
-    if not video_script or "Error: " in video_script:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+    # the completed stages of a previous run of this task are skipped when their
+    # inputs are unchanged, see POST /tasks/{task_id}/retry
+    manifest = checkpoint.TaskManifest.open(task_id)
+    manifest.set_params(params.model_dump(mode="json"), stop_at)
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=10)
+    # 1. Generate script
+    cancellation.check()
+    tracker.begin("script")
+    script_inputs = _inputs(
+        params, "video_subject", "video_script", "video_language", "paragraph_number"
+    )
+    restored = manifest.restore("script", script_inputs)
+    if restored:
+        video_script = restored["script"]
+    else:
+        video_script = generate_script(task_id, params)
+        if not video_script or "Error: " in video_script:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
+        manifest.record("script", script_inputs, {"script": video_script})
+    tracker.end(restored=bool(restored))
+    tracker.set_units("audio", len(video_script))
 
     if stop_at == "script":
-        sm.state.update_task(
-            task_id, state=const.TASK_STATE_COMPLETE, progress=100, script=video_script
-        )
+        tracker.complete(script=video_script)
         return {"script": video_script}
 
     # 2. Generate terms
+    cancellation.check()
     video_terms = ""
     if params.video_source != "local":
-        video_terms = generate_terms(task_id, params, video_script)
-        if not video_terms:
-            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-            return
+        tracker.begin("terms")
+        terms_inputs = _inputs(
+            params,
+            "video_subject",
+            "video_terms",
+            "video_source",
+            script=manifest.key("script"),
+        )
+        restored = manifest.restore("terms", terms_inputs)
+        if restored:
+            video_terms = restored["terms"]
+        else:
+            video_terms = generate_terms(task_id, params, video_script)
+            if not video_terms:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+                return
+            manifest.record("terms", terms_inputs, {"terms": video_terms})
+        tracker.end(restored=bool(restored))
 
     save_script_data(task_id, video_script, video_terms, params)
 
     if stop_at == "terms":
-        sm.state.update_task(
-            task_id, state=const.TASK_STATE_COMPLETE, progress=100, terms=video_terms
-        )
+        tracker.complete(terms=video_terms)
         return {"script": video_script, "terms": video_terms}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=20)
-
     # 3. Generate audio
-    audio_file, audio_duration, sub_maker = generate_audio(
-        task_id, params, video_script
+    cancellation.check()
+    tracker.begin("audio")
+    audio_inputs = _inputs(
+        params, "voice_name", "voice_rate", script=manifest.key("script")
     )
-    if not audio_file:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=30)
+    def run_audio_stage():
+        audio_file, audio_duration, sub_maker = generate_audio(
+            task_id, params, video_script
+        )
+        if audio_file:
+            manifest.record(
+                "audio",
+                audio_inputs,
+                {"audio_file": audio_file, "audio_duration": audio_duration},
+                files=[audio_file],
+            )
+        return audio_file, audio_duration, sub_maker
+
+    restored = manifest.restore("audio", audio_inputs)
+    if restored:
+        audio_file, audio_duration = restored["audio_file"], restored["audio_duration"]
+        sub_maker = None
+    else:
+        audio_file, audio_duration, sub_maker = run_audio_stage()
+        if not audio_file:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
+    tracker.end(restored=bool(restored))
+
+    # the work of the next stages depends on the length of the audio
+    if _transcribes(params):
+        tracker.set_units("subtitle", audio_duration)
+    tracker.set_units("materials", audio_duration * params.video_count)
+    tracker.set_units("render", _render_frames(params, audio_duration))
 
     if stop_at == "audio":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            audio_file=audio_file,
-        )
+        tracker.complete(audio_file=audio_file)
         return {"audio_file": audio_file, "audio_duration": audio_duration}
 
     # 4. Generate subtitle
-    subtitle_path = generate_subtitle(
-        task_id, params, video_script, sub_maker, audio_file
+    cancellation.check()
+    tracker.begin("subtitle")
+    subtitle_provider = config.app.get("subtitle_provider", "").strip().lower()
+    subtitle_inputs = _inputs(
+        params,
+        "subtitle_enabled",
+        "whisper_model_size",
+        "whisper_beam_size",
+        "whisper_batch_size",
+        provider=subtitle_provider,
+        audio=manifest.key("audio"),
     )
+    restored = manifest.restore("subtitle", subtitle_inputs)
+    if restored:
+        # the items are loaded from the subtitle file when the video is generated
+        subtitle_path, subtitle_items = restored["subtitle_path"], None
+    else:
+        if sub_maker is None and params.subtitle_enabled and subtitle_provider == "edge":
+            # the word boundaries of a restored audio are not kept, they come with
+            # the synthesis only
+            audio_file, audio_duration, sub_maker = run_audio_stage()
+            if not audio_file:
+                sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+                return
+            subtitle_inputs["audio"] = manifest.key("audio")
+
+        subtitle_path, subtitle_items = generate_subtitle(
+            task_id, params, video_script, sub_maker, audio_file
+        )
+        if subtitle_path or not params.subtitle_enabled:
+            manifest.record(
+                "subtitle",
+                subtitle_inputs,
+                {"subtitle_path": subtitle_path},
+                files=[subtitle_path],
+            )
+    tracker.end(restored=bool(restored))
 
     if stop_at == "subtitle":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            subtitle_path=subtitle_path,
-        )
+        tracker.complete(subtitle_path=subtitle_path)
         return {"subtitle_path": subtitle_path}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
-
     # 5. Get video materials
-    downloaded_videos = get_video_materials(
-        task_id, params, video_terms, audio_duration
+    cancellation.check()
+    tracker.begin("materials")
+    materials_inputs = _inputs(
+        params,
+        "video_source",
+        "video_materials",
+        "video_aspect",
+        "video_concat_mode",
+        "video_clip_duration",
+        "video_count",
+        terms=manifest.key("terms"),
+        audio_duration=audio_duration,
+        # the local images are rendered to clips with the encoding profile
+        **(
+            {"encoding_profile": params.encoding_profile}
+            if params.video_source == "local"
+            else {}
+        ),
     )
-    if not downloaded_videos:
-        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
-        return
+    restored = manifest.restore("materials", materials_inputs)
+    if restored:
+        downloaded_videos = restored["materials"]
+    else:
+        downloaded_videos = get_video_materials(
+            task_id, params, video_terms, audio_duration
+        )
+        if not downloaded_videos:
+            sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+            return
+        manifest.record(
+            "materials",
+            materials_inputs,
+            {"materials": downloaded_videos},
+            files=downloaded_videos,
+        )
+    tracker.end(restored=bool(restored))
 
     if stop_at == "materials":
-        sm.state.update_task(
-            task_id,
-            state=const.TASK_STATE_COMPLETE,
-            progress=100,
-            materials=downloaded_videos,
-        )
+        tracker.complete(materials=downloaded_videos)
         return {"materials": downloaded_videos}
 
-    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
-
     # 6. Generate final videos
+    cancellation.check()
+    tracker.begin("render")
     final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
+        task_id,
+        params,
+        downloaded_videos,
+        audio_file,
+        subtitle_path,
+        subtitle_items,
+        manifest=manifest,
+        audio_duration=audio_duration,
     )
 
     if not final_video_paths:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
         return
+    tracker.end()
 
     logger.success(
         f"task {task_id} finished, generated {len(final_video_paths)} videos."
@@ -345,9 +644,7 @@ def start(task_id, params: VideoParams, stop_at: str = "video"):
         "subtitle_path": subtitle_path,
         "materials": downloaded_videos,
     }
-    sm.state.update_task(
-        task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs
-    )
+    tracker.complete(**kwargs)
     return kwargs
 
 
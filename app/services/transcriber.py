@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from typing import List
+from timeit import default_timer as timer
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+# Plain versions of the faster-whisper result types, they carry only what the subtitle
+# generation needs and can be stored in the transcription cache.
+Word = namedtuple("Word", ["start", "end", "word"])
+Segment = namedtuple("Segment", ["start", "end", "text", "words"])
+TranscriptionInfo = namedtuple("TranscriptionInfo", ["language", "language_probability"])
+
+
+def cache_dir():
+    return utils.storage_dir("cache_transcriptions", create=True)
+
+
+def _to_cache_data(segments, info):
+    return {
+        "info": {
+            "language": info.language,
+            "language_probability": info.language_probability,
+        },
+        "segments": [
+            {
+                "start": seg.start,
+                "end": seg.end,
+                "text": seg.text,
+                "words": [[w.start, w.end, w.word] for w in (seg.words or [])],
+            }
+            for seg in segments
+        ],
+    }
+
+
+def _from_cache_data(data):
+    segments = [
+        Segment(
+            start=seg["start"],
+            end=seg["end"],
+            text=seg["text"],
+            words=[Word(*w) for w in seg["words"]],
+        )
+        for seg in data["segments"]
+    ]
+    return segments, TranscriptionInfo(**data["info"])
+
+
+class WhisperService:
+    """
+    Owns the process-wide WhisperModel.
+
+    The model is loaded once, under a lock, either eagerly at startup (whisper.preload)
+    or by the first task that needs it; concurrent tasks wait for that load instead of
+    loading their own copy. faster-whisper can run `num_workers` transcriptions on one
+    model in parallel, the semaphore queues any task beyond that.
+    """
+
+    def __init__(
+        self,
+        model_size: str = "large-v3",
+        device: str = "cpu",
+        compute_type: str = "int8",
+        cpu_threads: int = 0,
+        num_workers: int = 1,
+    ):
+        self.model_size = model_size
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = max(0, int(cpu_threads))
+        self.num_workers = max(1, int(num_workers))
+
+        self._model = None
+        self._pipeline = None
+        self._load_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.num_workers)
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def model_path(self):
+        model_path = f"{utils.root_dir()}/models/whisper-{self.model_size}"
+        model_bin_file = f"{model_path}/model.bin"
+        if not os.path.isdir(model_path) or not os.path.isfile(model_bin_file):
+            model_path = self.model_size
+        return model_path
+
+    def load(self):
+        if self._model is not None:
+            return self._model
+
+        with self._load_lock:
+            if self._model is not None:
+                return self._model
+
+            from faster_whisper import WhisperModel
+
+            model_path = self.model_path()
+            logger.info(
+                f"loading model: {model_path}, device: {self.device}, compute_type: {self.compute_type}, "
+                f"cpu_threads: {self.cpu_threads}, num_workers: {self.num_workers}"
+            )
+            start = timer()
+            try:
+                self._model = WhisperModel(
+                    model_size_or_path=model_path,
+                    device=self.device,
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads,
+                    num_workers=self.num_workers,
+                )
+            except Exception as e:
+                logger.error(
+                    f"failed to load model: {e} \n\n"
+                    f"********************************************\n"
+                    f"this may be caused by network issue. \n"
+                    f"please download the model manually and put it in the 'models' folder. \n"
+                    f"see [README.md FAQ](https://github.com/harry0703/MoneyPrinterTurbo) for more details.\n"
+                    f"********************************************\n\n"
+                )
+                return None
+            logger.info(f"model loaded, elapsed: {timer() - start:.2f} s")
+            return self._model
+
+    def warm_up(self):
+        """Loads the model in the background, so the first task does not pay for it."""
+        return utils.run_in_background(self.load)
+
+    def _batched_pipeline(self, model):
+        if self._pipeline is None:
+            from faster_whisper import BatchedInferencePipeline
+
+            self._pipeline = BatchedInferencePipeline(model=model)
+        return self._pipeline
+
+    def cache_key(self, audio_file: str, batch_size: int = 0, **kwargs):
+        settings = {
+            "model_size": self.model_size,
+            "compute_type": self.compute_type,
+            "batch_size": batch_size,
+            **kwargs,
+        }
+        settings_hash = utils.md5(json.dumps(settings, sort_keys=True, default=str))
+        return f"{utils.md5_file(audio_file)}-{settings_hash}"
+
+    def transcribe(self, audio_file: str, batch_size: int = 0, **kwargs):
+        """
+        Transcribes the audio file on the shared model.
+
+        With batch_size > 0 the audio is split into chunks at the VAD silences and the
+        chunks are decoded in batches of `batch_size`, the segment timestamps are
+        shifted back to the position of their chunk in the audio.
+
+        Results are cached by the audio content and the transcription settings
+        (whisper.cache), a repeated transcription of the same audio is a file read
+        and does not load the model.
+
+        Returns (segments, info), or (None, None) if the model could not be loaded.
+        """
+        cache_file = ""
+        if config.whisper.get("cache", True):
+            key = self.cache_key(audio_file, batch_size=batch_size, **kwargs)
+            cache_file = os.path.join(cache_dir(), f"{key}.json")
+            if os.path.isfile(cache_file):
+                try:
+                    with open(cache_file, "r", encoding="utf-8") as f:
+                        segments, info = _from_cache_data(json.load(f))
+                    logger.info(f"transcription loaded from cache: {cache_file}")
+                    return segments, info
+                except Exception as e:
+                    logger.warning(f"invalid transcription cache: {cache_file} => {str(e)}")
+
+        segments, info = self._transcribe(audio_file, batch_size=batch_size, **kwargs)
+        if segments is None:
+            return None, None
+
+        data = _to_cache_data(segments, info)
+        if cache_file:
+            tmp_file = f"{cache_file}.{utils.get_uuid(True)}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_file, cache_file)
+        return _from_cache_data(data)
+
+    def _transcribe(self, audio_file: str, batch_size: int = 0, **kwargs):
+        model = self.load()
+        if model is None:
+            return None, None
+
+        wait_start = timer()
+        with self._slots:
+            waited = timer() - wait_start
+            if waited > 1:
+                logger.info(f"waited {waited:.2f} s for a free whisper worker")
+            if batch_size and batch_size > 0:
+                segments, info = self._batched_pipeline(model).transcribe(
+                    audio_file, batch_size=batch_size, **kwargs
+                )
+            else:
+                segments, info = model.transcribe(audio_file, **kwargs)
+            # segments is a generator, the actual decoding happens while iterating it,
+            # so it has to be consumed while holding the worker slot.
+            segments = list(segments)
+        return segments, info
+
+
+# model size => service, the least recently used first
+_services = OrderedDict()
+_services_lock = threading.Lock()
+
+
+def allowed_model_sizes() -> List[str]:
+    """The model sizes a request may ask for, whisper.allowed_model_sizes and the default."""
+    default = config.whisper.get("model_size", "large-v3")
+    return [default] + [
+        s for s in config.whisper.get("allowed_model_sizes", []) if s != default
+    ]
+
+
+def check_model_size(model_size: str):
+    """
+    Raises ValueError for a model size that is not allowed: any other value would be
+    downloaded from Hugging Face, or loaded from a path of the server.
+    """
+    if model_size and model_size not in allowed_model_sizes():
+        raise ValueError(
+            f"whisper model size not allowed: {model_size}, "
+            f"allowed: {', '.join(allowed_model_sizes())}"
+        )
+
+
+def get_service(model_size: str = "") -> WhisperService:
+    """
+    Returns the shared service of the model size, the configured whisper.model_size
+    by default. Each model size is loaded at most once per process, at most
+    whisper.max_loaded_models are kept: the least recently used one is dropped (its
+    memory is freed once the transcriptions running on it are done).
+    """
+    check_model_size(model_size)
+    model_size = model_size or config.whisper.get("model_size", "large-v3")
+    with _services_lock:
+        service = _services.get(model_size)
+        if service is None:
+            service = WhisperService(
+                model_size=model_size,
+                device=config.whisper.get("device", "cpu"),
+                compute_type=config.whisper.get("compute_type", "int8"),
+                cpu_threads=config.whisper.get("cpu_threads", 0),
+                num_workers=config.whisper.get("num_workers", 1),
+            )
+            _services[model_size] = service
+        _services.move_to_end(model_size)
+        max_models = max(1, int(config.whisper.get("max_loaded_models", 2)))
+        while len(_services) > max_models:
+            dropped, _ = _services.popitem(last=False)
+            logger.info(f"whisper model unloaded: {dropped}")
+    return service
@@ -0,0 +1,264 @@
+import contextlib
+import contextvars
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from loguru import logger
+
+from app.services import cancellation, encoding
+
+
+def ffmpeg_binary() -> str:
+    """The ffmpeg executable used by MoviePy, app.ffmpeg_path (IMAGEIO_FFMPEG_EXE) if set."""
+    exe = os.environ.get("IMAGEIO_FFMPEG_EXE", "")
+    if exe and os.path.isfile(exe):
+        return exe
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception as e:
+        logger.warning(f"imageio_ffmpeg not available, falling back to ffmpeg on PATH: {e}")
+        return "ffmpeg"
+
+
+_VIDEO_STREAM_PATTERN = re.compile(r"Stream #.*?Video:.*?,\s*(\d{2,5})x(\d{2,5})")
+_DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def probe(file: str, timeout: float = 30):
+    """
+    Reads the container header only (no decoding), returns (width, height, duration)
+    of the first video stream, or None if the file has no readable video stream.
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", file]
+    # without an output ffmpeg exits with an error after printing the header info
+    result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    stderr = result.stderr.decode("utf-8", errors="ignore")
+    match = _VIDEO_STREAM_PATTERN.search(stderr)
+    if not match:
+        return None
+    duration = 0.0
+    duration_match = _DURATION_PATTERN.search(stderr)
+    if duration_match:
+        h, m, s = duration_match.groups()
+        duration = int(h) * 3600 + int(m) * 60 + float(s)
+    return int(match.group(1)), int(match.group(2)), duration
+
+
+def run(args: List[str], timeout: float = None):
+    """
+    Runs ffmpeg with the given arguments, raises RuntimeError with its stderr tail on
+    failure. The process is killed if the current task is cancelled meanwhile.
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-nostdin", "-y", *args]
+    logger.debug(f"ffmpeg: {' '.join(cmd)}")
+    cancellation.check()
+    token = cancellation.current()
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        if token is not None:
+            token.register(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            if token is not None:
+                token.unregister(process)
+    cancellation.check()
+    if process.returncode != 0:
+        stderr = stderr.decode("utf-8", errors="ignore")
+        raise RuntimeError(f"ffmpeg failed ({process.returncode}): {stderr[-2000:]}")
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+@contextlib.contextmanager
+def watch_progress(callback: Optional[Callable[[int], None]], interval: float = 0.5):
+    """
+    Yields the arguments that make ffmpeg write its -progress report into a temp file,
+    a thread follows the file and passes the number of frames encoded so far to the
+    callback. Yields no arguments if there is no callback.
+    """
+    if callback is None:
+        yield []
+        return
+
+    fd, progress_file = tempfile.mkstemp(suffix=".progress")
+    os.close(fd)
+    stopped = threading.Event()
+
+    def follow():
+        pending = ""
+        with open(progress_file, "r", encoding="utf-8", errors="ignore") as f:
+            while True:
+                finished = stopped.wait(interval)
+                # ffmpeg truncates the file when it opens it
+                if f.tell() > os.path.getsize(progress_file):
+                    f.seek(0)
+                    pending = ""
+                *lines, pending = (pending + f.read()).split("\n")
+                frames = [line[6:] for line in lines if line.startswith("frame=")]
+                if frames and frames[-1].strip().isdigit():
+                    try:
+                        callback(int(frames[-1]))
+                    except Exception as e:
+                        logger.warning(f"ffmpeg progress callback error: {e}")
+                if finished:
+                    break
+
+    thread = threading.Thread(target=follow, daemon=True)
+    thread.start()
+    try:
+        yield ["-progress", progress_file]
+    finally:
+        stopped.set()
+        thread.join(timeout=5)
+        try:
+            os.remove(progress_file)
+        except OSError:
+            pass
+
+
+def encoder_args(threads: int = 2, profile: str = "") -> List[str]:
+    """The H.264 settings of the encoding profile, intermediate clips use the same ones."""
+    return encoding.get_profile(profile).video_args(threads)
+
+
+# Zoompan works on integer pixel offsets, the image is scaled up before zooming so
+# the slow zoom does not jitter
+_ZOOMPAN_OVERSAMPLE = 2
+
+
+def image_to_video(
+    image_file: str,
+    output_file: str,
+    size: Tuple[int, int],
+    duration: float,
+    fps: int = 30,
+    zoom_per_second: float = 0.03,
+    threads: int = 2,
+    profile: str = "",
+):
+    """
+    Renders a still image as a centered slow zoom-in (Ken Burns) clip with zoompan,
+    the zoom grows linearly from 1 to 1 + zoom_per_second * duration. The clip is
+    encoded with the settings of the encoding profile of the task.
+    """
+    # yuv420p needs even dimensions
+    width, height = size[0] // 2 * 2, size[1] // 2 * 2
+    frames = max(1, int(round(duration * fps)))
+    zoom_end = 1 + zoom_per_second * duration
+    vf = (
+        f"scale={width * _ZOOMPAN_OVERSAMPLE}:{height * _ZOOMPAN_OVERSAMPLE},"
+        f"zoompan=z='1+{zoom_end - 1:.6f}*on/{frames}'"
+        f":x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+        f":d={frames}:s={width}x{height}:fps={fps},"
+        f"format=yuv420p"
+    )
+    tmp_file = f"{output_file}.tmp.mp4"
+    run(
+        [
+            "-i",
+            image_file,
+            "-vf",
+            vf,
+            "-frames:v",
+            str(frames),
+            *encoder_args(threads, profile),
+            "-an",
+            tmp_file,
+        ]
+    )
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def images_to_videos(jobs: List[dict], max_workers: int = 2) -> List:
+    """
+    Runs image_to_video for a batch of images in parallel, each job is the keyword
+    arguments of one call. Returns the output file, or the exception, of every job.
+    """
+
+    def render(job):
+        try:
+            return image_to_video(**job)
+        except Exception as e:
+            return e
+
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # the jobs run in the context of the caller, i.e. with the cancellation
+        # token of its task
+        futures = [
+            executor.submit(contextvars.copy_context().run, render, job) for job in jobs
+        ]
+        return [future.result() for future in futures]
+
+
+def mix_audio(
+    video_file: str,
+    voice_file: str,
+    output_file: str,
+    duration: float,
+    voice_volume: float = 1.0,
+    bgm_file: str = "",
+    bgm_volume: float = 0.2,
+    bgm_fade_out: float = 3.0,
+    ducking: bool = False,
+    profile: str = "",
+):
+    """
+    Muxes the voice and the background music into a video, the video stream is copied.
+
+    The whole mix runs in one ffmpeg filter graph: the BGM input is looped by the
+    demuxer (-stream_loop), trimmed to the video duration and faded out, optionally
+    ducked under the voice with a sidechain compressor, then mixed with the voice.
+    The audio is streamed by ffmpeg, nothing is decoded into Python memory.
+    """
+    args = ["-i", video_file, "-i", voice_file]
+    filters = [f"[1:a]volume={voice_volume}[voice]"]
+    if bgm_file:
+        args += ["-stream_loop", "-1", "-i", bgm_file]
+        fade_start = max(0.0, duration - bgm_fade_out)
+        filters.append(
+            f"[2:a]volume={bgm_volume},atrim=0:{duration:.3f},asetpts=PTS-STARTPTS,"
+            f"afade=t=out:st={fade_start:.3f}:d={bgm_fade_out}[bgm]"
+        )
+        if ducking:
+            filters[0] = f"[1:a]volume={voice_volume},asplit=2[voice][voice_sc]"
+            filters.append(
+                "[bgm][voice_sc]sidechaincompress=threshold=0.05:ratio=8:attack=20:release=400[bgm_ducked]"
+            )
+            bgm_label = "bgm_ducked"
+        else:
+            bgm_label = "bgm"
+        # normalize=0 keeps the configured volumes, as the previous CompositeAudioClip did
+        filters.append(
+            f"[voice][{bgm_label}]amix=inputs=2:duration=longest:dropout_transition=0:normalize=0[aout]"
+        )
+    else:
+        filters[0] = f"[1:a]volume={voice_volume}[aout]"
+
+    args += [
+        "-filter_complex",
+        ";".join(filters),
+        "-map",
+        "0:v:0",
+        "-map",
+        "[aout]",
+        "-c:v",
+        "copy",
+        *encoding.get_profile(profile).audio_args(),
+        "-t",
+        f"{duration:.3f}",
+        output_file,
+    ]
+    return run(args)
@@ -0,0 +1,83 @@
+import bisect
+from typing import List, Optional, Tuple
+
+import numpy as np
+from moviepy import Clip, TextClip
+
+
+class SubtitleSprite:
+    """A rasterized subtitle line, with its color premultiplied by its alpha."""
+
+    __slots__ = ("rgb", "inv_alpha", "x", "y", "w", "h")
+
+    def __init__(self, rgb: np.ndarray, alpha: np.ndarray, x: int, y: int):
+        alpha = alpha.astype(np.float32)[..., None]
+        self.rgb = rgb.astype(np.float32) * alpha
+        self.inv_alpha = 1.0 - alpha
+        self.h, self.w = rgb.shape[:2]
+        self.x = int(x)
+        self.y = int(y)
+
+    @classmethod
+    def from_text_clip(cls, clip: TextClip, x: int, y: int):
+        rgb = clip.get_frame(0)
+        if clip.mask is not None:
+            alpha = clip.mask.get_frame(0)
+        else:
+            alpha = np.ones(rgb.shape[:2], dtype=np.float32)
+        return cls(rgb=rgb, alpha=alpha, x=x, y=y)
+
+
+class SubtitleCompositor:
+    """
+    Blends pre-rasterized subtitle sprites into the video frames.
+
+    The sprites are indexed by their start/end times; a frame only looks up the one
+    active sprite (the lookup of consecutive frames hits the cached position) and
+    blends it into the region it covers, instead of compositing one layer per
+    subtitle line on every frame.
+    """
+
+    def __init__(self, entries: List[Tuple[float, float, SubtitleSprite]]):
+        entries = sorted(entries, key=lambda e: e[0])
+        self._starts = [e[0] for e in entries]
+        self._ends = [e[1] for e in entries]
+        self._sprites = [e[2] for e in entries]
+        self._last = 0
+
+    def __len__(self):
+        return len(self._sprites)
+
+    def active(self, t: float) -> Optional[SubtitleSprite]:
+        i = self._last
+        if i < len(self._starts) and self._starts[i] <= t < self._ends[i]:
+            return self._sprites[i]
+        i = bisect.bisect_right(self._starts, t) - 1
+        if i >= 0 and t < self._ends[i]:
+            self._last = i
+            return self._sprites[i]
+        return None
+
+    def blend(self, frame: np.ndarray, t: float) -> np.ndarray:
+        sprite = self.active(t)
+        if sprite is None:
+            return frame
+
+        frame_h, frame_w = frame.shape[:2]
+        x0, y0 = max(sprite.x, 0), max(sprite.y, 0)
+        x1, y1 = min(sprite.x + sprite.w, frame_w), min(sprite.y + sprite.h, frame_h)
+        if x0 >= x1 or y0 >= y1:
+            return frame
+
+        sx0, sy0 = x0 - sprite.x, y0 - sprite.y
+        sx1, sy1 = sx0 + (x1 - x0), sy0 + (y1 - y0)
+
+        out = np.array(frame, copy=True)
+        region = out[y0:y1, x0:x1, :3].astype(np.float32)
+        region *= sprite.inv_alpha[sy0:sy1, sx0:sx1]
+        region += sprite.rgb[sy0:sy1, sx0:sx1, :3]
+        out[y0:y1, x0:x1, :3] = np.clip(region, 0, 255).astype(np.uint8)
+        return out
+
+    def apply(self, clip: Clip) -> Clip:
+        return clip.transform(lambda get_frame, t: self.blend(get_frame(t), t))
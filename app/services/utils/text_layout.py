@@ -0,0 +1,99 @@
+import functools
+import threading
+from typing import Dict, List, Tuple
+
+from PIL import ImageFont
+
+
+@functools.lru_cache(maxsize=32)
+def get_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, font_size)
+
+
+class TextLayout:
+    """
+    Greedy line breaking for one font and size.
+
+    The advance width of every word (or glyph, for text without spaces such as CJK)
+    is measured once and cached, a line is the sum of its cached widths, so wrapping
+    a subtitle is linear in its length.
+    """
+
+    def __init__(self, font_path: str, font_size: int):
+        self.font = get_font(font_path, int(font_size))
+        self._widths: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.space_width = self.width(" ")
+
+    def width(self, token: str) -> float:
+        w = self._widths.get(token)
+        if w is None:
+            w = self.font.getlength(token)
+            with self._lock:
+                self._widths[token] = w
+        return w
+
+    def line_height(self, text: str) -> int:
+        left, top, right, bottom = self.font.getbbox(text.strip() or " ")
+        return bottom - top
+
+    def _break(self, tokens: List[str], separator: str, max_width: float):
+        sep_width = self.space_width if separator else 0.0
+        lines, line, line_width = [], [], 0.0
+        for token in tokens:
+            w = self.width(token)
+            if line and line_width + sep_width + w > max_width:
+                lines.append(separator.join(line))
+                line, line_width = [], 0.0
+            if not line and w > max_width and separator:
+                # a single word is wider than the line, break by characters instead
+                return None
+            line_width += (sep_width if line else 0.0) + w
+            line.append(token)
+        if line:
+            lines.append(separator.join(line))
+        return lines
+
+    def wrap(self, text: str, max_width: float) -> Tuple[str, int]:
+        """
+        Returns the wrapped text and its height, words are kept whole unless a
+        single word does not fit on a line, then the text is broken by characters.
+        """
+        height = self.line_height(text)
+        words = [w for w in text.split(" ") if w]
+        if not words:
+            return text, height
+
+        total_width = sum(self.width(w) for w in words)
+        if total_width + self.space_width * (len(words) - 1) <= max_width:
+            return text, height
+
+        lines = self._break(words, " ", max_width)
+        if lines is None:
+            lines = self._break(list(text.strip()), "", max_width)
+        lines = [line.strip() for line in lines if line.strip()]
+        return "\n".join(lines), len(lines) * height
+
+
+_layouts: Dict[Tuple[str, int], TextLayout] = {}
+_layouts_lock = threading.Lock()
+
+
+def get_layout(font_path: str, font_size: int) -> TextLayout:
+    key = (font_path, int(font_size))
+    layout = _layouts.get(key)
+    if layout is None:
+        with _layouts_lock:
+            layout = _layouts.get(key)
+            if layout is None:
+                layout = TextLayout(font_path, font_size)
+                _layouts[key] = layout
+    return layout
+
+
+def wrap_lines(
+    texts: List[str], max_width: float, font_path: str, font_size: int
+) -> List[Tuple[str, int]]:
+    """Lays out all subtitle lines of a task with one font, returns (text, height) per line."""
+    layout = get_layout(font_path, font_size)
+    return [layout.wrap(text, max_width) for text in texts]
@@ -1,21 +1,95 @@
-from moviepy import Clip, vfx
+"""
+Clip transitions as ffmpeg filter expressions.
 
+The transitions are applied by the ffmpeg process that encodes the combined video
+(passed as -vf), so they cost no per-frame Python work. Each transition is active
+only in its own window of the timeline (timeline `enable`), the frames outside the
+windows pass through untouched:
 
-# FadeIn
-def fadein_transition(clip: Clip, t: float) -> Clip:
-    return clip.with_effects([vfx.FadeIn(t)])
+    fade_in:   the clip fades in from black during its first `duration` seconds
+    fade_out:  the clip fades out to black during its last `duration` seconds
+    slide_in:  the clip slides in from `side` over black during its first seconds
+    slide_out: the clip slides out towards `side` during its last seconds
+"""
 
+from collections import namedtuple
+from typing import List
 
-# FadeOut
-def fadeout_transition(clip: Clip, t: float) -> Clip:
-    return clip.with_effects([vfx.FadeOut(t)])
+FADE_IN = "fade_in"
+FADE_OUT = "fade_out"
+SLIDE_IN = "slide_in"
+SLIDE_OUT = "slide_out"
 
+SIDES = ["left", "right", "top", "bottom"]
 
-# SlideIn
-def slidein_transition(clip: Clip, t: float, side: str) -> Clip:
-    return clip.with_effects([vfx.SlideIn(t, side)])
+# start and duration of the clip in the combined video, in seconds
+Transition = namedtuple("Transition", ["effect", "start", "clip_duration", "side"])
 
 
-# SlideOut
-def slideout_transition(clip: Clip, t: float, side: str) -> Clip:
-    return clip.with_effects([vfx.SlideOut(t, side)])
+def _window(transition: Transition, duration: float):
+    duration = min(duration, transition.clip_duration)
+    if transition.effect in (FADE_IN, SLIDE_IN):
+        start = transition.start
+    else:
+        start = transition.start + transition.clip_duration - duration
+    return start, duration
+
+
+def _fade(transition: Transition, duration: float) -> str:
+    start, duration = _window(transition, duration)
+    kind = "in" if transition.effect == FADE_IN else "out"
+    return (
+        f"fade=t={kind}:st={start:.3f}:d={duration:.3f}"
+        f":enable='between(t,{start:.3f},{start + duration:.3f})'"
+    )
+
+
+def _slide_offset(transition: Transition, duration: float):
+    """Returns the (x, y) offset terms of one slide, zero outside of its window."""
+    start, duration = _window(transition, duration)
+    if transition.effect == SLIDE_IN:
+        # 1 when the slide starts, 0 when the clip is in place
+        progress = f"(1-(t-{start:.3f})/{duration:.3f})"
+    else:
+        # 0 when the slide starts, 1 when the clip has left
+        progress = f"((t-{start:.3f})/{duration:.3f})"
+    active = f"between(t,{start:.3f},{start + duration:.3f})"
+    side = transition.side
+    if side == "left":
+        return f"-{active}*W*{progress}", ""
+    if side == "right":
+        return f"{active}*W*{progress}", ""
+    if side == "top":
+        return "", f"-{active}*H*{progress}"
+    return "", f"{active}*H*{progress}"
+
+
+def transition_filter(transitions: List[Transition], duration: float = 1.0) -> str:
+    """
+    Builds one filter graph for all the transitions of the combined video, or an
+    empty string if there are none. The graph has a single input and output, so it
+    can be passed to the encoder as -vf.
+    """
+    fades = [_fade(t, duration) for t in transitions if t.effect in (FADE_IN, FADE_OUT)]
+    slides = [t for t in transitions if t.effect in (SLIDE_IN, SLIDE_OUT)]
+
+    if not slides:
+        return ",".join(fades)
+
+    xs, ys = [], []
+    for t in slides:
+        x, y = _slide_offset(t, duration)
+        if x:
+            xs.append(x)
+        if y:
+            ys.append(y)
+    # the windows of the slides never overlap, so the offsets simply add up
+    x = "+".join(xs) or "0"
+    y = "+".join(ys) or "0"
+
+    head = ",".join(fades + ["split"]) if fades else "split"
+    return (
+        f"[in]{head}[fg][bg];"
+        f"[bg]drawbox=c=black:t=fill[black];"
+        f"[black][fg]overlay=x='{x}':y='{y}':eval=frame[out]"
+    )
@@ -2,27 +2,24 @@ import glob
 import os
 import random
 import traceback
-import subprocess
 import gc
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
 from typing import List
 
 import psutil
 from loguru import logger
+from PIL import Image
 from moviepy import (
     AudioFileClip,
     ColorClip,
-    CompositeAudioClip,
     CompositeVideoClip,
-    ImageClip,
     TextClip,
     VideoFileClip,
-    afx,
     concatenate_videoclips,
 )
-from moviepy.video.tools.subtitles import SubtitlesClip
-from PIL import ImageFont
 
-from app.models import const
+from app.models import const, srt
 from app.models.schema import (
     MaterialInfo,
     VideoAspect,
@@ -30,7 +27,9 @@ from app.models.schema import (
     VideoParams,
     VideoTransitionMode,
 )
-from app.services.utils import video_effects
+from app.services import bgm_library, cancellation, encoding, progress
+from app.services.utils import ffmpeg, text_layout, video_effects
+from app.services.utils.subtitle_compositor import SubtitleCompositor, SubtitleSprite
 from app.utils import utils
 from app.config import config
 
@@ -40,24 +39,28 @@ def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
         return ""
 
     if bgm_file and os.path.exists(bgm_file):
-        return bgm_file
+        return bgm_library.get_library().resolve(bgm_file)
 
     if bgm_type == "random":
+        bgm_file = bgm_library.get_library().random_file()
+        if bgm_file:
+            return bgm_file
+
+        # the library is not indexed yet, pick one of the original songs
         suffix = "*.mp3"
         song_dir = utils.song_dir()
         files = glob.glob(os.path.join(song_dir, suffix))
-        return random.choice(files)
+        return random.choice(files) if files else ""
 
     return ""
 
 
-def kill_ffmpeg_processes():
+def kill_ffmpeg_processes(*files):
+    """Kills the ffmpeg processes left writing the files, those of other tasks keep running."""
     try:
-        if os.name == 'nt':  # Windows
-            subprocess.run(['taskkill', '/F', '/IM', 'ffmpeg.exe'], capture_output=True)
-        else:  # Linux/Mac
-            subprocess.run(['pkill', 'ffmpeg'], capture_output=True)
-        logger.info("Killed all remaining ffmpeg processes")
+        killed = cancellation.kill_child_processes(files)
+        if killed:
+            logger.info(f"Killed {killed} remaining ffmpeg processes")
     except Exception as e:
         logger.error(f"Error killing ffmpeg processes: {str(e)}")
 
@@ -72,6 +75,7 @@ def combine_videos(
     max_clip_duration: int = 5,
     min_clip_duration: float = 1.5,  # Thêm tham số thời lượng tối thiểu
     threads: int = 2,
+    encoding_profile: str = "",
 ) -> str:
     audio_clip = AudioFileClip(audio_file)
     audio_duration = audio_clip.duration
@@ -92,10 +96,12 @@ def combine_videos(
     logger.info(f"Initial memory usage: {psutil.Process().memory_info().rss / 1024 / 1024:.2f} MB")
 
     clips = []
+    transitions = []
     video_duration = 0
 
     raw_clips = []
     for video_path in video_paths:
+        cancellation.check()
         try:
             # Check if file exists
             if not os.path.exists(video_path):
@@ -166,6 +172,7 @@ def combine_videos(
             # Kiểm tra nếu đã đủ thời lượng
             if video_duration >= audio_duration:
                 break
+            cancellation.check()
 
             try:
                 # Tạo bản sao của clip để tránh thay đổi clip gốc
@@ -247,28 +254,25 @@ def combine_videos(
                     f"resizing video to {video_width} x {video_height}, clip size: {clip_w} x {clip_h}"
                 )
 
-            shuffle_side = random.choice(["left", "right", "top", "bottom"])
-            logger.info(f"Using transition mode: {video_transition_mode}")
-            if video_transition_mode.value == VideoTransitionMode.none.value:
-                # Không cần thay đổi
-                pass
-            elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                current_clip = video_effects.fadein_transition(current_clip, 1)
+            # the transition is applied by the encoder, see video_effects
+            effect = None
+            if video_transition_mode.value == VideoTransitionMode.fade_in.value:
+                effect = video_effects.FADE_IN
             elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                current_clip = video_effects.fadeout_transition(current_clip, 1)
+                effect = video_effects.FADE_OUT
             elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-                current_clip = video_effects.slidein_transition(current_clip, 1, shuffle_side)
+                effect = video_effects.SLIDE_IN
             elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-                current_clip = video_effects.slideout_transition(current_clip, 1, shuffle_side)
+                effect = video_effects.SLIDE_OUT
             elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-                transition_funcs = [
-                    lambda c: video_effects.fadein_transition(c, 1),
-                    lambda c: video_effects.fadeout_transition(c, 1),
-                    lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                    lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                ]
-                shuffle_transition = random.choice(transition_funcs)
-                current_clip = shuffle_transition(current_clip)
+                effect = random.choice(
+                    [
+                        video_effects.FADE_IN,
+                        video_effects.FADE_OUT,
+                        video_effects.SLIDE_IN,
+                        video_effects.SLIDE_OUT,
+                    ]
+                )
 
             # Kiểm tra thời lượng tối đa một lần nữa (sau khi áp dụng hiệu ứng)
             if current_clip.duration > max_clip_duration:
@@ -276,6 +280,15 @@ def combine_videos(
 
             try:
                 # Add clip to list and update duration
+                if effect and current_clip.duration > 0:
+                    transitions.append(
+                        video_effects.Transition(
+                            effect=effect,
+                            start=video_duration,
+                            clip_duration=current_clip.duration,
+                            side=random.choice(video_effects.SIDES),
+                        )
+                    )
                 clips.append(current_clip)
                 video_duration += current_clip.duration
 
@@ -307,19 +320,15 @@ def combine_videos(
             logger.warning(f"Skipping empty batch at index {i}")
             continue
 
-        # Wrap each clip in a CompositeVideoClip to ensure consistent format
+        # All clips have the video size and no effects applied, they are
+        # concatenated as they are, without an extra composite layer
         wrapped_batch = []
         for clip in batch:
-            try:
-                # Check if clip is valid
-                if hasattr(clip, 'duration') and clip.duration > 0:
-                    wrapped_clip = CompositeVideoClip([clip])
-                    wrapped_batch.append(wrapped_clip)
-                else:
-                    logger.warning(f"Skipping invalid clip with no duration")
-            except Exception as e:
-                logger.error(f"Error wrapping clip in CompositeVideoClip: {str(e)}")
-                # Skip this clip
+            # Check if clip is valid
+            if hasattr(clip, 'duration') and clip.duration > 0:
+                wrapped_batch.append(clip)
+            else:
+                logger.warning(f"Skipping invalid clip with no duration")
 
         # Update batch with wrapped clips
         batch = wrapped_batch
@@ -435,19 +444,26 @@ def combine_videos(
         ffmpeg_threads = config.app.get("ffmpeg_threads_per_process", threads)
         logger.info(f"Using {ffmpeg_threads} threads for FFMPEG")
 
-        # Write the video file with optimized settings
-        video_clip.write_videofile(
-            filename=combined_video_path,
-            threads=ffmpeg_threads,
-            logger=None,
-            temp_audiofile_path=output_dir,
-            audio_codec="aac",
-            codec="libx264",  # Explicitly set video codec
-            fps=30,
-            bitrate="2000k",  # Lower bitrate
-            preset="ultrafast",  # Faster encoding
-            ffmpeg_params=["-crf", "28"]  # Lower quality for smaller file size
-        )
+        profile = encoding.get_profile(encoding_profile)
+        logger.info(f"encoding profile: {profile}")
+        encoder_kwargs = profile.moviepy_kwargs(threads=ffmpeg_threads)
+        transition_filter = video_effects.transition_filter(transitions)
+        if transition_filter:
+            logger.info(f"applying {len(transitions)} transitions in the encoder")
+            encoder_kwargs["ffmpeg_params"] += ["-vf", transition_filter]
+
+        # Write the video file with the settings of the encoding profile, the frames
+        # encoded by ffmpeg are reported to the progress of the task
+        with ffmpeg.watch_progress(progress.reporter()) as progress_args:
+            encoder_kwargs["ffmpeg_params"] += progress_args
+            video_clip.write_videofile(
+                filename=combined_video_path,
+                logger=None,
+                temp_audiofile_path=output_dir,
+                audio_codec="aac",
+                fps=30,
+                **encoder_kwargs,
+            )
 
         # Log success and file size
         if os.path.exists(combined_video_path):
@@ -469,67 +485,13 @@ def combine_videos(
             logger.info("Video clip closed successfully")
         except Exception as e:
             logger.error(f"Error closing video clip: {str(e)}")
-        kill_ffmpeg_processes()
+        kill_ffmpeg_processes(combined_video_path)
     logger.success("Video generation completed")
     return combined_video_path
 
 
 def wrap_text(text, max_width, font="Arial", fontsize=60):
-    # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
-
-    def get_text_size(inner_text):
-        inner_text = inner_text.strip()
-        left, top, right, bottom = font.getbbox(inner_text)
-        return right - left, bottom - top
-
-    width, height = get_text_size(text)
-    if width <= max_width:
-        return text, height
-
-    # logger.warning(f"wrapping text, max_width: {max_width}, text_width: {width}, text: {text}")
-
-    processed = True
-
-    _wrapped_lines_ = []
-    words = text.split(" ")
-    _txt_ = ""
-    for word in words:
-        _before = _txt_
-        _txt_ += f"{word} "
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            if _txt_.strip() == word.strip():
-                processed = False
-                break
-            _wrapped_lines_.append(_before)
-            _txt_ = f"{word} "
-    _wrapped_lines_.append(_txt_)
-    if processed:
-        _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
-        result = "\n".join(_wrapped_lines_).strip()
-        height = len(_wrapped_lines_) * height
-        # logger.warning(f"wrapped text: {result}")
-        return result, height
-
-    _wrapped_lines_ = []
-    chars = list(text)
-    _txt_ = ""
-    for word in chars:
-        _txt_ += word
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
-            continue
-        else:
-            _wrapped_lines_.append(_txt_)
-            _txt_ = ""
-    _wrapped_lines_.append(_txt_)
-    result = "\n".join(_wrapped_lines_).strip()
-    height = len(_wrapped_lines_) * height
-    # logger.warning(f"wrapped text: {result}")
-    return result, height
+    return text_layout.get_layout(font, fontsize).wrap(text, max_width)
 
 
 def generate_video(
@@ -538,6 +500,7 @@ def generate_video(
     subtitle_path: str,
     output_file: str,
     params: VideoParams,
+    subtitle_items: List[srt.SubtitleItem] = None,
 ):
     aspect = VideoAspect(params.video_aspect)
     video_width, video_height = aspect.to_resolution()
@@ -563,14 +526,31 @@ def generate_video(
 
         logger.info(f"using font: {font_path}")
 
-    def create_text_clip(subtitle_item):
+    sprites = {}
+
+    def subtitle_y(h: int) -> int:
+        if params.subtitle_position == "bottom":
+            return int(video_height * 0.95 - h)
+        elif params.subtitle_position == "top":
+            return int(video_height * 0.05)
+        elif params.subtitle_position == "custom":
+            # Ensure the subtitle is fully within the screen bounds
+            margin = 10  # Additional margin, in pixels
+            max_y = video_height - h - margin
+            min_y = margin
+            custom_y = (video_height - h) * (params.custom_position / 100)
+            # Constrain the y value within the valid range
+            return int(max(min_y, min(custom_y, max_y)))
+        else:  # center
+            return int((video_height - h) / 2)
+
+    def create_subtitle_sprite(wrapped_txt: str) -> SubtitleSprite:
+        # every distinct line is rasterized once, repeated lines share the sprite
+        sprite = sprites.get(wrapped_txt)
+        if sprite is not None:
+            return sprite
         params.font_size = int(params.font_size)
         params.stroke_width = int(params.stroke_width)
-        phrase = subtitle_item[1]
-        max_width = video_width * 0.9
-        wrapped_txt, txt_height = wrap_text(
-            phrase, max_width=max_width, font=font_path, fontsize=params.font_size
-        )
         _clip = TextClip(
             text=wrapped_txt,
             font=font_path,
@@ -580,27 +560,12 @@ def generate_video(
             stroke_color=params.stroke_color,
             stroke_width=params.stroke_width,
         )
-        duration = subtitle_item[0][1] - subtitle_item[0][0]
-        _clip = _clip.with_start(subtitle_item[0][0])
-        _clip = _clip.with_end(subtitle_item[0][1])
-        _clip = _clip.with_duration(duration)
-        if params.subtitle_position == "bottom":
-            _clip = _clip.with_position(("center", video_height * 0.95 - _clip.h))
-        elif params.subtitle_position == "top":
-            _clip = _clip.with_position(("center", video_height * 0.05))
-        elif params.subtitle_position == "custom":
-            # Ensure the subtitle is fully within the screen bounds
-            margin = 10  # Additional margin, in pixels
-            max_y = video_height - _clip.h - margin
-            min_y = margin
-            custom_y = (video_height - _clip.h) * (params.custom_position / 100)
-            custom_y = max(
-                min_y, min(custom_y, max_y)
-            )  # Constrain the y value within the valid range
-            _clip = _clip.with_position(("center", custom_y))
-        else:  # center
-            _clip = _clip.with_position(("center", "center"))
-        return _clip
+        sprite = SubtitleSprite.from_text_clip(
+            _clip, x=int((video_width - _clip.w) / 2), y=subtitle_y(_clip.h)
+        )
+        _clip.close()
+        sprites[wrapped_txt] = sprite
+        return sprite
 
     # Load the video clip with moderate resolution to balance quality and memory usage
     file_size_mb = os.path.getsize(video_path) / (1024 * 1024)
@@ -626,42 +591,27 @@ def generate_video(
     if clip_w != video_width or clip_h != video_height:
         logger.info(f"Resizing final video from {clip_w}x{clip_h} to {video_width}x{video_height}")
         video_clip = video_clip.resized((video_width, video_height))
-    audio_clip = AudioFileClip(audio_path).with_effects(
-        [afx.MultiplyVolume(params.voice_volume)]
-    )
 
-    def make_textclip(text):
-        return TextClip(
-            text=text,
-            font=font_path,
-            font_size=params.font_size,
-        )
+    if subtitle_items is None and subtitle_path and os.path.exists(subtitle_path):
+        subtitle_items = srt.load(subtitle_path)
 
-    if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(
-            subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
+    if subtitle_items:
+        wrapped_lines = text_layout.wrap_lines(
+            [item.text for item in subtitle_items],
+            max_width=video_width * 0.9,
+            font_path=font_path,
+            font_size=int(params.font_size),
         )
-        text_clips = []
-        for item in sub.subtitles:
-            clip = create_text_clip(subtitle_item=item)
-            text_clips.append(clip)
-        video_clip = CompositeVideoClip([video_clip, *text_clips])
-
-    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
-    if bgm_file:
-        try:
-            bgm_clip = AudioFileClip(bgm_file).with_effects(
-                [
-                    afx.MultiplyVolume(params.bgm_volume),
-                    afx.AudioFadeOut(3),
-                    afx.AudioLoop(duration=video_clip.duration),
-                ]
-            )
-            audio_clip = CompositeAudioClip([audio_clip, bgm_clip])
-        except Exception as e:
-            logger.error(f"failed to add bgm: {str(e)}")
+        entries = []
+        for item, (wrapped_txt, _) in zip(subtitle_items, wrapped_lines):
+            sprite = create_subtitle_sprite(wrapped_txt)
+            entries.append((item.start, item.end, sprite))
+        logger.info(
+            f"rasterized {len(sprites)} subtitle sprites for {len(entries)} subtitles"
+        )
+        video_clip = SubtitleCompositor(entries).apply(video_clip)
 
-    video_clip = video_clip.with_audio(audio_clip)
+    silent_file = os.path.join(output_dir, f"silent-{os.path.basename(output_file)}")
     try:
         # Log memory usage and video clip info
         logger.info(f"Memory usage before writing final video: {psutil.Process().memory_info().rss / 1024 / 1024:.2f} MB")
@@ -673,19 +623,49 @@ def generate_video(
         ffmpeg_threads = config.app.get("ffmpeg_threads_per_process", params.n_threads or 2)
         logger.info(f"Using {ffmpeg_threads} threads for FFMPEG in final video")
 
-        # Write the video file with optimized settings
-        video_clip.write_videofile(
-            output_file,
-            audio_codec="aac",
-            codec="libx264",  # Explicitly set video codec
-            temp_audiofile_path=output_dir,
-            threads=ffmpeg_threads,
-            logger=None,
-            fps=30,
-            bitrate="2000k",  # Lower bitrate
-            preset="ultrafast",  # Faster encoding
-            ffmpeg_params=["-crf", "28"]  # Lower quality for smaller file size
-        )
+        # Write the video stream only, the audio is mixed by ffmpeg afterwards
+        profile = encoding.get_profile(params.encoding_profile)
+        logger.info(f"encoding profile: {profile}")
+        encoder_kwargs = profile.moviepy_kwargs(threads=ffmpeg_threads)
+        with ffmpeg.watch_progress(progress.reporter()) as progress_args:
+            encoder_kwargs["ffmpeg_params"] += progress_args
+            video_clip.write_videofile(
+                silent_file,
+                audio=False,
+                logger=None,
+                fps=30,
+                **encoder_kwargs,
+            )
+
+        bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+        logger.info(f"mixing audio, voice: {audio_path}, bgm: {bgm_file}")
+        try:
+            ffmpeg.mix_audio(
+                video_file=silent_file,
+                voice_file=audio_path,
+                output_file=output_file,
+                duration=video_clip.duration,
+                voice_volume=params.voice_volume,
+                bgm_file=bgm_file,
+                bgm_volume=params.bgm_volume,
+                ducking=config.app.get("bgm_ducking", False),
+                profile=profile.name,
+            )
+        except Exception as e:
+            if not bgm_file:
+                raise
+            logger.error(f"failed to add bgm: {str(e)}")
+            ffmpeg.mix_audio(
+                video_file=silent_file,
+                voice_file=audio_path,
+                output_file=output_file,
+                duration=video_clip.duration,
+                voice_volume=params.voice_volume,
+                profile=profile.name,
+            )
+        finally:
+            if os.path.exists(silent_file):
+                os.remove(silent_file)
 
         # Log success and file size
         if os.path.exists(output_file):
@@ -708,81 +688,107 @@ def generate_video(
             logger.info("Final video clip closed and deleted successfully")
         except Exception as e:
             logger.error(f"Error closing final video clip: {str(e)}")
-        kill_ffmpeg_processes()
+        kill_ffmpeg_processes(output_file, silent_file)
     logger.success("Final video generation completed")
 
 
-def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
-    """Preprocess video materials to ensure they are in the correct format and duration."""
+def render_images(image_jobs, clip_duration=4, encoding_profile: str = ""):
+    """
+    Turns the images into slow zoom-in clips, all images are rendered in parallel by
+    ffmpeg (zoompan) with the encoding profile of the final video. Returns the ids of
+    the materials that could not be rendered.
+    """
+    # the clips are scaled to the final video later on, there is no point in
+    # encoding them larger than the largest output resolution
+    max_side = 1920
+    ffmpeg_threads = config.app.get("ffmpeg_threads_per_process", 2)
+    max_workers = config.app.get("max_concurrent_ffmpeg", os.cpu_count() or 2)
+    jobs = []
+    for material, width, height in image_jobs:
+        scale = min(1.0, max_side / max(width, height))
+        jobs.append(
+            {
+                "image_file": material.url,
+                "output_file": f"{material.url}.mp4",
+                "size": (int(width * scale), int(height * scale)),
+                "duration": clip_duration,
+                "threads": ffmpeg_threads,
+                "profile": encoding_profile,
+            }
+        )
+
+    logger.info(f"processing {len(jobs)} images, workers: {max_workers}")
+    start = timer()
+    results = ffmpeg.images_to_videos(jobs, max_workers=max_workers)
+    cancellation.check()
+    failed = set()
+    for (material, _, _), result in zip(image_jobs, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to process image {material.url}: {str(result)}")
+            failed.add(id(material))
+            continue
+        material.url = result
+        logger.success(f"completed: {result}")
+    logger.info(f"images processed, elapsed: {timer() - start:.2f} s")
+    return failed
+
+
+def probe_material(material: MaterialInfo):
+    """
+    Validates a local material from its header only, returns (material, is_image,
+    width, height), or None if the material is unreadable or smaller than 480px.
+    """
+    if not material.url:
+        return None
+
+    ext = os.path.splitext(material.url)[1].lower().lstrip(".")
+    is_image = ext in const.FILE_TYPE_IMAGES
     try:
-        for material in materials:
-            if not material.url:
-                continue
+        if is_image:
+            # PIL reads the size from the header, the pixels are not decoded
+            with Image.open(material.url) as img:
+                width, height = img.size
+        else:
+            info = ffmpeg.probe(material.url)
+            if info is None:
+                logger.warning(f"no video stream found: {material.url}")
+                return None
+            width, height, _ = info
+    except Exception as e:
+        logger.warning(f"Failed to load material {material.url}: {str(e)}")
+        return None
 
-            ext = os.path.splitext(material.url)[1].lower()
-            try:
-                # First try to load as video if it's a video format
-                if ext in ['.mov', '.mp4', '.avi', '.mkv', '.flv']:
-                    try:
-                        clip = VideoFileClip(material.url)
-                        # Check video dimensions
-                        width = clip.size[0]
-                        height = clip.size[1]
-                        if width < 480 or height < 480:
-                            logger.warning(f"video is too small, width: {width}, height: {height}")
-                            clip.close()
-                            continue
-                        # If it's a valid video, close it and continue
-                        clip.close()
-                        continue
-                    except Exception as e:
-                        logger.warning(f"Failed to load video clip {material.url}: {str(e)}")
-                        continue
-                else:
-                    try:
-                        clip = ImageClip(material.url)
-                    except Exception as e:
-                        logger.warning(f"Failed to load image clip {material.url}: {str(e)}")
-                        continue
-
-                width = clip.size[0]
-                height = clip.size[1]
-                if width < 480 or height < 480:
-                    logger.warning(f"video is too small, width: {width}, height: {height}")
-                    clip.close()
-                    continue
-
-                if ext in const.FILE_TYPE_IMAGES:
-                    logger.info(f"processing image: {material.url}")
-                    # Create an image clip and set its duration to 3 seconds
-                    clip = (
-                        ImageClip(material.url)
-                        .with_duration(clip_duration)
-                        .with_position("center")
-                    )
-                    # Apply zoom effect
-                    zoom_clip = clip.resized(
-                        lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
-                    )
+    if width < 480 or height < 480:
+        logger.warning(f"video is too small, width: {width}, height: {height}, file: {material.url}")
+        return None
+    return material, is_image, width, height
 
-                    final_clip = CompositeVideoClip([zoom_clip])
 
-                    video_file = f"{material.url}.mp4"
-                    # Get threads from config
-                    ffmpeg_threads = config.app.get("ffmpeg_threads_per_process", 2)
+def preprocess_video(
+    materials: List[MaterialInfo], clip_duration=4, encoding_profile: str = ""
+):
+    """
+    Preprocess video materials to ensure they are in the correct format and duration.
+
+    The materials are validated in parallel, the images are then rendered to clips
+    with the encoding profile. Only the valid materials are returned, in their
+    original order.
+    """
+    max_workers = config.app.get("max_concurrent_ffmpeg", os.cpu_count() or 2)
+    start = timer()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        probes = [p for p in executor.map(probe_material, materials) if p]
+    logger.info(
+        f"validated {len(materials)} materials, {len(probes)} valid, elapsed: {timer() - start:.2f} s"
+    )
 
-                    # Write video file with thread limit
-                    final_clip.write_videofile(video_file, fps=30, logger=None, threads=ffmpeg_threads)
-                    final_clip.close()
-                    del final_clip
-                    material.url = video_file
-                    logger.success(f"completed: {video_file}")
-            except Exception as e:
-                logger.warning(f"Failed to process material {material.url}: {str(e)}")
-                continue
-    finally:
-        kill_ffmpeg_processes()
-    return materials
+    image_jobs = [(m, w, h) for m, is_image, w, h in probes if is_image]
+    failed = (
+        render_images(image_jobs, clip_duration, encoding_profile)
+        if image_jobs
+        else set()
+    )
+    return [m for m, _, _, _ in probes if id(m) not in failed]
 
 
 if __name__ == "__main__":
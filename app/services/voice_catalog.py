@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.utils import utils
+
+PROVIDER_AZURE_V1 = "azure_v1"
+PROVIDER_AZURE_V2 = "azure_v2"
+PROVIDER_OPENAI = "openai"
+PROVIDER_OPENAI_FM = "openai_fm"
+
+# Prefixes used by the provider-specific voice names, e.g. "openai-alloy-Male"
+_PROVIDER_PREFIXES = {
+    PROVIDER_OPENAI: "openai-",
+    PROVIDER_OPENAI_FM: "openai_fm-",
+}
+
+
+def catalog_file():
+    return utils.resource_dir("voices/voices.json")
+
+
+class VoiceCatalog:
+    """
+    In-memory index over the voice catalog file (resource/voices/voices.json).
+
+    Every voice is indexed by its full name ("zh-CN-XiaoxiaoNeural-Female") and
+    its short name ("zh-CN-XiaoxiaoNeural"), and grouped by locale, language,
+    gender and provider, so lookups and filters never rescan the whole list.
+    """
+
+    def __init__(self, voices: List[Dict], etag: str = ""):
+        self.voices = sorted(voices, key=lambda v: v["name"])
+        self.etag = etag
+
+        self._by_name: Dict[str, Dict] = {}
+        self._by_locale: Dict[str, List[Dict]] = {}
+        self._by_language: Dict[str, List[Dict]] = {}
+        self._by_gender: Dict[str, List[Dict]] = {}
+        self._by_provider: Dict[str, List[Dict]] = {}
+
+        for v in self.voices:
+            self._by_name[v["name"]] = v
+            self._by_name.setdefault(v["short_name"], v)
+            locale = v["locale"].lower()
+            self._by_locale.setdefault(locale, []).append(v)
+            self._by_language.setdefault(locale.split("-")[0], []).append(v)
+            self._by_gender.setdefault(v["gender"].lower(), []).append(v)
+            self._by_provider.setdefault(v["provider"], []).append(v)
+
+    @classmethod
+    def load(cls, file_path: str = ""):
+        file_path = file_path or catalog_file()
+        with open(file_path, "rb") as f:
+            content = f.read()
+        data = json.loads(content.decode("utf-8"))
+        etag = hashlib.md5(content).hexdigest()
+        logger.info(f"voice catalog loaded: {file_path}, voices: {len(data['voices'])}")
+        return cls(voices=data["voices"], etag=etag)
+
+    def __len__(self):
+        return len(self.voices)
+
+    def get(self, name: str) -> Optional[Dict]:
+        if not name:
+            return None
+        return self._by_name.get(name.strip())
+
+    def _match_locale(self, filter_locale: str) -> List[Dict]:
+        fl = filter_locale.strip().lower()
+        if not fl:
+            return []
+        language = fl.split("-")[0]
+        if fl == language:
+            # "en" => every en-* voice, plus the language-wide voices (locale "en")
+            return self._by_language.get(language, [])
+
+        matched = self._by_locale.get(fl, [])
+        if language in self._by_locale:
+            # language-wide voices are usable for every region of the language
+            matched = matched + self._by_locale[language]
+        if matched:
+            return matched
+
+        # not a known locale, e.g. "zh-CN-liaoning", fall back to a prefix match
+        return [
+            v
+            for v in self._by_language.get(language, [])
+            if v["short_name"].lower().startswith(fl)
+        ]
+
+    def filter(
+        self,
+        locales: Optional[List[str]] = None,
+        gender: str = "",
+        provider: str = "",
+    ) -> List[Dict]:
+        candidates = None
+        if locales:
+            seen = {}
+            for fl in locales:
+                for v in self._match_locale(fl):
+                    seen[v["name"]] = v
+            candidates = list(seen.values())
+
+        for key, index in ((gender.lower(), self._by_gender), (provider, self._by_provider)):
+            if not key:
+                continue
+            group = index.get(key, [])
+            if candidates is None:
+                candidates = group
+            else:
+                names = {v["name"] for v in group}
+                candidates = [v for v in candidates if v["name"] in names]
+
+        if candidates is None:
+            return list(self.voices)
+        return sorted(candidates, key=lambda v: v["name"])
+
+    def names(self, locales: Optional[List[str]] = None, **kwargs) -> List[str]:
+        return [v["name"] for v in self.filter(locales=locales, **kwargs)]
+
+    def provider_voice(self, name: str, provider: str) -> str:
+        """
+        Returns the provider-native voice id for the given voice name, or an empty string
+        if the voice does not belong to the provider.
+        """
+        v = self.get(name)
+        if not v or v["provider"] != provider:
+            return ""
+        short_name = v["short_name"]
+        if provider == PROVIDER_AZURE_V2:
+            return short_name[: -len("-V2")]
+        prefix = _PROVIDER_PREFIXES.get(provider, "")
+        return short_name[len(prefix) :]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> VoiceCatalog:
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                if os.path.isfile(catalog_file()):
+                    _catalog = VoiceCatalog.load()
+                else:
+                    logger.warning(f"voice catalog not found: {catalog_file()}")
+                    _catalog = VoiceCatalog(voices=[])
+    return _catalog
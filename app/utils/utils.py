@@ -203,6 +203,16 @@ def md5(text):
     return hashlib.md5(text.encode("utf-8")).hexdigest()
 
 
+def md5_file(file_path, chunk_size=1024 * 1024):
+    import hashlib
+
+    h = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def get_system_locale():
     try:
         loc = locale.getdefaultlocale()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the encoding profiles (app/services/encoding.py): encode speed and
+output size of every profile on the same input.
+
+Without an input file, a 5 s 1080x1920 test pattern with film grain is generated,
+which compresses about as hard as stock footage.
+
+    python benchmarks/encoding_profiles.py [input.mp4] [--threads 2]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+# Add the root directory of the project to the system path to allow importing modules from the project
+root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from app.services import encoding  # noqa: E402
+from app.services.utils import ffmpeg  # noqa: E402
+
+FPS = 30
+
+
+def make_source(output_file: str, duration: int = 5):
+    ffmpeg.run(
+        [
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc2=size=1080x1920:rate={FPS}",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:sample_rate=44100",
+            "-vf",
+            "noise=alls=8:allf=t+u",
+            "-t",
+            str(duration),
+            "-c:v",
+            "libx264",
+            "-crf",
+            "10",
+            "-preset",
+            "ultrafast",
+            "-c:a",
+            "aac",
+            output_file,
+        ]
+    )
+
+
+def bench(profile: encoding.EncodingProfile, source: str, output_file: str, threads: int):
+    start = timer()
+    ffmpeg.run(
+        [
+            "-i",
+            source,
+            "-r",
+            str(FPS),
+            *profile.video_args(threads),
+            *profile.audio_args(),
+            output_file,
+        ]
+    )
+    elapsed = timer() - start
+    _, _, duration = ffmpeg.probe(output_file)
+    fps = duration * FPS / elapsed
+    size_mb = os.path.getsize(output_file) / 1024 / 1024
+    kbps = os.path.getsize(output_file) * 8 / 1000 / duration
+    print(
+        f"  {profile.name:<10} {profile.preset:<10} {elapsed:7.2f} s  {fps:7.1f} fps  "
+        f"{size_mb:7.2f} MB  {kbps:7.0f} kb/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="?", default="")
+    parser.add_argument("--threads", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = args.input
+        if not source:
+            source = os.path.join(tmp_dir, "source.mp4")
+            make_source(source)
+        print(f"input: {source}, threads: {args.threads}")
+        for name in encoding.profiles():
+            profile = encoding.get_profile(name)
+            bench(profile, source, os.path.join(tmp_dir, f"{name}.mp4"), args.threads)
@@ -0,0 +1,186 @@
+"""
+Benchmark of the task state updates and reads of RedisState (one round trip, JSON
+values) against the previous implementation (one HSET per field, values written
+with str() and read back with ast.literal_eval), and of the task listing (the task
+index) against the previous SCAN of the keyspace.
+
+Runs against fakeredis, every round trip to the server is delayed by --rtt-ms to
+stand in for the network, or against a real server with --url.
+
+    python benchmarks/redis_state.py
+    python benchmarks/redis_state.py --rtt-ms 0.5 --rounds 500
+    python benchmarks/redis_state.py --url redis://localhost:6379/15
+"""
+
+import argparse
+import ast
+import os
+import sys
+import time
+from timeit import default_timer as timer
+
+# Add the root directory of the project to the system path to allow importing modules from the project
+root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+import redis  # noqa: E402
+
+from app.services.state import RedisState  # noqa: E402
+
+round_trips = [0]
+
+
+def fake_client(rtt_ms: float):
+    import fakeredis
+
+    class Connection(fakeredis.FakeRedisConnection):
+        def send_packed_command(self, command, check_health=True):
+            round_trips[0] += 1
+            if rtt_ms:
+                time.sleep(rtt_ms / 1000)
+            return super().send_packed_command(command, check_health)
+
+    pool = redis.ConnectionPool(
+        connection_class=Connection, server=fakeredis.FakeServer()
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def legacy_update(client, task_id, state=4, progress=0, **kwargs):
+    fields = {"task_id": task_id, "state": state, "progress": progress, **kwargs}
+    for field, value in fields.items():
+        client.hset(task_id, field, str(value))
+
+
+def legacy_get(client, task_id):
+    def convert(value):
+        value_str = value.decode("utf-8")
+        try:
+            return ast.literal_eval(value_str)
+        except (ValueError, SyntaxError):
+            pass
+        if value_str.isdigit():
+            return int(value_str)
+        return value_str
+
+    task_data = client.hgetall(task_id)
+    return {k.decode("utf-8"): convert(v) for k, v in task_data.items()}
+
+
+def legacy_list(client, page, page_size):
+    start = (page - 1) * page_size
+    end = start + page_size
+    tasks = []
+    cursor = 0
+    total = 0
+    while True:
+        cursor, keys = client.scan(cursor, count=page_size)
+        total += len(keys)
+        if total > start:
+            for key in keys[max(0, start - total):end - total]:
+                tasks.append(legacy_get(client, key))
+                if len(tasks) >= page_size:
+                    break
+        if cursor == 0 or len(tasks) >= page_size:
+            break
+    return tasks, total
+
+
+def progress_update(i: int):
+    """A progress update of a render, with the stage timings (7 fields)."""
+    return dict(
+        progress=50 + i % 50,
+        stage="render",
+        eta=120 - i % 120,
+        stages={
+            "script": {"elapsed": 3.2, "units": 1, "unit": "request"},
+            "audio": {"elapsed": 8.1, "units": 812, "unit": "char"},
+            "materials": {"elapsed": 41.7, "units": 67.5, "unit": "second", "bytes": 91234567},
+            "render": {"elapsed": 12.0, "units": 4050, "done": i % 4050, "unit": "frame"},
+        },
+        audio_duration=67.5,
+    )
+
+
+def complete_update(materials: int):
+    """The update of a completed task, with its script and files."""
+    task_dir = "/app/storage/tasks/3f0c1b7e-6a4d-4c55-9a51-0d1f9e2b7c11"
+    return dict(
+        progress=100,
+        videos=[f"{task_dir}/final-{i}.mp4" for i in range(1, 3)],
+        combined_videos=[f"{task_dir}/combined-{i}.mp4" for i in range(1, 3)],
+        script="The meaning of life is a question as old as people themselves. " * 12,
+        terms=["life meaning", "philosophy", "sunrise", "family", "nature"],
+        audio_file=f"{task_dir}/audio.mp3",
+        subtitle_path=f"{task_dir}/subtitle.srt",
+        materials=[f"/app/storage/cache_videos/vid-{i:032x}.mp4" for i in range(materials)],
+    )
+
+
+def bench(name, func, rounds):
+    round_trips[0] = 0
+    start = timer()
+    for i in range(rounds):
+        func(i)
+    elapsed = timer() - start
+    print(
+        f"  {name:<20} {elapsed / rounds * 1000:8.3f} ms/op, "
+        f"{round_trips[0] / rounds:5.1f} round trips/op"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="", help="a real redis server to run against")
+    parser.add_argument("--rtt-ms", type=float, default=0.2, help="simulated round trip")
+    parser.add_argument("--rounds", type=int, default=300)
+    parser.add_argument("--tasks", type=int, default=2000, help="tasks of the listing")
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(args.url) if args.url else fake_client(args.rtt_ms)
+    state = RedisState(client=client)
+    print(
+        f"server: {args.url or f'fakeredis, {args.rtt_ms} ms per round trip'}, "
+        f"rounds: {args.rounds}"
+    )
+
+    for label, update in [
+        ("progress update, 7 fields", progress_update),
+        ("complete update, 40 materials", lambda i: complete_update(40)),
+        ("complete update, 400 materials", lambda i: complete_update(400)),
+    ]:
+        print(label)
+        bench("legacy update", lambda i: legacy_update(client, "bench-legacy", **update(i)), args.rounds)
+        bench("update", lambda i: state.update_task("bench-json", **update(i)), args.rounds)
+        bench("legacy read", lambda i: legacy_get(client, "bench-legacy"), args.rounds)
+        bench("read", lambda i: state.get_task("bench-json"), args.rounds)
+        # both decode to the same task
+        legacy_task = legacy_get(client, "bench-legacy")
+        legacy_task["task_id"] = "bench-json"
+        assert legacy_task == state.get_task("bench-json")
+
+    client.delete("bench-legacy", "bench-json")
+
+    print(f"listing, {args.tasks} tasks, 20 per page")
+    # the legacy listing scans every key, it gets a database of its own without the
+    # keys of the index
+    legacy_client = fake_client(args.rtt_ms) if not args.url else client
+    task_ids = [f"bench-task-{i:06d}" for i in range(args.tasks)]
+    for task_id in task_ids:
+        fields = dict(state=1, progress=100, videos=[f"{task_id}.mp4"])
+        state.update_task(task_id, **fields)
+        if not args.url:
+            legacy_update(legacy_client, task_id, **fields)
+    # indexes the tasks written before the index existed, once
+    state.get_all_tasks(1, 1)
+    pages = max(1, args.tasks // 20)
+    rounds = max(1, args.rounds // 10)
+    if not args.url:
+        bench("legacy first page", lambda i: legacy_list(legacy_client, 1, 20), rounds)
+        bench("legacy last page", lambda i: legacy_list(legacy_client, pages, 20), rounds)
+    bench("first page", lambda i: state.get_all_tasks(1, 20), rounds)
+    bench("last page", lambda i: state.get_all_tasks(pages, 20), rounds)
+    bench("last page of state", lambda i: state.get_all_tasks(pages, 20, state=1), rounds)
+    for task_id in task_ids:
+        state.delete_task(task_id)
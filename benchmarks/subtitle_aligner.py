@@ -0,0 +1,117 @@
+"""
+Benchmark of the whisper subtitle correction: the banded global aligner
+(subtitle.align_subtitles) against the previous greedy Levenshtein merging.
+
+The recognized subtitles are simulated from the script: lines are merged or split
+differently than in the script and some words are misrecognized, the timing error
+is measured against the true line timings.
+
+    python benchmarks/subtitle_aligner.py
+"""
+
+import os
+import random
+import sys
+from timeit import default_timer as timer
+
+# Add the root directory of the project to the system path to allow importing modules from the project
+root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from app.models import srt  # noqa: E402
+from app.services import subtitle  # noqa: E402
+
+WORDS = {
+    "en": "money time life people world family work story health travel dream".split(),
+    "vi": "tiền thời gian cuộc sống con người thế giới gia đình công việc".split(),
+    "zh": list("静夜思是唐代诗人李白创作的一首五言古诗这首描绘了在寂静晚看到窗前明月不禁想起远方家乡和亲"),
+}
+
+
+def build_case(language: str, lines_count: int, words_per_line: int, seed: int = 1):
+    rnd = random.Random(seed)
+    joiner = "" if language == "zh" else " "
+    script_lines, truth, words = [], [], []
+    t = 0.0
+    for _ in range(lines_count):
+        line_words = [rnd.choice(WORDS[language]) for _ in range(words_per_line)]
+        script_lines.append(joiner.join(line_words))
+        start = t
+        for w in line_words:
+            # misrecognized words
+            recognized = w if rnd.random() > 0.05 else rnd.choice(WORDS[language])
+            words.append((recognized, t, t + 0.3))
+            t += 0.35
+        truth.append((start, t - 0.05))
+        t += 0.3
+
+    # recognized segments do not follow the script lines
+    items = []
+    k = 0
+    while k < len(words):
+        size = rnd.randint(words_per_line // 2, words_per_line * 2)
+        chunk = words[k : k + size]
+        text = joiner.join(w for w, _, _ in chunk)
+        items.append(srt.SubtitleItem(chunk[0][1], chunk[-1][2], text))
+        k += size
+    return script_lines, items, truth
+
+
+def legacy_correct(script_lines, subtitle_items):
+    new_items = []
+    script_index = 0
+    subtitle_index = 0
+    while script_index < len(script_lines) and subtitle_index < len(subtitle_items):
+        script_line = script_lines[script_index].strip()
+        start_time, end_time, subtitle_line = subtitle_items[subtitle_index]
+        if script_line == subtitle_line:
+            new_items.append((start_time, end_time, script_line))
+            script_index += 1
+            subtitle_index += 1
+            continue
+        combined = subtitle_line
+        next_index = subtitle_index + 1
+        while next_index < len(subtitle_items):
+            next_subtitle = subtitle_items[next_index].text.strip()
+            if subtitle.similarity(
+                script_line, combined + " " + next_subtitle
+            ) > subtitle.similarity(script_line, combined):
+                combined += " " + next_subtitle
+                end_time = subtitle_items[next_index].end
+                next_index += 1
+            else:
+                break
+        new_items.append((start_time, end_time, script_line))
+        script_index += 1
+        subtitle_index = next_index
+    while script_index < len(script_lines):
+        new_items.append((0.0, 0.0, script_lines[script_index]))
+        script_index += 1
+    return new_items
+
+
+def timing_error(results, truth):
+    errors = [abs(r[0] - t[0]) + abs(r[1] - t[1]) for r, t in zip(results, truth)]
+    return sum(errors) / len(errors) / 2
+
+
+def bench(name, func, script_lines, items, truth):
+    start = timer()
+    results = func(script_lines, items)
+    elapsed = timer() - start
+    print(
+        f"  {name:<8} {elapsed * 1000:10.2f} ms, mean timing error: {timing_error(results, truth):7.2f} s"
+    )
+
+
+if __name__ == "__main__":
+    print(f"C-backed edit distance: {subtitle._rf_levenshtein is not None}")
+    for language in ["en", "vi", "zh"]:
+        for lines_count, words_per_line in [(40, 12), (150, 16)]:
+            script_lines, items, truth = build_case(language, lines_count, words_per_line)
+            print(
+                f"{language}: {len(script_lines)} script lines, {len(items)} subtitle items"
+            )
+            bench("greedy", legacy_correct, script_lines, items, truth)
+            bench("aligned", subtitle.align_subtitles, script_lines, items, truth)
@@ -0,0 +1,113 @@
+"""
+Benchmark of the edge subtitle line matcher (voice.match_subtitle_lines) against the
+previous implementation that re-normalized the growing line on every word boundary.
+
+    python benchmarks/subtitle_matcher.py
+"""
+
+import os
+import random
+import re
+import sys
+from timeit import default_timer as timer
+
+# Add the root directory of the project to the system path to allow importing modules from the project
+root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from app.services import voice  # noqa: E402
+from app.utils import utils  # noqa: E402
+
+EN_WORDS = "money time life people world family work story health travel dream".split()
+VI_WORDS = "tiền thời gian cuộc sống con người thế giới gia đình công việc".split()
+ZH_CHARS = "静夜思是唐代诗人李白创作的一首五言古诗这首描绘了在寂静晚看到窗前明月不禁想起远方家乡和亲"
+
+
+def build_script(language: str, sentences: int, words_per_sentence: int) -> str:
+    rnd = random.Random(sentences)
+    lines = []
+    for _ in range(sentences):
+        if language == "zh":
+            line = "".join(rnd.choice(ZH_CHARS) for _ in range(words_per_sentence))
+            lines.append(line + "，")
+        else:
+            pool = EN_WORDS if language == "en" else VI_WORDS
+            line = " ".join(rnd.choice(pool) for _ in range(words_per_sentence))
+            lines.append(line + ", ")
+    return "".join(lines)
+
+
+def build_word_boundaries(script: str, language: str, mismatch_every: int = 0):
+    if language == "zh":
+        text = re.sub(r"\W+", "", script)
+        words = [text[i : i + 2] for i in range(0, len(text), 2)]
+    else:
+        words = re.findall(r"\w+", script)
+    boundaries = []
+    offset = 0
+    for i, word in enumerate(words):
+        if mismatch_every and i % mismatch_every == mismatch_every - 1:
+            word = "uh"
+        boundaries.append(((offset, offset + 2_000_000), word))
+        offset += 2_500_000
+    return boundaries
+
+
+def legacy_match(script_lines, word_boundaries):
+    items = []
+    sub_index = 0
+    sub_line = ""
+    start_time = -1.0
+
+    def match_line(_sub_line, _sub_index):
+        if len(script_lines) <= _sub_index:
+            return ""
+        _line = script_lines[_sub_index]
+        if _sub_line == _line:
+            return _line.strip()
+        if re.sub(r"[^\w\s]", "", _sub_line) == re.sub(r"[^\w\s]", "", _line):
+            return _line.strip()
+        if re.sub(r"\W+", "", _sub_line) == re.sub(r"\W+", "", _line):
+            return _line.strip()
+        return ""
+
+    for (_start_time, end_time), sub in word_boundaries:
+        if start_time < 0:
+            start_time = _start_time
+        sub_line += sub
+        sub_text = match_line(sub_line, sub_index)
+        if sub_text:
+            sub_index += 1
+            items.append((start_time, end_time, sub_text))
+            start_time = -1.0
+            sub_line = ""
+    return items
+
+
+def bench(name, func, script_lines, boundaries, rounds=3):
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = timer()
+        result = func(script_lines, boundaries)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(
+        f"  {name:<8} {best * 1000:9.2f} ms, matched lines: {len(result)}/{len(script_lines)}"
+    )
+
+
+if __name__ == "__main__":
+    for language in ["en", "vi", "zh"]:
+        for sentences, words in [(50, 20), (200, 60)]:
+            for mismatch_every in [0, 97]:
+                script = build_script(language, sentences, words)
+                script_lines = utils.split_string_by_punctuations(script)
+                boundaries = build_word_boundaries(script, language, mismatch_every)
+                print(
+                    f"{language}: {len(script_lines)} lines, {len(boundaries)} words, "
+                    f"mismatch every {mismatch_every or '-'} words"
+                )
+                bench("legacy", legacy_match, script_lines, boundaries)
+                bench("linear", voice.match_subtitle_lines, script_lines, boundaries)
@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import unittest
+
+# add project root to python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from app.controllers.manager import scheduler
+from app.controllers.manager.redis_manager import (
+    ReliableQueue,
+    deserialize_task,
+    serialize_task,
+)
+from app.models.schema import AudioRequest, SubtitleRequest, VideoParams
+from app.services import task as tm
+
+
+def new_task(params):
+    return {
+        "func": tm.start,
+        "args": (),
+        "kwargs": {"task_id": "task-1", "params": params, "stop_at": "audio"},
+        "schedule": scheduler.new_schedule(),
+    }
+
+
+class TestTaskSerialization(unittest.TestCase):
+    def round_trip(self, params):
+        # the payload of the queue is JSON
+        data = json.loads(json.dumps(serialize_task(new_task(params))))
+        return deserialize_task(data)
+
+    def test_audio_task(self):
+        params = AudioRequest(video_script="hello world", voice_rate=1.5)
+        task_info = self.round_trip(params)
+        self.assertIs(task_info["func"], tm.start)
+        self.assertIsInstance(task_info["kwargs"]["params"], AudioRequest)
+        self.assertEqual(task_info["kwargs"]["params"], params)
+        self.assertEqual(task_info["kwargs"]["stop_at"], "audio")
+
+    def test_subtitle_task(self):
+        params = SubtitleRequest(video_script="hello world", whisper_beam_size=3)
+        task_info = self.round_trip(params)
+        self.assertIsInstance(task_info["kwargs"]["params"], SubtitleRequest)
+        self.assertEqual(task_info["kwargs"]["params"], params)
+
+    def test_video_task(self):
+        params = VideoParams(video_subject="the sea", video_count=2)
+        task_info = self.round_trip(params)
+        self.assertIsInstance(task_info["kwargs"]["params"], VideoParams)
+        self.assertEqual(task_info["kwargs"]["params"], params)
+
+    def test_task_of_a_previous_version(self):
+        # queued without the name of the params model
+        data = serialize_task(new_task(VideoParams(video_subject="the sea")))
+        del data["params_model"]
+        task_info = deserialize_task(json.loads(json.dumps(data)))
+        self.assertIsInstance(task_info["kwargs"]["params"], VideoParams)
+
+    def test_unknown_params_model(self):
+        data = serialize_task(new_task(AudioRequest(video_script="hello")))
+        data["params_model"] = "HttpException"
+        with self.assertRaises(ValueError):
+            deserialize_task(data)
+
+    def test_reliable_queue(self):
+        try:
+            import fakeredis
+        except ImportError:
+            self.skipTest("fakeredis is not installed")
+        queue = ReliableQueue(fakeredis.FakeRedis(), "test_queue")
+        params = AudioRequest(video_script="hello world")
+        queue.push(serialize_task(new_task(params)))
+        payload, data = queue.pop()
+        task_info = deserialize_task(data)
+        queue.ack(payload)
+        self.assertIsInstance(task_info["kwargs"]["params"], AudioRequest)
+        self.assertEqual(task_info["kwargs"]["params"], params)
+        self.assertEqual(len(queue), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+import argparse
+
+from loguru import logger
+
+from app.config import config
+from app.controllers.manager.redis_worker import RedisWorker
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the queued video tasks")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.app.get("redis_worker_concurrency", 1),
+        help="number of tasks run in parallel by this worker",
+    )
+    args = parser.parse_args()
+
+    logger.info(f"start worker, redis: {config.app.get('redis_host', 'localhost')}")
+    RedisWorker(
+        concurrency=args.concurrency,
+        max_attempts=config.app.get("redis_task_max_attempts", 3),
+    ).run()